@@ -23,6 +23,9 @@ SITE_SPS_PKG_PATH:
     Caminhio para os pacotes SPS XML gerados a partir da estrutura do Site antigo do SciELO
 INCOMPLETE_SPS_PKG_PATH:
     pacotes de XML validados e nomeados de acordo com SPS, mas com ativos digitais faltantes
+STAGING_SPS_PKG_PATH:
+    pacotes em montagem, publicados em SPS_PKG_PATH ou INCOMPLETE_SPS_PKG_PATH
+    ao final do empacotamento (deve estar no mesmo sistema de arquivos)
 ERRORS_PATH:
     arquivos de erros
 """
@@ -38,7 +41,12 @@ _default = dict(
     XML_ERRORS_PATH=os.path.join(BASE_PATH, "xml/xml_errors"),
     SPS_PKG_PATH=os.path.join(BASE_PATH, "xml/sps_packages"),
     SITE_SPS_PKG_PATH=os.path.join(BASE_PATH, "xml/site_sps_packages"),
+    SITE_SPS_PKG_FINGERPRINTS_FILE=os.path.join(
+        BASE_PATH, "xml/site_sps_packages_fingerprints.db"
+    ),
+    SITE_INDEX_FILE=os.path.join(BASE_PATH, "xml/site_index.db"),
     INCOMPLETE_SPS_PKG_PATH=os.path.join(BASE_PATH, "xml/incomplete_sps_packages"),
+    STAGING_SPS_PKG_PATH=os.path.join(BASE_PATH, "xml/staging_sps_packages"),
     LOGGER_PATH=os.path.join(BASE_PATH, ""),
     GENERATOR_PATH=os.path.join(BASE_PATH, "xml/html"),
     CONSTRUCTOR_PATH=os.path.join(BASE_PATH, "xml/constructor"),
@@ -48,11 +56,48 @@ _default = dict(
     VALIDATE_ALL="FALSE",
     THREADPOOL_MAX_WORKERS=os.cpu_count() * 5,
     PROCESSPOOL_MAX_WORKERS=os.cpu_count(),
+    # Envios simultâneos ao object storage durante a importação. Cada envio
+    # pode manter em memória um arquivo de até MINIO_SINGLE_READ_MAX_MB, por
+    # processo de importação (ex: 16 envios x 16 MB = 256 MB por processo)
+    UPLOAD_MAX_WORKERS=16,
+    # Documentos, periódicos e fascículos gravados por lote no Kernel (0 grava
+    # um a um)
+    KERNEL_BULK_WRITE_SIZE=500,
+    # Intervalo em segundos entre as sincronizações em disco dos arquivos de
+    # resultado dos comandos
+    RESULT_FLUSH_INTERVAL=5,
+    # thread ou process
+    PACKING_EXECUTOR="thread",
+    IMPORT_EXECUTOR="thread",
+    PACKING_ASSET_THREADS=4,
+    DIRECTORY_INDEX_MAXSIZE=10000,
+    # copy, hardlink ou reflink
+    ASSET_MATERIALIZATION_MODE="copy",
+    # Pasta do armazenamento de ativos endereçado por SHA-1 (desabilitado se vazio)
+    ASSET_STORE_DIR="",
+    # Cache das imagens otimizadas para a WEB (desabilitado se vazio)
+    OPTIMISED_ASSET_CACHE_DIR="",
+    # Tamanho máximo do cache de imagens otimizadas em MB (0 para ilimitado)
+    OPTIMISED_ASSET_CACHE_MAX_MB=10240,
     PID_DATABASE_DSN="sqlite:///pid_manager_database.db",
     MONGO_MAX_IDLE_TIME_MS=20000,
     MONGO_SOCKET_TIMEOUT_MS=20000,
     MONGO_CONNECT_TIMEOUT_MS=20000,
     MINIO_TIMEOUT=20000,
+    # Cache SQLite dos objetos já registrados no Min.io (desabilitado se vazio)
+    MINIO_KNOWN_OBJECTS_FILE="",
+    # Objetos maiores que MINIO_MULTIPART_THRESHOLD_MB são enviados em partes de
+    # MINIO_PART_SIZE_MB (mínimo de 5)
+    MINIO_MULTIPART_THRESHOLD_MB=64,
+    MINIO_PART_SIZE_MB=16,
+    # Arquivos até este tamanho são lidos uma única vez para o cálculo da soma
+    # SHA-1 e o envio; os maiores são lidos duas vezes do disco, sem mantê-los
+    # em memória
+    MINIO_SINGLE_READ_MAX_MB=16,
+    # Object storage em pasta local, utilizado no lugar do Min.io se definido
+    LOCAL_OBJECT_STORAGE_DIR="",
+    LOCAL_OBJECT_STORAGE_URL="",
+    LOCAL_OBJECT_STORAGE_FSYNC_BATCH=0,
 
     # DATABASE_CONNECT_ARGS must be a JSON String
     DATABASE_CONNECT_ARGS='{"connect_timeout": 20000}',
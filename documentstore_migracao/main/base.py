@@ -1,6 +1,8 @@
 import argparse
 import pkg_resources
 
+from documentstore_migracao import config
+
 
 def base_parser(args):
     """ Parser com parametros basico da execução do app """
@@ -35,14 +37,13 @@ def minio_parser(args):
     parser = argparse.ArgumentParser(add_help=False)
     parser.add_argument(
         "--minio_host",
-        required=True,
         help="""Host to connect to Min.io ObjectStorage, e.g: "play.min.io:9000" """,
     )
     parser.add_argument(
-        "--minio_access_key", required=True, help="Access key to Min.io, e.g: minion"
+        "--minio_access_key", help="Access key to Min.io, e.g: minion"
     )
     parser.add_argument(
-        "--minio_secret_key", required=True, help="Secure key to Min.io, e.g: minion123"
+        "--minio_secret_key", help="Secure key to Min.io, e.g: minion123"
     )
     parser.add_argument(
         "--minio_is_secure",
@@ -50,6 +51,41 @@ def minio_parser(args):
         help="if connection wich to Min.io is secure, default False",
         action="store_true",
     )
+    parser.add_argument(
+        "--minio_known_objects",
+        default=config.get("MINIO_KNOWN_OBJECTS_FILE") or None,
+        help="SQLite file caching the objects already registered in Min.io, "
+        "which are not uploaded again",
+    )
+    parser.add_argument(
+        "--minio_multipart_threshold_mb",
+        type=int,
+        default=int(config.get("MINIO_MULTIPART_THRESHOLD_MB")),
+        help="Objects bigger than this size (MB) are uploaded in parts",
+    )
+    parser.add_argument(
+        "--minio_part_size_mb",
+        type=int,
+        default=int(config.get("MINIO_PART_SIZE_MB")),
+        help="Size (MB) of each part of a multipart upload, at least 5",
+    )
+    parser.add_argument(
+        "--local_storage",
+        default=config.get("LOCAL_OBJECT_STORAGE_DIR") or None,
+        help="Store objects in this folder instead of Min.io (the --minio_host, "
+        "--minio_access_key and --minio_secret_key options are then not required)",
+    )
+    parser.add_argument(
+        "--local_storage_url",
+        default=config.get("LOCAL_OBJECT_STORAGE_URL") or None,
+        help="Public URL of the --local_storage folder, default is its file:// URI",
+    )
+    parser.add_argument(
+        "--local_storage_fsync_batch",
+        type=int,
+        default=int(config.get("LOCAL_OBJECT_STORAGE_FSYNC_BATCH")),
+        help="Sync --local_storage objects to disk every N objects (0 disables)",
+    )
 
     return parser
 
@@ -12,7 +12,14 @@ from .base import base_parser, minio_parser, mongodb_parser
 
 from documentstore_migracao import config
 from documentstore_migracao.utils.build_ps_package import BuildPSPackage
-from documentstore_migracao.utils import quality_checker
+from documentstore_migracao.utils import (
+    quality_checker,
+    files,
+    asset_store,
+    optimised_assets,
+    package_fingerprints,
+    site_index,
+)
 
 from documentstore_migracao.processing import (
     extracted,
@@ -23,7 +30,7 @@ from documentstore_migracao.processing import (
     rollback,
     compare_articles_sites,
 )
-from documentstore_migracao.object_store import minio
+from documentstore_migracao.object_store import minio, known_objects, local
 from documentstore import adapters as ds_adapters
 
 from sqlalchemy import create_engine
@@ -115,6 +122,21 @@ def migrate_articlemeta_parser(sargs):
         help="ISSNs JSON data file",
     )
 
+    pack_sps_parser.add_argument(
+        "--asset-store",
+        dest="asset_store",
+        default=config.get("ASSET_STORE_DIR") or None,
+        help="Content-addressed asset store folder (assets are hard linked).",
+    )
+
+    pack_sps_parser.add_argument(
+        "--executor",
+        dest="executor",
+        choices=("thread", "process"),
+        default=config.get("PACKING_EXECUTOR"),
+        help="Pack XMLs in a thread pool or in a process pool.",
+    )
+
     # GERACAO PACOTE SPS FROM SITE STRUTURE
     pack_sps_parser_from_site = subparsers.add_parser(
         "pack_from_site", help="Gera pacotes `SPS` dos XML nativos"
@@ -171,6 +193,91 @@ def migrate_articlemeta_parser(sargs):
         help="ISSNs JSON data file",
     )
 
+    pack_sps_parser_from_site.add_argument(
+        "--assets-mode",
+        dest="assets_mode",
+        choices=files.MATERIALIZATION_MODES,
+        default=config.get("ASSET_MATERIALIZATION_MODE"),
+        help="How assets are put into packages (falls back to copy).",
+    )
+
+    pack_sps_parser_from_site.add_argument(
+        "--asset-store",
+        dest="asset_store",
+        default=config.get("ASSET_STORE_DIR") or None,
+        help="Content-addressed asset store folder (assets are hard linked).",
+    )
+
+    pack_sps_parser_from_site.add_argument(
+        "--optimised-asset-cache",
+        dest="optimised_asset_cache",
+        default=config.get("OPTIMISED_ASSET_CACHE_DIR") or None,
+        help="Folder to cache optimised images and thumbnails between runs.",
+    )
+
+    pack_sps_parser_from_site.add_argument(
+        "--optimised-asset-cache-max-mb",
+        dest="optimised_asset_cache_max_mb",
+        type=int,
+        default=int(config.get("OPTIMISED_ASSET_CACHE_MAX_MB")),
+        help="Optimised images cache size limit in MB (0 means no limit).",
+    )
+
+    pack_sps_parser_from_site.add_argument(
+        "--incremental",
+        dest="fingerprints_file",
+        nargs="?",
+        const=config.get("SITE_SPS_PKG_FINGERPRINTS_FILE"),
+        help="Skip packages whose sources did not change since the last run. "
+        "Source fingerprints are kept in the given SQLite file.",
+    )
+
+    pack_sps_parser_from_site.add_argument(
+        "--site-index",
+        dest="site_index_file",
+        nargs="?",
+        const=config.get("SITE_INDEX_FILE"),
+        help="Look up XML, PDF and image files in an index of the site folders "
+        "kept in the given SQLite file (built if it does not exist, was built "
+        "for other folders or is older than the site folders).",
+    )
+
+    pack_sps_parser_from_site.add_argument(
+        "--rebuild-site-index",
+        dest="rebuild_site_index",
+        action="store_true",
+        help="Scan the site folders and rebuild the index used by --site-index.",
+    )
+
+    pack_sps_parser_from_site.add_argument(
+        "--pipeline",
+        dest="pipeline",
+        action="store_true",
+        help="Copy files in threads and optimise images in a process pool.",
+    )
+
+    pack_sps_parser_from_site.add_argument(
+        "--cpu-workers",
+        dest="cpu_workers",
+        type=int,
+        default=int(config.get("PROCESSPOOL_MAX_WORKERS")),
+        help="Number of processes optimising images when --pipeline is used.",
+    )
+
+    pack_sps_parser_from_site.add_argument(
+        "--years",
+        dest="years",
+        nargs="+",
+        help="Publication years (taken from the PID) of the articles to pack.",
+    )
+
+    pack_sps_parser_from_site.add_argument(
+        "--skip-pids-file",
+        dest="skip_pids_file",
+        required=False,
+        help="File with PIDs (one per line) of articles that must not be packed.",
+    )
+
     # IMPORTACAO
     import_parser = subparsers.add_parser(
         "import",
@@ -197,6 +304,39 @@ def migrate_articlemeta_parser(sargs):
 
     import_parser.add_argument("--output", required=True, help="The output file path")
 
+    import_parser.add_argument(
+        "--upload-workers",
+        dest="upload_workers",
+        type=int,
+        default=int(config.get("UPLOAD_MAX_WORKERS")),
+        help="Maximum number of concurrent uploads to Min.io, shared by all packages.",
+    )
+
+    import_parser.add_argument(
+        "--bulk-write-size",
+        dest="bulk_write_size",
+        type=int,
+        default=int(config.get("KERNEL_BULK_WRITE_SIZE")),
+        help="Number of documents written at once to the Kernel database "
+        "(0 writes each document as it is imported).",
+    )
+
+    import_parser.add_argument(
+        "--executor",
+        dest="executor",
+        choices=("thread", "process"),
+        default=config.get("IMPORT_EXECUTOR"),
+        help="Import packages in a thread pool or in a process pool.",
+    )
+
+    import_parser.add_argument(
+        "--package-list",
+        dest="package_list",
+        default=None,
+        help="File with the package folders to import, one per line, relative "
+        "to --folder (by default the packages are found in --folder).",
+    )
+
     # IMPORTACAO
     link_documents_issues = subparsers.add_parser(
         "link_documents_issues",
@@ -210,6 +350,13 @@ def migrate_articlemeta_parser(sargs):
     link_documents_issues.add_argument(
         "journals", help="JSON file de journals result, e.g: ~/json/journal.json"
     )
+    link_documents_issues.add_argument(
+        "--workers",
+        dest="workers",
+        type=int,
+        default=int(config.get("THREADPOOL_MAX_WORKERS")),
+        help="Number of documents bundles updated concurrently.",
+    )
 
     # ROLLBACK
     rollback_parser = subparsers.add_parser(
@@ -386,13 +533,28 @@ def migrate_articlemeta_parser(sargs):
             with open(args.issns_jsonfile) as fp:
                 packing.ISSNs = json.loads(fp.read())
 
+        if args.asset_store:
+            packing.ASSET_STORE = asset_store.AssetStore(args.asset_store)
+
         # pack HTML
         if args.packFile:
             packing.pack_article_xml(args.packFile)
         else:
-            packing.pack_article_ALLxml()
+            packing.pack_article_ALLxml(executor=args.executor)
 
     elif args.command == "pack_from_site":
+        index = None
+        if args.site_index_file:
+            index = site_index.SiteIndex.open(
+                args.site_index_file,
+                {
+                    "xml": args.xml_folder,
+                    "pdf": args.pdf_folder,
+                    "img": args.img_folder,
+                },
+                rebuild=args.rebuild_site_index,
+            )
+
         # pack XML
         build_ps = BuildPSPackage(
             args.xml_folder,
@@ -400,11 +562,37 @@ def migrate_articlemeta_parser(sargs):
             args.pdf_folder,
             args.output_folder,
             args.articles_csvfile,
+            assets_mode=args.assets_mode,
+            asset_store=(
+                asset_store.AssetStore(args.asset_store) if args.asset_store else None
+            ),
+            acrons=args.acrons,
+            years=args.years,
+            skip_pids=(
+                files.read_file(args.skip_pids_file).split() if args.skip_pids_file else None
+            ),
+            optimised_cache=(
+                optimised_assets.OptimisedAssetCache(
+                    args.optimised_asset_cache,
+                    max_size=args.optimised_asset_cache_max_mb * 1024 * 1024,
+                )
+                if args.optimised_asset_cache
+                else None
+            ),
+            fingerprints=(
+                package_fingerprints.PackageFingerprints(args.fingerprints_file)
+                if args.fingerprints_file
+                else None
+            ),
+            site_index=index,
         )
         if args.issns_jsonfile:
             with open(args.issns_jsonfile) as fp:
                 build_ps.issns = json.loads(fp.read())
-        build_ps.run()
+        if args.pipeline:
+            build_ps.run_pipeline(args.cpu_workers)
+        else:
+            build_ps.run()
 
     elif args.command == "import":
         mongo = ds_adapters.MongoDB(uri=args.uri, dbname=args.db, options=options)
@@ -413,27 +601,60 @@ def migrate_articlemeta_parser(sargs):
         pid_database_engine = create_engine(args.pid_database_dsn,
                                             connect_args=json.loads(config.get('DATABASE_CONNECT_ARGS')))
 
-        http_client = urllib3.PoolManager(
-            timeout=config.get('MINIO_TIMEOUT'),
-            maxsize=10,
-            cert_reqs='CERT_REQUIRED',
-            retries=urllib3.Retry(
-                total=5,
-                backoff_factor=0.2,
-                status_forcelist=[500, 502, 503, 504]
-            ))
-
-        storage = minio.MinioStorage(
-            minio_host=args.minio_host,
-            minio_access_key=args.minio_access_key,
-            minio_secret_key=args.minio_secret_key,
-            minio_secure=args.minio_is_secure,
-            minio_http_client=http_client
-        )
+        if args.local_storage:
+            storage = local.LocalObjectStorage(
+                args.local_storage,
+                base_url=args.local_storage_url,
+                fsync_batch=args.local_storage_fsync_batch,
+            )
+        else:
+            if not (args.minio_host and args.minio_access_key and args.minio_secret_key):
+                parser.error(
+                    "the following arguments are required: --minio_host, "
+                    "--minio_access_key, --minio_secret_key (or --local_storage)"
+                )
+
+            http_client = urllib3.PoolManager(
+                timeout=config.get('MINIO_TIMEOUT'),
+                maxsize=max(10, args.upload_workers),
+                cert_reqs='CERT_REQUIRED',
+                retries=urllib3.Retry(
+                    total=5,
+                    backoff_factor=0.2,
+                    status_forcelist=[500, 502, 503, 504]
+                ))
+
+            storage = minio.MinioStorage(
+                minio_host=args.minio_host,
+                minio_access_key=args.minio_access_key,
+                minio_secret_key=args.minio_secret_key,
+                minio_secure=args.minio_is_secure,
+                minio_http_client=http_client,
+                known_objects=(
+                    known_objects.KnownObjects(args.minio_known_objects)
+                    if args.minio_known_objects
+                    else None
+                ),
+                multipart_threshold=args.minio_multipart_threshold_mb * minio.MB,
+                part_size=args.minio_part_size_mb * minio.MB,
+            )
 
         inserting.import_documents_to_kernel(
             session_db=DB_Session(), pid_database_engine=pid_database_engine, storage=storage,
-            folder=args.folder, output_path=args.output
+            folder=args.folder, output_path=args.output, upload_workers=args.upload_workers,
+            bulk_write_size=args.bulk_write_size, executor=args.executor,
+            package_list=args.package_list,
+            worker=(
+                inserting.ImportWorker(
+                    mongodb_uri=args.uri,
+                    mongodb_name=args.db,
+                    mongodb_options=options,
+                    pid_database_dsn=args.pid_database_dsn,
+                    storage=storage,
+                )
+                if args.executor == "process"
+                else None
+            ),
         )
 
     elif args.command == "link_documents_issues":
@@ -441,7 +662,8 @@ def migrate_articlemeta_parser(sargs):
         DB_Session = ds_adapters.Session.partial(mongo)
 
         inserting.register_documents_in_documents_bundle(
-            session_db=DB_Session(), file_documents=args.documents, file_journals=args.journals
+            session_db=DB_Session(), file_documents=args.documents, file_journals=args.journals,
+            max_workers=args.workers,
         )
 
     elif args.command == "rollback":
@@ -0,0 +1,113 @@
+# coding: utf-8
+
+"""
+Cache local dos objetos já registrados no object storage.
+
+Os nomes dos objetos são formados pela soma SHA-1 do conteúdo, portanto um
+objeto registrado não muda. Os nomes dos objetos enviados ou encontrados no
+bucket são gravados em um banco SQLite, de modo que uma nova importação do
+mesmo pacote não precise consultar o object storage.
+
+O banco é compartilhado pelas threads e pelos processos de importação: é
+aberto em modo WAL, as gravações de cada processo são serializadas e as
+gravações concorrentes de outros processos são aguardadas por até `timeout`
+segundos. Falhas no acesso ao cache são tratadas como objetos desconhecidos,
+que são então consultados no object storage.
+"""
+
+import os
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class KnownObjects:
+    """Conjunto persistente dos objetos existentes em cada bucket.
+
+    Args:
+        path: arquivo SQLite do cache
+        timeout: tempo máximo, em segundos, de espera por um banco bloqueado
+    """
+
+    def __init__(self, path: str, timeout: float = 30):
+        self.path = path
+        self.timeout = timeout
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(_connection=None, _lock=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            connection = sqlite3.connect(
+                self.path, timeout=self.timeout, check_same_thread=False
+            )
+            try:
+                connection.execute("PRAGMA journal_mode=WAL")
+                with connection:
+                    connection.execute(
+                        "CREATE TABLE IF NOT EXISTS objects ("
+                        "bucket TEXT, name TEXT, PRIMARY KEY (bucket, name))"
+                    )
+            except sqlite3.Error:
+                connection.close()
+                raise
+            self._connection = connection
+        return self._connection
+
+    def __contains__(self, key) -> bool:
+        bucket, name = key
+        try:
+            with self._lock:
+                row = (
+                    self._connect()
+                    .execute(
+                        "SELECT 1 FROM objects WHERE bucket = ? AND name = ?",
+                        (bucket, name),
+                    )
+                    .fetchone()
+                )
+        except sqlite3.Error as exc:
+            logger.warning("Could not read known objects from '%s': %s", self.path, exc)
+            return False
+        return row is not None
+
+    def add(self, bucket: str, name: str) -> None:
+        try:
+            with self._lock:
+                connection = self._connect()
+                with connection:
+                    connection.execute(
+                        "INSERT OR IGNORE INTO objects VALUES (?, ?)", (bucket, name)
+                    )
+        except sqlite3.Error as exc:
+            logger.warning("Could not record known object '%s': %s", name, exc)
+
+    def discard(self, bucket: str, name: str) -> None:
+        """Remove ``name`` do cache. Ao contrário das demais operações, as
+        falhas são propagadas, pois o objeto removido seria considerado
+        existente"""
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "DELETE FROM objects WHERE bucket = ? AND name = ?", (bucket, name)
+                )
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,153 @@
+# coding: utf-8
+
+"""
+Object storage em sistema de arquivos local, com a mesma interface de
+`MinioStorage`, utilizado em importações sem acesso ao Min.io (testes,
+simulações e medições de desempenho).
+
+Os objetos são gravados com os mesmos nomes utilizados no Min.io, formados
+pelo prefixo e pela soma SHA-1 do conteúdo:
+
+    <path>/<prefixo>/<soma SHA-1>.<extensão>
+
+Um objeto existente não é gravado novamente. As gravações podem ser
+sincronizadas em disco (fsync) em lotes de `fsync_batch` objetos.
+"""
+
+import os
+import time
+import pathlib
+import logging
+import tempfile
+import threading
+from urllib.parse import quote
+
+from documentstore_migracao.utils import files, asset_store
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+class LocalObjectStorage:
+    """Armazena objetos na pasta `path`.
+
+    Args:
+        path: pasta raiz dos objetos
+        base_url: URL pública de `path` (padrão: URI `file://` da pasta)
+        fsync_batch: quantidade de objetos gravados entre sincronizações em
+            disco (0 desabilita a sincronização)
+        mode: modo de materialização dos arquivos (ver `files.materialize_file`)
+    """
+
+    def __init__(self, path, base_url=None, fsync_batch=0, mode="copy"):
+        self.path = path
+        self.base_url = (base_url or pathlib.Path(path).resolve().as_uri()).rstrip("/")
+        self.fsync_batch = fsync_batch
+        self.mode = mode
+        self.uploaded_objects = 0
+        self.uploaded_bytes = 0
+        self.upload_seconds = 0.0
+        self._pending = []
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def __getstate__(self):
+        # as gravações pendentes de sincronização pertencem ao processo
+        state = self.__dict__.copy()
+        state.update(_pending=[], _lock=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _generator_object_name(self, file_path, prefix):
+        n_filename = asset_store.known_sha1(file_path) or files.sha1(file_path)
+        _, file_extension = os.path.splitext(os.path.basename(file_path))
+        return f"{prefix}/{n_filename}{file_extension}"
+
+    def object_path(self, object_name: str) -> str:
+        return os.path.join(self.path, *object_name.split("/"))
+
+    def get_urls(self, media_path: str) -> str:
+        return "%s/%s" % (self.base_url, quote(media_path))
+
+    def exists(self, object_name: str) -> bool:
+        return os.path.isfile(self.object_path(object_name))
+
+    def register(self, file_path, prefix="", original_uri=None) -> str:
+        object_name = self._generator_object_name(file_path, prefix)
+        if self.exists(object_name):
+            logger.debug(
+                "Object %s already registered, skipping %s", object_name, file_path
+            )
+            return self.get_urls(object_name)
+
+        logger.debug("Registering %s in %s", file_path, object_name)
+        started = time.monotonic()
+        object_path = self.object_path(object_name)
+        folder = os.path.dirname(object_path)
+        os.makedirs(folder, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=folder, prefix=".tmp-")
+        os.close(fd)
+        try:
+            files.materialize_file(file_path, temp_path, self.mode)
+            os.replace(temp_path, object_path)
+        except BaseException:
+            if os.path.lexists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+        size = os.path.getsize(object_path)
+        with self._lock:
+            self.uploaded_objects += 1
+            self.uploaded_bytes += size
+            self.upload_seconds += time.monotonic() - started
+            if self.fsync_batch:
+                self._pending.append(object_path)
+                if len(self._pending) >= self.fsync_batch:
+                    self._sync()
+
+        return self.get_urls(object_name)
+
+    def _sync(self):
+        """Sincroniza em disco os objetos pendentes e as suas pastas"""
+        folders = set()
+        for object_path in self._pending:
+            fd = os.open(object_path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            folders.add(os.path.dirname(object_path))
+        for folder in folders:
+            fd = os.open(folder, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        logger.debug("%s objects synced to disk", len(self._pending))
+        self._pending = []
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._pending:
+                self._sync()
+
+    def remove(self, object_name: str) -> None:
+        try:
+            os.unlink(self.object_path(object_name))
+        except FileNotFoundError:
+            pass
+
+    def log_summary(self) -> None:
+        self.flush()
+        logger.info(
+            "%s objects stored in '%s' (%.2f MB) in %.1fs (%.2f MB/s).",
+            self.uploaded_objects,
+            self.path,
+            self.uploaded_bytes / MB,
+            self.upload_seconds,
+            self.uploaded_bytes / MB / self.upload_seconds if self.upload_seconds else 0,
+        )
@@ -1,20 +1,42 @@
 # coding: utf-8
+import io
 import logging
 import os
 import json
+import math
+import time
+import hashlib
+import threading
+import contextlib
 
+import urllib3
 from minio import Minio
-from minio.error import ResponseError, NoSuchBucket
+from minio.helpers import get_target_url, MIN_PART_SIZE, MAX_PART_SIZE
+from minio.error import ResponseError, NoSuchBucket, NoSuchKey
 
-from documentstore_migracao.utils import files, xml
+from documentstore_migracao.utils import files, xml, asset_store
 from documentstore_migracao import config
 
 logger = logging.getLogger(__name__)
 
+# Quantidade máxima de partes de um envio multipart
+MAX_PARTS = 10000
+
+MB = 1024 * 1024
+
 
 class MinioStorage:
     def __init__(
-        self, minio_host, minio_access_key, minio_secret_key, minio_secure=True, minio_http_client=None
+        self,
+        minio_host,
+        minio_access_key,
+        minio_secret_key,
+        minio_secure=True,
+        minio_http_client=None,
+        known_objects=None,
+        multipart_threshold=None,
+        part_size=None,
+        single_read_max_size=None,
     ):
 
         self.bucket_name = "documentstore"
@@ -40,8 +62,46 @@ class MinioStorage:
         self.minio_secret_key = minio_secret_key
         self.minio_secure = minio_secure
         self.http_client = minio_http_client
+        self.known_objects = known_objects
+        self.multipart_threshold = min(
+            multipart_threshold
+            or int(config.get("MINIO_MULTIPART_THRESHOLD_MB")) * MB,
+            MAX_PART_SIZE,
+        )
+        self.part_size = part_size or int(config.get("MINIO_PART_SIZE_MB")) * MB
+        if not MIN_PART_SIZE <= self.part_size <= MAX_PART_SIZE:
+            raise ValueError(
+                "Part size must be between %s and %s bytes" % (MIN_PART_SIZE, MAX_PART_SIZE)
+            )
+        # arquivos até este tamanho são lidos uma única vez: a soma SHA-1 é
+        # calculada e o envio é feito a partir do mesmo conteúdo em memória
+        self.single_read_max_size = (
+            single_read_max_size
+            if single_read_max_size is not None
+            else int(config.get("MINIO_SINGLE_READ_MAX_MB")) * MB
+        )
+        self.uploaded_objects = 0
+        self.uploaded_bytes = 0
+        self.upload_seconds = 0.0
+        self._stats_lock = threading.Lock()
         self._client_instance = None
 
+    def __getstate__(self):
+        # o cliente Min.io e as travas pertencem ao processo; o cliente HTTP é
+        # recriado a partir das suas configurações de conexão
+        state = self.__dict__.copy()
+        state.update(_client_instance=None, _stats_lock=None, http_client=None)
+        if self.http_client is not None:
+            state["_http_client_kw"] = dict(self.http_client.connection_pool_kw)
+        return state
+
+    def __setstate__(self, state):
+        http_client_kw = state.pop("_http_client_kw", None)
+        self.__dict__.update(state)
+        self._stats_lock = threading.Lock()
+        if http_client_kw is not None:
+            self.http_client = urllib3.PoolManager(**http_client_kw)
+
     @property
     def _client(self):
         """Posterga a instanciação de `pymongo.MongoClient` até o seu primeiro
@@ -88,19 +148,88 @@ class MinioStorage:
             * o segundo o scielo-id do documento no seu idioma original.
             Var: Prefix
         O nome do arquivo sera alterado para soma SHA-1, para evitar duplicatas e conflitos em nomes.
+        A soma registrada pelo `AssetStore` é utilizada quando disponível.
         """
-        n_filename = files.sha1(file_path)
+        n_filename = asset_store.known_sha1(file_path) or files.sha1(file_path)
+        return self._object_name(n_filename, file_path, prefix)
+
+    def _object_name(self, sha1, file_path, prefix):
         _, file_extension = os.path.splitext(os.path.basename(file_path))
+        return f"{prefix}/{sha1}{file_extension}"
+
+    def _read_file(self, file_path):
+        """Retorna a tupla (soma SHA-1, conteúdo) de `file_path`.
 
-        return f"{prefix}/{n_filename}{file_extension}"
+        O conteúdo é lido uma única vez e reaproveitado no envio, exceto para
+        arquivos maiores que `single_read_max_size` ou cuja soma já tenha sido
+        registrada pelo `AssetStore`, quando é retornado None e o
+        arquivo é enviado diretamente do disco."""
+        known = asset_store.known_sha1(file_path)
+        if known is not None:
+            return known, None
+
+        if os.path.getsize(file_path) > self.single_read_max_size:
+            return files.sha1(file_path), None
+
+        data = files.read_file_binary(file_path)
+        return hashlib.sha1(data).hexdigest(), data
 
     def get_urls(self, media_path: str) -> str:
+        """Retorna a URL pública de `media_path`, a mesma de
+        `presigned_get_object` sem a assinatura.
+
+        A URL é montada com `get_target_url`, utilizado pelo cliente Min.io
+        nas URLs assinadas, que considera o estilo de endereçamento (virtual
+        host nos endpoints da AWS) e a região do bucket."""
+        return get_target_url(
+            "%s://%s" % ("https" if self.minio_secure else "http", self.minio_host),
+            bucket_name=self.bucket_name,
+            object_name=media_path,
+            bucket_region=self._bucket_region(),
+        )
+
+    def _bucket_region(self) -> str:
+        # a região altera somente as URLs dos endpoints da AWS. O cliente
+        # consulta a região uma única vez; o minio 4 não expõe um método
+        # público para obtê-la
+        if "s3.amazonaws.com" not in self.minio_host:
+            return "us-east-1"
+        return self._client._get_bucket_region(self.bucket_name)
+
+    def exists(self, object_name: str) -> bool:
+        """Verifica se `object_name` está no bucket, consultando antes o cache
+        `known_objects` para evitar a requisição ao object storage"""
+        if (
+            self.known_objects is not None
+            and (self.bucket_name, object_name) in self.known_objects
+        ):
+            return True
+
+        try:
+            self._client.stat_object(self.bucket_name, object_name)
+        except (NoSuchKey, NoSuchBucket):
+            return False
+        except ResponseError as err:
+            if err.code in ("NoSuchKey", "NoSuchBucket"):
+                return False
+            raise
+
+        self._add_known_object(object_name)
+        return True
 
-        url = self._client.presigned_get_object(self.bucket_name, media_path)
-        return url.split("?")[0]
+    def _add_known_object(self, object_name):
+        if self.known_objects is not None:
+            self.known_objects.add(self.bucket_name, object_name)
 
     def register(self, file_path, prefix="", original_uri=None) -> str:
-        object_name = self._generator_object_name(file_path, prefix)
+        sha1, data = self._read_file(file_path)
+        object_name = self._object_name(sha1, file_path, prefix)
+        if self.exists(object_name):
+            logger.debug(
+                "Object %s already registered, skipping %s", object_name, file_path
+            )
+            return self.get_urls(object_name)
+
         metadata = {"origin_name": os.path.basename(file_path)}
         if original_uri is not None:
             metadata.update({"origin_uri": original_uri})
@@ -109,19 +238,64 @@ class MinioStorage:
             "Registering %s in %s with metadata %s", file_path, object_name, metadata
         )
         try:
-            self._client.fput_object(
-                self.bucket_name,
-                object_name=object_name,
-                file_path=file_path,
-            )
-
+            self._upload(object_name, file_path, data)
         except NoSuchBucket as err:
             logger.error(err)
             self._create_bucket()
             return self.register(file_path, prefix)
 
+        self._add_known_object(object_name)
         return self.get_urls(object_name)
 
+    def _upload(self, object_name, file_path, data=None):
+        """Envia `data` ou, se None, o conteúdo de `file_path` para
+        `object_name`. Objetos maiores que `multipart_threshold` são enviados
+        pelo cliente Min.io em partes de `part_size` bytes."""
+        started = time.monotonic()
+        with contextlib.ExitStack() as stack:
+            if data is None:
+                stream = stack.enter_context(open(file_path, "rb"))
+                size = os.fstat(stream.fileno()).st_size
+            else:
+                stream = io.BytesIO(data)
+                size = len(data)
+
+            if size > self.multipart_threshold:
+                part_size = max(self.part_size, math.ceil(size / MAX_PARTS))
+            else:
+                part_size = max(size, MIN_PART_SIZE)
+            self._client.put_object(
+                self.bucket_name,
+                object_name=object_name,
+                data=stream,
+                length=size,
+                part_size=part_size,
+            )
+
+        elapsed = time.monotonic() - started
+        with self._stats_lock:
+            self.uploaded_objects += 1
+            self.uploaded_bytes += size
+            self.upload_seconds += elapsed
+        logger.debug(
+            "Uploaded %s (%d bytes) in %.3fs (%.2f MB/s)",
+            object_name,
+            size,
+            elapsed,
+            size / MB / elapsed if elapsed else 0,
+        )
+
+    def log_summary(self) -> None:
+        logger.info(
+            "%s objects uploaded (%.2f MB) in %.1fs of upload time (%.2f MB/s).",
+            self.uploaded_objects,
+            self.uploaded_bytes / MB,
+            self.upload_seconds,
+            self.uploaded_bytes / MB / self.upload_seconds if self.upload_seconds else 0,
+        )
+
     def remove(self, object_name: str) -> None:
         # Remove an object.
         self._client.remove_object(self.bucket_name, object_name)
+        if self.known_objects is not None:
+            self.known_objects.discard(self.bucket_name, object_name)
@@ -3,15 +3,20 @@ import os
 import re
 import logging
 import json
+import bisect
+import functools
 import concurrent.futures
-from typing import List, Tuple
+import multiprocessing.util
+from typing import List, Tuple, Optional
 from mimetypes import MimeTypes
 from urllib.parse import urlparse
 
 import lxml
 from tqdm import tqdm
 from xylose.scielodocument import Journal
+from sqlalchemy import create_engine
 
+from documentstore import adapters as ds_adapters
 from documentstore.domain import utcnow, DocumentsBundle, get_static_assets, Document
 from documentstore.exceptions import AlreadyExists, DoesNotExist
 from documentstore.interfaces import Session
@@ -29,12 +34,14 @@ from documentstore_migracao.utils import (
     add_renditions,
     DoJobsConcurrently,
     PoisonPill,
+    mongodb_collection,
 )
 from documentstore_migracao import config, exceptions
 from documentstore_migracao.export.sps_package import DocumentsSorter, SPS_Package
 from documentstore_migracao.processing import reading
 from documentstore_migracao.tools import constructor
 from documentstore_migracao.utils.files import xml_files_list
+from documentstore_migracao.utils import bulk_writer, result_writer
 
 
 logger = logging.getLogger(__name__)
@@ -42,6 +49,61 @@ logger = logging.getLogger(__name__)
 
 __all__ = ["import_documents_to_kernel", "register_documents_in_documents_bundle"]
 
+# Executor compartilhado pelos pacotes para o envio de arquivos ao object
+# storage, limitando a quantidade total de envios simultâneos
+UPLOAD_EXECUTOR = None
+
+# Identificadores dos documentos registrados no Kernel, carregados uma única
+# vez por `import_documents_to_kernel`
+IMPORTED_DOCUMENTS = None
+
+# `ImportWorker` do processo de importação, ver `init_import_worker`
+IMPORT_WORKER = None
+
+
+def register_files(storage, files_to_register: List[tuple]) -> List[str]:
+    """Envia ao object storage os arquivos de `files_to_register`, tuplas com
+    os argumentos de `storage.register`, e retorna as URLs na mesma ordem.
+
+    Os envios são feitos em paralelo por `UPLOAD_EXECUTOR`, quando
+    configurado."""
+
+    def register(args):
+        return storage.register(*args)
+
+    if UPLOAD_EXECUTOR is None or len(files_to_register) < 2:
+        return [register(args) for args in files_to_register]
+    return list(UPLOAD_EXECUTOR.map(register, files_to_register))
+
+
+def fetch_imported_documents(session) -> Optional[set]:
+    """Retorna o conjunto dos identificadores dos documentos registrados no
+    Kernel, obtidos por uma única consulta que retorna apenas o campo `_id`.
+
+    Retorna None para sessões sem cliente MongoDB, quando a existência de
+    cada documento é verificada com `session.documents.fetch`."""
+    collection = mongodb_collection(session, "documents")
+    if collection is None:
+        return None
+
+    cursor = collection.find({}, projection={"_id": True})
+    imported = {document["_id"] for document in cursor}
+    logger.info("%s documents already registered in kernel.", len(imported))
+    return imported
+
+
+def document_exists(session, pid_v3: str) -> bool:
+    """Verifica se o documento `pid_v3` está registrado no Kernel, consultando
+    `IMPORTED_DOCUMENTS` quando carregado"""
+    if IMPORTED_DOCUMENTS is not None:
+        return pid_v3 in IMPORTED_DOCUMENTS
+
+    try:
+        session.documents.fetch(id=pid_v3)
+    except DoesNotExist:
+        return False
+    return True
+
 
 def get_document_renditions(
     folder: str, file_prefix: str, storage: object
@@ -63,15 +125,24 @@ def get_document_renditions(
         _manifest = {lang: urlparse(url).path for lang, url in _manifest_json.items()}
         logger.debug("Renditions lang and legacy url: %s", _manifest)
 
-        for lang, legacy_url in _manifest.items():
-            rendition = os.path.basename(legacy_url)
+        _renditions_paths = [
+            (lang, os.path.basename(legacy_url))
+            for lang, legacy_url in _manifest.items()
+        ]
+        _urls = register_files(
+            storage,
+            [
+                (os.path.join(folder, rendition), file_prefix, _manifest.get(lang))
+                for lang, rendition in _renditions_paths
+            ],
+        )
+
+        for (lang, rendition), url in zip(_renditions_paths, _urls):
             _mimetype = mimetypes.guess_type(rendition)[0]
             _rendition_path = os.path.join(folder, rendition)
             _rendition = {
                 "filename": rendition,
-                "url": storage.register(
-                    _rendition_path, file_prefix, _manifest.get(lang)
-                ),
+                "url": url,
                 "size_bytes": os.path.getsize(_rendition_path),
                 "mimetype": _mimetype,
                 "lang": lang,
@@ -100,28 +171,70 @@ def get_document_assets_path(
        `1518-8787-rsp-40-01-92-98-gseta.tif`
     3) Resultado de asset `{'1518-8787-rsp-40-01-92-98-gseta': '1518-8787-rsp-40-01-92-98-gseta.tif'}
     4) Resultado para arquivo adicional: `[1518-8787-rsp-40-01-92-98-gseta.jpeg]`
+
+    Os arquivos do pacote são indexados uma única vez, de forma que o tempo de
+    execução cresce com a quantidade de arquivos e de assets, e não com o
+    produto entre eles. Um arquivo corresponde a um asset quando o seu nome
+    começa com o nome do asset.
     """
 
     # TODO: é preciso que o get_static_assets conheça todos os tipos de assets
     static_assets = dict([(asset[0], None) for asset in get_static_assets(xml)])
     static_additionals = {}
 
-    for folder_file in folder_files:
-        file_name, extension = os.path.splitext(folder_file)
-
-        for key in static_assets.keys():
-            path = os.path.join(folder, folder_file)
-
-            if key == folder_file:
-                static_assets[key] = path
-            elif key in folder_file and extension in prefered_types:
-                static_assets[key] = path
-            elif key in folder_file and static_assets[key] is None:
-                static_assets[key] = path
+    # Os arquivos são indexados uma única vez: pelo nome, em ordem alfabética,
+    # para obter os que começam com o nome do asset, e pelo nome sem extensão
+    sorted_files = sorted((name, index) for index, name in enumerate(folder_files))
+    sorted_names = [name for name, _ in sorted_files]
+    files_by_stem = {}
+    for index, folder_file in enumerate(folder_files):
+        files_by_stem.setdefault(os.path.splitext(folder_file)[0], []).append(index)
+
+    def path(index):
+        return os.path.join(folder, folder_files[index])
+
+    # (posição do arquivo, posição do asset, chave, caminho), aplicados na
+    # ordem dos arquivos do pacote
+    additionals = []
+
+    for key_index, key in enumerate(static_assets.keys()):
+        matches = []
+        position = bisect.bisect_left(sorted_names, key)
+        while position < len(sorted_names) and sorted_names[position].startswith(key):
+            matches.append(sorted_files[position][1])
+            position += 1
+        matches.sort()
+
+        prefered = [
+            index
+            for index in matches
+            if folder_files[index] == key
+            or os.path.splitext(folder_files[index])[1] in prefered_types
+        ]
+        if prefered:
+            static_assets[key] = path(prefered[-1])
+        elif matches:
+            static_assets[key] = path(matches[0])
+
+        # os demais arquivos com o mesmo nome do asset são adicionais
+        prefered = set(prefered)
+        for index in matches[1:]:
+            file_name = os.path.splitext(folder_files[index])[0]
+            if index in prefered:
+                continue
             elif file_name == key:
-                static_additionals[key] = path
+                additionals.append((index, key_index, key, path(index)))
             elif file_name == os.path.splitext(key)[0]:
-                static_additionals[file_name] = path
+                additionals.append((index, key_index, file_name, path(index)))
+
+        matches = set(matches)
+        key_name = os.path.splitext(key)[0]
+        for index in files_by_stem.get(key_name, []):
+            if index not in matches:
+                additionals.append((index, key_index, key_name, path(index)))
+
+    for _, _, key, additional_path in sorted(additionals):
+        static_additionals[key] = additional_path
 
     return (static_assets, static_additionals)
 
@@ -130,17 +243,19 @@ def put_static_assets_into_storage(
     assets: dict, prefix: str, storage, ignore_missing_assets: bool = True
 ) -> List[dict]:
     """Armazena os arquivos assets em um object storage"""
-    _assets = []
-
-    for asset_name, asset_path in assets.items():
-        if not asset_path and ignore_missing_assets:
-            continue
-
-        _assets.append(
-            {"asset_id": asset_name, "asset_url": storage.register(asset_path, prefix)}
-        )
+    _assets = [
+        (asset_name, asset_path)
+        for asset_name, asset_path in assets.items()
+        if asset_path or not ignore_missing_assets
+    ]
+    _urls = register_files(
+        storage, [(asset_path, prefix) for _, asset_path in _assets]
+    )
 
-    return _assets
+    return [
+        {"asset_id": asset_name, "asset_url": url}
+        for (asset_name, _), url in zip(_assets, _urls)
+    ]
 
 
 def get_article_result_dict(sps: SPS_Package) -> dict:
@@ -178,9 +293,13 @@ def get_article_result_dict(sps: SPS_Package) -> dict:
     return dict(article_metadata)
 
 
-def register_document(folder: str, session, storage, pid_database_engine, poison_pill=PoisonPill()) -> None:
-    """Registra registra pacotes SPS em uma instância do Kernel e seus
-    ativos digitais em um object storage."""
+def prepare_document(
+    folder: str, session, storage, pid_database_engine, poison_pill=PoisonPill()
+) -> Optional[Tuple[dict, Optional[dict], bool]]:
+    """Envia ao object storage os ativos digitais do pacote SPS `folder` e
+    retorna o resultado da importação, o manifesto do documento a registrar no
+    Kernel (None quando o documento já está registrado) e se o documento
+    possui manifestações."""
 
     if poison_pill.poisoned:
         return
@@ -208,19 +327,17 @@ def register_document(folder: str, session, storage, pid_database_engine, poison
         ) from None
 
     xml_sps = SPS_Package(obj_xml)
+    # a pasta do pacote permite retomar a importação (ver `imported_packages`)
+    result = dict(get_article_result_dict(xml_sps), package=folder)
 
     pid_v3 = xml_sps.scielo_pid_v3
 
-    try:
-        session.documents.fetch(id=pid_v3)
-    except DoesNotExist:
-        pass
-    else:
+    if document_exists(session, pid_v3):
         logger.debug(
             "Document '%s' already exist in kernel. Returning article result information",
             pid_v3,
         )
-        return get_article_result_dict(xml_sps)
+        return result, None, False
 
     prefix = xml_sps.media_prefix or ""
     url_xml = storage.register(xml_path, prefix)
@@ -229,16 +346,38 @@ def register_document(folder: str, session, storage, pid_database_engine, poison
     )
     registered_assets = put_static_assets_into_storage(static_assets, prefix, storage)
 
-    for additional_path in static_additionals.values():
-        storage.register(os.path.join(additional_path), prefix)
+    register_files(
+        storage,
+        [(additional_path, prefix) for additional_path in static_additionals.values()],
+    )
 
     renditions = get_document_renditions(folder, prefix, storage)
-    document = Document(
-        manifest=manifest.get_document_manifest(
-            xml_sps, url_xml, registered_assets, renditions
-        )
+    document_manifest = manifest.get_document_manifest(
+        xml_sps, url_xml, registered_assets, renditions
+    )
+
+    if IMPORTED_DOCUMENTS is not None:
+        # evita a reimportação de pacotes repetidos nesta execução
+        IMPORTED_DOCUMENTS.add(pid_v3)
+
+    return result, document_manifest, bool(renditions)
+
+
+def register_document(folder: str, session, storage, pid_database_engine, poison_pill=PoisonPill()) -> None:
+    """Registra registra pacotes SPS em uma instância do Kernel e seus
+    ativos digitais em um object storage."""
+
+    prepared = prepare_document(
+        folder, session, storage, pid_database_engine, poison_pill
     )
+    if prepared is None:
+        return
 
+    result, document_manifest, renditions = prepared
+    if document_manifest is None:
+        return result
+
+    document = Document(manifest=document_manifest)
     try:
         add_document(session, document)
         if renditions:
@@ -248,7 +387,16 @@ def register_document(folder: str, session, storage, pid_database_engine, poison
     else:
         logger.debug("Document with id '%s' was imported.", document.id())
 
-    return get_article_result_dict(xml_sps)
+    return result
+
+
+def log_package_error(folder: str, exception: Exception) -> None:
+    logger.error(
+        "Could not import package '%s'. The following exception "
+        "was raised: '%s'.",
+        folder,
+        exception,
+    )
 
 
 def get_documents_bundle(session_db, bundle_id, is_issue, issn):
@@ -283,67 +431,370 @@ def create_aop_bundle(session_db, issn):
     return session_db.documents_bundles.fetch(bundle.id())
 
 
-def import_documents_to_kernel(session_db, pid_database_engine, storage, folder, output_path) -> None:
+class ImportWorker:
+    """Recursos utilizados pela importação em um processo.
+
+    A sessão do Kernel e a engine do banco de dados de PIDs não podem ser
+    transferidas entre processos e são criadas, em cada processo, no primeiro
+    uso a partir dos parâmetros de conexão informados na linha de comando.
+
+    Args:
+        mongodb_uri: URI de conexão com o MongoDB do Kernel
+        mongodb_name: nome do banco de dados do Kernel
+        pid_database_dsn: DSN do banco de dados de PIDs
+        storage: object storage onde os arquivos dos pacotes são registrados
+        mongodb_options: opções de conexão com o MongoDB
+    """
+
+    def __init__(
+        self,
+        mongodb_uri: str,
+        mongodb_name: str,
+        pid_database_dsn: str,
+        storage,
+        mongodb_options: dict = None,
+    ):
+        self.mongodb_uri = mongodb_uri
+        self.mongodb_name = mongodb_name
+        self.mongodb_options = mongodb_options
+        self.pid_database_dsn = pid_database_dsn
+        self.storage = storage
+        self.bulk_write_size = 0
+        self._session = None
+        self._pid_database_engine = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(_session=None, _pid_database_engine=None)
+        return state
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = ds_adapters.Session(
+                ds_adapters.MongoDB(
+                    uri=self.mongodb_uri,
+                    dbname=self.mongodb_name,
+                    options=self.mongodb_options,
+                )
+            )
+        return self._session
+
+    @property
+    def pid_database_engine(self):
+        if self._pid_database_engine is None:
+            self._pid_database_engine = create_engine(
+                self.pid_database_dsn,
+                connect_args=json.loads(config.get("DATABASE_CONNECT_ARGS")),
+            )
+        return self._pid_database_engine
+
+
+def init_import_worker(
+    worker: ImportWorker, imported_documents, upload_workers, bulk_write_size
+):
+    """Inicializa um processo de importação.
+
+    O `ImportWorker` e os identificadores dos documentos já registrados são
+    recebidos uma única vez por processo, que cria o seu próprio executor de
+    envios ao object storage. Com `bulk_write_size`, os documentos são
+    devolvidos ao processo principal, que os grava em lotes (ver
+    `register_package`)."""
+    global IMPORT_WORKER, IMPORTED_DOCUMENTS, UPLOAD_EXECUTOR
+    worker.bulk_write_size = bulk_write_size
+    IMPORT_WORKER = worker
+    IMPORTED_DOCUMENTS = imported_documents
+    UPLOAD_EXECUTOR = concurrent.futures.ThreadPoolExecutor(upload_workers)
+    multiprocessing.util.Finalize(
+        None, finish_import, args=(worker.storage,), exitpriority=10
+    )
+
+
+def register_package(folder: str, poison_pill=PoisonPill()):
+    """Registra o pacote SPS `folder` com os recursos do processo de
+    importação (ver `init_import_worker`).
+
+    Quando os documentos são gravados em lotes, apenas os ativos digitais são
+    enviados e o retorno é o de `prepare_document`: o documento é gravado pelo
+    processo principal, que conhece o resultado de cada lote."""
+    register = register_document
+    if IMPORT_WORKER.bulk_write_size > 0:
+        register = prepare_document
+
+    return register(
+        folder,
+        IMPORT_WORKER.session,
+        IMPORT_WORKER.storage,
+        IMPORT_WORKER.pid_database_engine,
+        poison_pill,
+    )
+
+
+def finish_import(storage) -> None:
+    """Encerra o `UPLOAD_EXECUTOR` e registra o resumo dos envios ao object
+    storage"""
+    global UPLOAD_EXECUTOR
+
+    if UPLOAD_EXECUTOR is not None:
+        UPLOAD_EXECUTOR.shutdown()
+        UPLOAD_EXECUTOR = None
+    storage.log_summary()
+
+
+def write_prepared_document(
+    writer: bulk_writer.BulkWriter, results: result_writer.ResultWriter, prepared
+) -> None:
+    """Adiciona a `writer` o documento preparado por `prepare_document`.
+
+    O resultado do pacote é gravado em `results` somente após a gravação do
+    lote que contém o documento, para que pacotes com documentos não gravados
+    sejam importados novamente (ver `imported_packages`)."""
+    if prepared is None:
+        return
+
+    result, document_manifest, renditions = prepared
+    if document_manifest is None:
+        results.write_json(result)
+        return
+
+    def already_registered(exc):
+        logger.error(exc)
+        results.write_json(result)
+
+    writer.add_document(
+        Document(manifest=document_manifest),
+        renditions=renditions,
+        on_duplicate=already_registered,
+        on_written=functools.partial(results.write_json, result),
+        on_error=functools.partial(log_package_error, result["package"]),
+    )
+
+
+def imported_packages(output_path: str) -> set:
+    """Retorna as pastas dos pacotes registrados no arquivo de resultado de
+    uma importação anterior"""
+    packages = set()
+    try:
+        with open(output_path) as output:
+            for line in output:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(result, dict) and result.get("package"):
+                    packages.add(result["package"])
+    except FileNotFoundError:
+        pass
+    return packages
+
+
+def import_documents_to_kernel(
+    session_db,
+    pid_database_engine,
+    storage,
+    folder,
+    output_path,
+    upload_workers=None,
+    bulk_write_size=None,
+    executor="thread",
+    worker=None,
+    package_list=None,
+) -> None:
     """Armazena os arquivos do pacote SPS em um object storage, registra o documento
-    no banco de dados do Kernel e por fim associa-o ao seu `document bundle`"""
+    no banco de dados do Kernel e por fim associa-o ao seu `document bundle`.
+
+    Os arquivos de todos os pacotes são enviados por um único executor com
+    `upload_workers` threads (padrão `UPLOAD_MAX_WORKERS`). Os documentos são
+    gravados em lotes de `bulk_write_size` (padrão `KERNEL_BULK_WRITE_SIZE`,
+    0 para gravar um a um).
+
+    Os identificadores dos documentos já registrados no Kernel são carregados
+    uma única vez, antes da importação, para que os pacotes já importados
+    sejam ignorados sem consultas ao banco de dados.
+
+    Com `executor` ``process``, os pacotes são importados em processos
+    (``PROCESSPOOL_MAX_WORKERS``) que utilizam os recursos criados por
+    `worker` (`ImportWorker`), cada um com o seu executor de envios, e os
+    resultados e os lotes de documentos são gravados pelo processo principal.
+
+    Os pacotes são as pastas listadas, uma por linha, no arquivo
+    `package_list` ou, se não informado, as encontradas em `folder`, que são
+    enviadas para importação à medida que são descobertas. Pacotes já
+    registrados em `output_path` são ignorados: o resultado de cada pacote é
+    registrado somente após a gravação do seu documento no Kernel."""
+    global UPLOAD_EXECUTOR, IMPORTED_DOCUMENTS
+
+    if executor == "process" and worker is None:
+        raise ValueError("An ImportWorker is required to import in processes.")
+
+    if package_list is not None:
+        package_folders = files.iter_package_list(package_list, folder)
+    else:
+        package_folders = files.iter_package_folders(folder)
+
+    imported = imported_packages(output_path)
+    if imported:
+        logger.info("%s packages already imported will be skipped.", len(imported))
+    package_folders = (
+        package_folder
+        for package_folder in package_folders
+        if package_folder not in imported
+    )
 
-    jobs = [
-        {"folder": package_folder, "session": session_db, "storage": storage, "pid_database_engine": pid_database_engine}
-        for package_folder, _, files in os.walk(folder)
-        if files is not None and len(files) > 0
-    ]
+    upload_workers = upload_workers or int(config.get("UPLOAD_MAX_WORKERS"))
+    if bulk_write_size is None:
+        bulk_write_size = int(config.get("KERNEL_BULK_WRITE_SIZE"))
+    IMPORTED_DOCUMENTS = fetch_imported_documents(session_db)
+
+    if executor == "process":
+        func = register_package
+        pool_executor = functools.partial(
+            concurrent.futures.ProcessPoolExecutor,
+            initializer=init_import_worker,
+            initargs=(worker, IMPORTED_DOCUMENTS, upload_workers, bulk_write_size),
+        )
+        jobs = ({"folder": package_folder} for package_folder in package_folders)
+    else:
+        func = register_document
+        if bulk_write_size > 0:
+            func = prepare_document
+        pool_executor = concurrent.futures.ThreadPoolExecutor
+        jobs = (
+            {
+                "folder": package_folder,
+                "session": session_db,
+                "storage": storage,
+                "pid_database_engine": pid_database_engine,
+            }
+            for package_folder in package_folders
+        )
+        UPLOAD_EXECUTOR = concurrent.futures.ThreadPoolExecutor(upload_workers)
 
-    with tqdm(total=len(jobs)) as pbar:
+    writer = None
+    if bulk_write_size > 0:
+        writer = bulk_writer.BulkWriter(session_db, bulk_write_size)
+
+    try:
+        with tqdm() as pbar, result_writer.ResultWriter(
+            output_path
+        ) as results:
 
-        def update_bar(pbar=pbar):
-            pbar.update(1)
+            def update_bar(pbar=pbar):
+                pbar.update(1)
 
-        def write_result_to_file(result, path=output_path):
-            with open(path, "a") as f:
-                f.write(json.dumps(result) + "\n")
+            def exception_callback(exception, job):
+                log_package_error(job["folder"], exception)
 
-        def exception_callback(exception, job, logger=logger):
-            logger.error(
-                "Could not import package '%s'. The following exception "
-                "was raised: '%s'.",
-                job["folder"],
-                exception,
+            if writer is not None:
+                success_callback = functools.partial(
+                    write_prepared_document, writer, results
+                )
+            else:
+                success_callback = results.write_json
+
+            max_workers = int(config.get("PROCESSPOOL_MAX_WORKERS"))
+            DoJobsConcurrently(
+                func,
+                jobs=jobs,
+                executor=pool_executor,
+                max_workers=max_workers,
+                max_pending=max_workers * 4,
+                success_callback=success_callback,
+                exception_callback=exception_callback,
+                update_bar=update_bar,
             )
 
-        # O param executor por padrão é concurrent.futures.ThreadPoolExecutor.
-        # É possível e ganhamos velocidade quando utilizamos concurrent.futures.Executor,
-        # porém é necessário saber dos por menores que envolve essa alteração, é possível
-        # verificar isso em: https://docs.python.org/3/library/concurrent.futures.html#processpoolexecutor
-        DoJobsConcurrently(
-            register_document,
-            jobs=jobs,
-            max_workers=int(config.get("PROCESSPOOL_MAX_WORKERS")),
-            success_callback=write_result_to_file,
-            exception_callback=exception_callback,
-            update_bar=update_bar,
-        )
+            if writer is not None:
+                # os resultados dos pacotes do último lote são gravados aqui
+                writer.flush()
+                logger.info(
+                    "%s documents imported in bulk, %s already existed, %s failed.",
+                    writer.counts["Document"],
+                    writer.counts["duplicates"],
+                    writer.counts["failed"],
+                )
+    finally:
+        IMPORTED_DOCUMENTS = None
+        if executor != "process":
+            finish_import(storage)
 
 
-def link_documents_bundles_with_documents(
-    documents_bundle: DocumentsBundle, documents: List[str], session: Session
-):
-    """Função responsável por atualizar o relacionamento entre
-    documents bundles e documents no nível de banco de dados"""
+def add_documents_to_bundle(
+    documents_bundle: DocumentsBundle, documents: List[dict]
+) -> DocumentsBundle:
+    """Adiciona `documents` ao final de `documents_bundle`, na ordem em que
+    foram informados e ignorando os já relacionados, e retorna o documents
+    bundle atualizado.
+
+    `DocumentsBundle.add_document` percorre os itens do documents bundle a
+    cada inclusão; aqui os identificadores relacionados são indexados e o
+    manifesto é copiado uma única vez."""
+    _manifest = documents_bundle.manifest
+    linked = {item["id"] for item in _manifest["items"]}
+
     for document in documents:
-        try:
-            documents_bundle.add_document(document)
-        except AlreadyExists:
+        if document["id"] in linked:
             logger.info(
                 "Document %s already exists in documents bundle %s"
                 % (document, documents_bundle)
             )
+            continue
+        linked.add(document["id"])
+        _manifest["items"].append(document)
+
+    _manifest["updated"] = utcnow()
+    return DocumentsBundle(manifest=_manifest)
+
+
+def link_documents_bundles_with_documents(
+    documents_bundle: DocumentsBundle,
+    documents: List[str],
+    session: Session,
+    writer: bulk_writer.BulkWriter = None,
+):
+    """Função responsável por atualizar o relacionamento entre
+    documents bundles e documents no nível de banco de dados.
 
-    update_bundle(session, documents_bundle)
+    Quando informado, `writer` grava o documents bundle em lote."""
+    documents_bundle = add_documents_to_bundle(documents_bundle, documents)
+
+    if writer is not None:
+        writer.update_bundle(documents_bundle)
+    else:
+        update_bundle(session, documents_bundle)
+
+
+def fetch_documents_bundles(
+    session_db, bundle_ids: List[str], batch_size: int = 500
+) -> dict:
+    """Retorna os `DocumentsBundle` de `bundle_ids` registrados no Kernel,
+    obtidos em consultas de até `batch_size` identificadores.
+
+    Retorna um dicionário vazio para sessões sem cliente MongoDB, quando cada
+    documents bundle é obtido com `session.documents_bundles.fetch`."""
+    collection = mongodb_collection(session_db, "documents_bundles")
+    if collection is None:
+        return {}
+
+    documents_bundles = {}
+    for start in range(0, len(bundle_ids), batch_size):
+        cursor = collection.find(
+            {"_id": {"$in": bundle_ids[start : start + batch_size]}}
+        )
+        for manifest in cursor:
+            documents_bundles[manifest["_id"]] = DocumentsBundle(manifest=manifest)
+    return documents_bundles
 
 
 def register_documents_in_documents_bundle(
-    session_db, file_documents: str, file_journals: str
+    session_db, file_documents: str, file_journals: str, max_workers: int = None
 ) -> None:
+    """Relaciona os documentos importados aos seus documents bundles.
+
+    Os documents bundles são obtidos do Kernel em lotes e atualizados
+    concorrentemente por até `max_workers` threads (padrão
+    `THREADPOOL_MAX_WORKERS`), uma tarefa por documents bundle, e gravados em
+    lotes de `KERNEL_BULK_WRITE_SIZE`."""
     journals = reading.read_json_file(file_journals)
     data_journal = {}
     for journal in journals:
@@ -411,22 +862,62 @@ def register_documents_in_documents_bundle(
             "issn": issn_id,
         }
 
-    for documents_bundle in documents_bundles.values():
+    fetched_bundles = fetch_documents_bundles(
+        session_db,
+        list(documents_bundles),
+        int(config.get("KERNEL_BULK_WRITE_SIZE")) or 1,
+    )
 
-        data = documents_bundle["data"]
-        items = documents_bundle["items"]
-        try:
-            documents_bundle = get_documents_bundle(
-                session_db, data["bundle_id"], data["is_issue"], data["issn"]
-            )
-        except ValueError as exc:
-            logger.error(
-                "The bundle '%s' was not updated. During executions "
-                "this following exception was raised '%s'.",
-                data["bundle_id"],
-                exc,
-            )
-            content = json.dumps({"issue": data["bundle_id"], "items": items})
-            files.write_file(err_filename, content + "\n", "a")
-        else:
-            link_documents_bundles_with_documents(documents_bundle, items, session_db)
\ No newline at end of file
+    def link_documents_bundle(data, items, writer, errors, poison_pill=PoisonPill()):
+        if poison_pill.poisoned:
+            return
+
+        documents_bundle = fetched_bundles.get(data["bundle_id"])
+        if documents_bundle is None:
+            try:
+                documents_bundle = get_documents_bundle(
+                    session_db, data["bundle_id"], data["is_issue"], data["issn"]
+                )
+            except ValueError as exc:
+                logger.error(
+                    "The bundle '%s' was not updated. During executions "
+                    "this following exception was raised '%s'.",
+                    data["bundle_id"],
+                    exc,
+                )
+                errors.write_json({"issue": data["bundle_id"], "items": items})
+                return
+
+        link_documents_bundles_with_documents(
+            documents_bundle, items, session_db, writer
+        )
+
+    def exception_callback(exception, job, logger=logger):
+        logger.error(
+            "Could not link documents with bundle '%s'. The following exception "
+            "was raised: '%s'.",
+            job["data"]["bundle_id"],
+            exception,
+        )
+
+    with bulk_writer.BulkWriter(
+        session_db, int(config.get("KERNEL_BULK_WRITE_SIZE")) or 1
+    ) as writer, result_writer.ResultWriter(err_filename) as errors:
+        # cada tarefa atualiza um único documents bundle, evitando gravações
+        # concorrentes de um mesmo registro
+        DoJobsConcurrently(
+            link_documents_bundle,
+            jobs=[
+                {
+                    "data": bundle["data"],
+                    "items": bundle["items"],
+                    "writer": writer,
+                    "errors": errors,
+                }
+                for bundle in documents_bundles.values()
+            ],
+            max_workers=max_workers or int(config.get("THREADPOOL_MAX_WORKERS")),
+            exception_callback=exception_callback,
+        )
+
+    logger.info("%s documents bundles updated.", writer.counts["DocumentsBundle"])
\ No newline at end of file
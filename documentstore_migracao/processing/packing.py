@@ -1,8 +1,14 @@
 import os
+import uuid
+import errno
 import shutil
 import logging
+import tempfile
 import json
 import difflib
+import functools
+import concurrent.futures
+import multiprocessing.util
 
 from tqdm import tqdm
 from urllib.parse import urlparse
@@ -21,6 +27,15 @@ logger = logging.getLogger(__name__)
 
 ISSNs = {}
 
+DIRECTORY_INDEX = files.DirectoryIndex(int(config.get("DIRECTORY_INDEX_MAXSIZE")))
+
+# Instância de ``asset_store.AssetStore`` utilizada para empacotar os ativos
+ASSET_STORE = None
+
+# Executor utilizado para obter os ativos de um pacote em paralelo. É
+# configurado por ``init_packing_worker`` em cada processo de empacotamento.
+ASSETS_EXECUTOR = None
+
 
 class AssetNotFoundError(Exception):
     ...
@@ -84,28 +99,59 @@ def pack_article_xml(file_xml_path, poison_pill=PoisonPill()):
     renditions, renditions_metadata = source_json.get_renditions_metadata()
     logger.debug("%s possui %s renditions", file_xml_path, len(renditions))
 
-    package_path = packing_assets(
+    staging_path = make_staging_dir(sps_package.package_name)
+    try:
+        files.write_file(
+            os.path.join(staging_path, "manifest.json"),
+            json.dumps(renditions_metadata)
+        )
+        xml.objXML2file(
+            os.path.join(staging_path, "%s.xml" % (sps_package.package_name)), obj_xml
+        )
+    except BaseException:
+        shutil.rmtree(staging_path, ignore_errors=True)
+        raise
+
+    packing_assets(
         asset_replacements + renditions,
         pkg_path,
         incomplete_pkg_path,
         sps_package.package_name,
         sps_package.scielo_pid_v2,
+        staging_path=staging_path,
     )
 
-    files.write_file(
-        os.path.join(package_path, "manifest.json"),
-        json.dumps(renditions_metadata)
-    )
-    xml.objXML2file(
-        os.path.join(package_path, "%s.xml" % (sps_package.package_name)), obj_xml
-    )
 
+def init_packing_worker(issns, asset_store, asset_threads):
+    """Inicializa um processo de empacotamento.
+
+    As substituições de ISSNs e o armazenamento de ativos são recebidos uma
+    única vez por processo e um executor de threads é criado para que a
+    obtenção dos ativos (I/O) ocorra em paralelo ao processamento dos XMLs.
+    O executor é encerrado com o processo (ver ``finish_packing``).
+    """
+    global ISSNs, ASSET_STORE, ASSETS_EXECUTOR
+    ISSNs = issns
+    ASSET_STORE = asset_store
+    ASSETS_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=asset_threads)
+    multiprocessing.util.Finalize(None, finish_packing, exitpriority=10)
+
+
+def finish_packing():
+    """Encerra o executor de ativos criado por ``init_packing_worker``"""
+    global ASSETS_EXECUTOR
+    if ASSETS_EXECUTOR is not None:
+        ASSETS_EXECUTOR.shutdown()
+        ASSETS_EXECUTOR = None
 
-def pack_article_ALLxml():
+
+def pack_article_ALLxml(executor="thread"):
     """Gera os pacotes SPS a partir de um lista de XML validos.
 
     Args:
-       Não há argumentos
+       executor: ``thread`` (padrão) ou ``process``. No modo ``process`` os
+           XMLs são empacotados em processos (``PROCESSPOOL_MAX_WORKERS``),
+           evitando a disputa pelo GIL durante o parse e a escrita dos XMLs.
 
     Retornos:
         Sem retornos.
@@ -126,6 +172,19 @@ def pack_article_ALLxml():
 
     jobs = [{"file_xml_path": xml} for xml in xmls]
 
+    clean_stale_staging_dirs()
+
+    if executor == "process":
+        pool_executor = functools.partial(
+            concurrent.futures.ProcessPoolExecutor,
+            initializer=init_packing_worker,
+            initargs=(ISSNs, ASSET_STORE, int(config.get("PACKING_ASSET_THREADS"))),
+        )
+        max_workers = int(config.get("PROCESSPOOL_MAX_WORKERS"))
+    else:
+        pool_executor = concurrent.futures.ThreadPoolExecutor
+        max_workers = int(config.get("THREADPOOL_MAX_WORKERS"))
+
     with tqdm(total=len(xmls), initial=0) as pbar:
 
         def update_bar(pbar=pbar):
@@ -141,7 +200,8 @@ def pack_article_ALLxml():
         DoJobsConcurrently(
             pack_article_xml,
             jobs=jobs,
-            max_workers=int(config.get("THREADPOOL_MAX_WORKERS")),
+            executor=pool_executor,
+            max_workers=max_workers,
             exception_callback=log_exceptions,
             update_bar=update_bar,
         )
@@ -159,7 +219,9 @@ def get_asset(old_path, new_fname, dest_path):
     Retornos:
         Sem retornos.
 
-        Persiste o ativo no ``dest_path``
+        Persiste o ativo no ``dest_path`` a partir de ``ASSET_STORE``, se
+        configurado, ou de acordo com o modo ``ASSET_MATERIALIZATION_MODE``
+        (ver ``files.materialize_file``)
 
     Exceções:
         IOError
@@ -193,24 +255,166 @@ def get_asset(old_path, new_fname, dest_path):
             path = find_file(path)
             if path:
                 break
-        content = files.read_file_binary(path)
+        if ASSET_STORE is not None:
+            ASSET_STORE.materialize(path, dest_path_file)
+        else:
+            files.materialize_file(path, dest_path_file)
     except (TypeError, FileNotFoundError, IOError):
         raise AssetNotFoundError(f"Not found {old_path}")
+
+
+def get_assets(asset_replacements, dest_path):
+    """Obtém os ativos digitais de ``asset_replacements``, em paralelo caso
+    ``ASSETS_EXECUTOR`` esteja configurado.
+
+    Retornos:
+        Lista, na mesma ordem de ``asset_replacements``, com a exceção
+        ``AssetNotFoundError`` dos ativos não encontrados ou None.
+    """
+
+    def _get_asset(asset_replacement):
+        old_path, new_fname = asset_replacement
+        try:
+            get_asset(old_path, new_fname, dest_path)
+        except AssetNotFoundError as e:
+            return e
+
+    if ASSETS_EXECUTOR is None:
+        return [_get_asset(item) for item in asset_replacements]
+    return list(ASSETS_EXECUTOR.map(_get_asset, asset_replacements))
+
+
+def make_staging_dir(pkg_name):
+    """Cria a pasta em que o pacote ``pkg_name`` é montado antes de ser
+    publicado em ``SPS_PKG_PATH`` ou ``INCOMPLETE_SPS_PKG_PATH``.
+
+    O nome da pasta contém o PID do processo que a criou, o que permite
+    identificar pastas abandonadas por execuções interrompidas (ver
+    ``clean_stale_staging_dirs``)."""
+    staging_root = config.get("STAGING_SPS_PKG_PATH")
+    files.create_dir(staging_root)
+    return tempfile.mkdtemp(
+        prefix="%s.%d." % (pkg_name, os.getpid()), dir=staging_root
+    )
+
+
+def _process_is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def clean_stale_staging_dirs(staging_root=None):
+    """Remove as pastas de montagem de pacotes cujos processos não estão mais
+    em execução, isto é, pacotes incompletos deixados por execuções
+    interrompidas.
+
+    Retornos:
+        Lista com as pastas removidas.
+    """
+    staging_root = staging_root or config.get("STAGING_SPS_PKG_PATH")
+    if not os.path.isdir(staging_root):
+        return []
+
+    removed = []
+    with os.scandir(staging_root) as entries:
+        for entry in entries:
+            try:
+                pid = int(entry.name.rsplit(".", 2)[1])
+            except (IndexError, ValueError):
+                continue
+            if pid == os.getpid() or _process_is_alive(pid):
+                continue
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed.append(entry.path)
+
+    if removed:
+        logger.info("%s pastas de montagem abandonadas removidas", len(removed))
+    return removed
+
+
+def _rename_dir(source, target):
+    """Renomeia ``source`` para ``target``. Caso estejam em sistemas de
+    arquivos diferentes, o conteúdo é movido (operação não atômica)."""
+    try:
+        os.rename(source, target)
+    except OSError as exc:
+        if exc.errno != errno.EXDEV:
+            raise
+        logger.warning(
+            "%s e %s estão em sistemas de arquivos diferentes, "
+            "a publicação do pacote não é atômica", source, target
+        )
+        shutil.move(source, target)
+
+
+def _remove_dir(path):
+    """Remove a pasta ``path`` movendo-a antes para a pasta de montagem, de
+    modo que um pacote nunca fique parcialmente removido em seu destino."""
+    if not os.path.isdir(path):
+        return
+    trash = os.path.join(
+        config.get("STAGING_SPS_PKG_PATH"),
+        "%s.%d.%s" % (os.path.basename(path), os.getpid(), uuid.uuid4().hex),
+    )
+    try:
+        os.rename(path, trash)
+    except OSError as exc:
+        if exc.errno != errno.EXDEV:
+            raise
+        trash = path
+    shutil.rmtree(trash)
+
+
+def publish_package(staging_path, pkg_path, incomplete_pkg_path, pkg_name, errors):
+    """Publica o pacote montado em ``staging_path`` por meio de um único
+    ``os.rename`` para ``pkg_path`` ou, caso existam ``errors``, para
+    ``incomplete_pkg_path`` junto com o relatório de erros.
+
+    Retornos:
+        O caminho do pacote publicado.
+    """
+    if errors:
+        # garante que existe pastas diferentes para
+        # pacotes completos e incompletos
+        if pkg_path == incomplete_pkg_path:
+            incomplete_pkg_path += "_INCOMPLETE"
+        # gera relatorio de erros
+        errors_filename = os.path.join(staging_path, "%s.err" % pkg_name)
+        error_messages = "\n".join(["%s %s %s" % _err for _err in errors])
+        files.write_file(errors_filename, error_messages)
+        # remove versão completa gerada anteriormente
+        _remove_dir(pkg_path)
+        target_path = incomplete_pkg_path
     else:
-        files.write_file_binary(dest_path_file, content)
+        target_path = pkg_path
+
+    files.create_dir(os.path.dirname(target_path))
+    _remove_dir(target_path)
+    _rename_dir(staging_path, target_path)
+    return target_path
 
 
 def packing_assets(asset_replacements, pkg_path, incomplete_pkg_path, pkg_name,
-                   scielo_pid_v2):
+                   scielo_pid_v2, staging_path=None):
     """Tem a responsabilidade de ``empacotar`` os ativos digitais e retorna o
     path do pacote.
 
+    O pacote é montado em ``staging_path`` (ou em uma nova pasta criada por
+    ``make_staging_dir``) e publicado de uma só vez por ``publish_package``,
+    de modo que pacotes parcialmente gravados nunca fiquem visíveis.
+
     Args:
         asset_replacements: lista com os ativos
         pkg_path: caminho do pacote
         incomplete_pkg_path: caminho para os pacotes incompletos
         pkg_name: nome do pacote
         scielo_pid_v2: PID v2
+        staging_path: pasta de montagem do pacote
 
     Retornos:
         retorna o caminho ``pkg_path`` ou incomplete_pkg_path
@@ -219,55 +423,47 @@ def packing_assets(asset_replacements, pkg_path, incomplete_pkg_path, pkg_name,
         Não lança exceções.
     """
     errors = []
-    if not os.path.isdir(pkg_path):
-        files.make_empty_dir(pkg_path)
+    if staging_path is None:
+        staging_path = make_staging_dir(pkg_name)
 
-    for old_path, new_fname in asset_replacements:
-        try:
-            get_asset(old_path, new_fname, pkg_path)
-        except AssetNotFoundError as e:
-            logger.error(
-                "%s", {
-                    "pid": scielo_pid_v2,
-                    "pkg_name": pkg_name,
-                    "old_path": old_path,
-                    "new_fname": new_fname,
-                    "msg": str(e),
-                })
-            errors.append((old_path, new_fname, str(e)))
-
-    if len(errors) > 0:
-        # garante que existe pastas diferentes para
-        # pacotes completos e incompletos
-        if pkg_path == incomplete_pkg_path:
-            incomplete_pkg_path += "_INCOMPLETE"
-        # move pacote incompleto para a pasta de pacotes incompletos
-        files.make_empty_dir(incomplete_pkg_path)
-        for item in os.listdir(pkg_path):
-            shutil.move(os.path.join(pkg_path, item), incomplete_pkg_path)
-        shutil.rmtree(pkg_path)
-        # gera relatorio de erros
-        errors_filename = os.path.join(incomplete_pkg_path, "%s.err" % pkg_name)
-        error_messages = "\n".join(["%s %s %s" % _err for _err in errors])
-        files.write_file(errors_filename, error_messages)
-        return incomplete_pkg_path
-    return pkg_path
+    try:
+        for (old_path, new_fname), e in zip(
+            asset_replacements, get_assets(asset_replacements, staging_path)
+        ):
+            if e is not None:
+                logger.error(
+                    "%s", {
+                        "pid": scielo_pid_v2,
+                        "pkg_name": pkg_name,
+                        "old_path": old_path,
+                        "new_fname": new_fname,
+                        "msg": str(e),
+                    })
+                errors.append((old_path, new_fname, str(e)))
+
+        return publish_package(
+            staging_path, pkg_path, incomplete_pkg_path, pkg_name, errors
+        )
+    except BaseException:
+        shutil.rmtree(staging_path, ignore_errors=True)
+        raise
 
 
 def find_file(file_path):
     """
-    A partir de um dado path, pega o nome de arquivo mais semelhante
+    A partir de um dado path, pega o nome de arquivo mais semelhante.
+
+    A listagem da pasta é obtida de ``DIRECTORY_INDEX``, compartilhado entre
+    todos os ativos do empacotamento.
     """
     dirname = os.path.dirname(file_path)
     basename = os.path.basename(file_path)
-    try:
-        files = os.listdir(dirname)
-    except FileNotFoundError:
+    names = DIRECTORY_INDEX.get(dirname)
+    if names is None:
         return None
-    else:
-        found = case_insensitive_find(basename, files)
-        if found:
-            return os.path.join(dirname, found)
+    found = case_insensitive_find(basename, names)
+    if found:
+        return os.path.join(dirname, found)
 
 
 def case_insensitive_find(word, words):
@@ -275,17 +471,20 @@ def case_insensitive_find(word, words):
     Obtém a palavra que seja mais similar possível dentre uma lista de palavras
     A palavra obtida deve ser do mesmo tamanho
     Mas pode ter variações entre maiúsculas e minúsculas
+
+    ``words`` pode ser uma lista de palavras ou um mapa de palavras agrupadas
+    pelo seu valor em minúsculo (``files.group_by_lowercase``).
     """
-    if word in words:
-        return word
+    if not isinstance(words, dict):
+        words = files.group_by_lowercase(words)
 
-    _words = [w for w in words if len(w) == len(word)]
+    candidates = words.get(word.lower()) or []
+    if word in candidates:
+        return word
 
-    similar_items = difflib.get_close_matches(word, _words)
-    for item in similar_items:
-        if item.upper() == word.upper():
-            return item
+    similar_items = difflib.get_close_matches(word, candidates)
+    if similar_items:
+        return similar_items[0]
 
-    for item in _words:
-        if item.upper() == word.upper():
-            return item
+    if candidates:
+        return candidates[0]
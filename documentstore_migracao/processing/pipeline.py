@@ -22,11 +22,10 @@ from documentstore_migracao import exceptions, config
 from documentstore_migracao.utils import (
     extract_isis,
     add_document,
-    add_journal,
     update_journal,
-    add_bundle,
     update_bundle,
     get_nested,
+    bulk_writer,
 )
 from documentstore_migracao.processing import reading, conversion
 from documentstore_migracao.utils.xylose_converter import (
@@ -71,12 +70,11 @@ def import_journals(json_file: str, session: Session):
         journals_as_json = reading.read_json_file(json_file)
         manifests = conversion.conversion_journals_to_kernel(journals=journals_as_json)
 
-        for manifest in manifests:
-            journal = Journal(manifest=manifest)
-            try:
-                add_journal(session, journal)
-            except AlreadyExists as exc:
-                logger.info(exc)
+        with bulk_writer.BulkWriter(
+            session, int(config.get("KERNEL_BULK_WRITE_SIZE")) or 1
+        ) as writer:
+            for manifest in manifests:
+                writer.add_journal(Journal(manifest=manifest), on_duplicate=logger.info)
     except (FileNotFoundError, ValueError) as exc:
         logger.debug(exc)
 
@@ -90,12 +88,11 @@ def import_issues(json_file: str, session: Session):
     issues_as_xylose = filter_issues(issues_as_xylose)
     manifests = conversion.conversion_issues_to_kernel(issues_as_xylose)
 
-    for manifest in manifests:
-        issue = DocumentsBundle(manifest=manifest)
-        try:
-            add_bundle(session, issue)
-        except AlreadyExists as exc:
-            logger.info(exc)
+    with bulk_writer.BulkWriter(
+        session, int(config.get("KERNEL_BULK_WRITE_SIZE")) or 1
+    ) as writer:
+        for manifest in manifests:
+            writer.add_bundle(DocumentsBundle(manifest=manifest), on_duplicate=logger.info)
 
 
 def import_documents_bundles_link_with_journal(file_path: str, session: Session):
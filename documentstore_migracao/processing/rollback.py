@@ -12,6 +12,7 @@ from xylose.scielodocument import Journal
 from documentstore_migracao import exceptions, config
 from documentstore_migracao.utils import (
     scielo_ids_generator,
+    result_writer,
     DoJobsConcurrently,
     PoisonPill,
 )
@@ -237,15 +238,13 @@ def rollback_kernel_documents(
             if doc_info
         ]
 
-    with tqdm(total=len(jobs)) as pbar:
+    with tqdm(total=len(jobs)) as pbar, result_writer.ResultWriter(
+        output_path
+    ) as results:
 
         def update_bar(pbar=pbar):
             pbar.update(1)
 
-        def write_result_to_file(result, path=output_path):
-            with open(path, "a") as f:
-                f.write(json.dumps(result) + "\n")
-
         def exception_callback(exception, job, logger=logger):
             logger.exception(
                 "Could not roll back document '%s'. The following exception "
@@ -259,7 +258,7 @@ def rollback_kernel_documents(
             rollback_document,
             jobs=jobs,
             max_workers=1,
-            success_callback=write_result_to_file,
+            success_callback=results.write_json,
             exception_callback=exception_callback,
             update_bar=update_bar,
         )
@@ -1,6 +1,11 @@
+import io
 import os
+import json
+import queue
 import logging
 import shutil
+import threading
+from collections import Counter
 from tqdm import tqdm
 from packtools import XMLValidator, exceptions
 
@@ -11,12 +16,18 @@ from lxml import etree
 logger = logging.getLogger(__name__)
 
 
-def validate_article_xml(file_xml_path, print_error=True):
+def validate_article_xml(file_xml_path, print_error=True, content=None):
+    """Valida o XML ``file_xml_path`` por meio das regras da SPS vigente.
+
+    Caso ``content`` seja informado, os bytes do XML já presentes em memória
+    são utilizados no lugar de uma nova leitura do arquivo."""
 
     result = {}
     logger.debug(file_xml_path)
     try:
-        xmlvalidator = XMLValidator.parse(file_xml_path)
+        xmlvalidator = XMLValidator.parse(
+            io.BytesIO(content) if content is not None else file_xml_path
+        )
         if config.get("VALIDATE_ALL") == "TRUE":
             is_valid, errors = xmlvalidator.validate_all()
         else:
@@ -40,6 +51,7 @@ def validate_article_xml(file_xml_path, print_error=True):
                 "count": 1,
                 "lineno": [error.line],
                 "message": [error.message],
+                "level": [error.level],
                 "filename": {file_xml_path},
             }
             dicts.merge(result, message, data)
@@ -47,54 +59,155 @@ def validate_article_xml(file_xml_path, print_error=True):
     return result
 
 
-def validate_article_ALLxml(move_to_processed_source=False, move_to_valid_xml=False):
+class ErrorFileWriter:
+    """Grava os arquivos `.err` em uma thread separada da validação.
+
+    O conteúdo do arquivo é montado a partir dos bytes do XML já lidos pelo
+    validador, evitando uma nova leitura do XML convertido."""
+
+    def __init__(self, maxsize=100):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = threading.Thread(target=self._consume, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._queue.put(None)
+        self._thread.join()
+
+    def put(self, errors, err_file, content):
+        self._queue.put((errors, err_file, content))
+
+    def _consume(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                manage_error_file(*item)
+            except Exception as exc:
+                logger.error("Could not write error file '%s': %s", item[1], exc)
+
+
+class ValidationReport:
+    """Registra em um arquivo JSONL um registro por erro de validação
+    encontrado, contendo o arquivo, a linha, o nível e a chave da mensagem.
+    Os erros de leitura do XML, que não passam pelo validador, são
+    registrados sem nível.
+
+    Apenas contadores agregados por mensagem são mantidos em memória."""
+
+    def __init__(self, report_file):
+        self.report_file = report_file
+        self.messages = Counter()
+        self.valid_files = 0
+        self.invalid_files = 0
+        self._fp = None
+
+    def __enter__(self):
+        files.create_dir(os.path.dirname(self.report_file))
+        self._fp = open(self.report_file, "w", encoding="utf-8")
+        return self
+
+    def __exit__(self, *args):
+        self._fp.close()
+
+    def add(self, file_xml_path, errors):
+        if not errors:
+            self.valid_files += 1
+            return
+
+        self.invalid_files += 1
+        for message_key, data in errors.items():
+            levels = data.get("level", [None] * len(data["message"]))
+            if not len(data["lineno"]) == len(data["message"]) == len(levels):
+                raise ValueError(
+                    "Validation errors of '%s' have %s lines, %s messages and "
+                    "%s levels." % (
+                        file_xml_path,
+                        len(data["lineno"]),
+                        len(data["message"]),
+                        len(levels),
+                    )
+                )
+            for lineno, message, level in zip(data["lineno"], data["message"], levels):
+                self._fp.write(
+                    json.dumps(
+                        {
+                            "file": file_xml_path,
+                            "line": lineno,
+                            "level": level,
+                            "message_key": message_key,
+                            "message": message,
+                        }
+                    )
+                    + "\n"
+                )
+            self.messages[message_key] += data["count"]
+
+    def log_summary(self):
+        logger.info(
+            "%s valid files, %s invalid files. Report written to '%s'.",
+            self.valid_files,
+            self.invalid_files,
+            self.report_file,
+        )
+        for message_key, count in self.messages.most_common():
+            logger.error("%s - %s", message_key, count)
+
+
+def validate_article_ALLxml(
+    move_to_processed_source=False, move_to_valid_xml=False, report_file=None
+):
     logger.debug("Iniciando Validação dos xmls")
     list_files_xmls = files.xml_files_list(config.get("CONVERSION_PATH"))
 
     success_path = config.get("VALID_XML_PATH")
     errors_path = config.get("XML_ERRORS_PATH")
+    report_file = report_file or os.path.join(
+        config.get("ERRORS_PATH"), "validation.jsonl"
+    )
     func = shutil.move if move_to_valid_xml else shutil.copyfile
 
-    result = {}
-    for file_xml in tqdm(list_files_xmls):
-
-        filename, _ = files.extract_filename_ext_by_path(file_xml)
-        converted_file = os.path.join(config.get("CONVERSION_PATH"), file_xml)
+    with ValidationReport(report_file) as report, ErrorFileWriter() as err_writer:
+        for file_xml in tqdm(list_files_xmls):
 
-        try:
-            errors = validate_article_xml(converted_file, False)
+            filename, _ = files.extract_filename_ext_by_path(file_xml)
+            converted_file = os.path.join(config.get("CONVERSION_PATH"), file_xml)
 
-            for k_error, v_error in errors.items():
-                dicts.merge(result, k_error, v_error)
+            try:
+                content = files.read_file_binary(converted_file)
+                errors = validate_article_xml(converted_file, False, content=content)
+                report.add(converted_file, errors)
 
-            if errors_path:
-                manage_error_file(
-                    errors,
-                    os.path.join(errors_path, "%s.err" % filename),
-                    converted_file,
-                )
+                if errors_path:
+                    err_writer.put(
+                        errors, os.path.join(errors_path, "%s.err" % filename), content
+                    )
 
-            if not errors:
-                if success_path:
-                    func(converted_file, os.path.join(success_path, file_xml))
+                if not errors:
+                    if success_path:
+                        func(converted_file, os.path.join(success_path, file_xml))
 
-                if move_to_processed_source:
-                    files.move_xml_to(
-                        "%s.xml" % filename,
-                        config.get("SOURCE_PATH"),
-                        config.get("PROCESSED_SOURCE_PATH"),
-                    )
+                    if move_to_processed_source:
+                        files.move_xml_to(
+                            "%s.xml" % filename,
+                            config.get("SOURCE_PATH"),
+                            config.get("PROCESSED_SOURCE_PATH"),
+                        )
 
-        except Exception as ex:
-            logger.exception(ex)
-            raise
+            except Exception as ex:
+                logger.exception(ex)
+                raise
 
-    analase = sorted(result.items(), key=lambda x: x[1]["count"], reverse=True)
-    for k_result, v_result in analase:
-        logger.error("%s - %s", k_result, v_result["count"])
+    report.log_summary()
 
 
-def manage_error_file(errors, err_file, converted_file):
+def manage_error_file(errors, err_file, content):
+    """Grava o arquivo ``err_file`` com os bytes do XML (``content``) seguidos
+    das mensagens de erro. Remove o arquivo caso não existam erros."""
     if os.path.isfile(err_file):
         try:
             os.unlink(err_file)
@@ -112,7 +225,8 @@ def manage_error_file(errors, err_file, converted_file):
                 ]
             )
 
-        files.write_file(
+        files.write_file_binary(
             err_file,
-            "%s %s\n%s" % (files.read_file(converted_file), "=" * 80, "\n".join(msg)),
+            b"%s %s\n%s"
+            % (content, b"=" * 80, "\n".join(msg).encode("utf-8")),
         )
@@ -6,16 +6,18 @@ from documentstore.domain import utcnow
 from documentstore.services import DocumentRenditions
 
 
+def _change(instance, entity, id=None):
+    return {
+        "timestamp": utcnow(),
+        "entity": entity,
+        "id": id or instance.id(),
+        "content_gz": gzip.compress(instance.data_bytes()),
+        "content_type": instance.data_type,
+    }
+
+
 def _add_change(session, instance, entity, id=None):
-    session.changes.add(
-        {
-            "timestamp": utcnow(),
-            "entity": entity,
-            "id": id or instance.id(),
-            "content_gz": gzip.compress(instance.data_bytes()),
-            "content_type": instance.data_type,
-        }
-    )
+    session.changes.add(_change(instance, entity, id))
 
 
 def add_document(session, document):
@@ -49,6 +51,19 @@ def add_renditions(session, document):
     )
 
 
+def mongodb_collection(session, name):
+    """Retorna a coleção `name` do MongoDB utilizado por `session` ou None.
+
+    `documentstore.adapters.Session` não expõe o adaptador do MongoDB, que é
+    obtido do atributo `_mongodb_client`, como em `rollback.RollbackSession`.
+    Sessões sem o adaptador (ex: as sessões em memória dos testes) retornam
+    None e devem ser acessadas pelos seus repositórios."""
+    mongodb_client = getattr(session, "_mongodb_client", None)
+    if mongodb_client is None:
+        return None
+    return getattr(mongodb_client, name, None)
+
+
 class PoisonPill:
     """Sinaliza para as threads que devem abortar a execução da rotina e 
     retornar imediatamente.
@@ -66,6 +81,7 @@ def DoJobsConcurrently(
     success_callback: callable = (lambda *k: k),
     exception_callback: callable = (lambda *k: k),
     update_bar: callable = (lambda *k: k),
+    max_pending: int = None,
 ):
     """Executa uma lista de tarefas concorrentemente.
 
@@ -78,28 +94,48 @@ def DoJobsConcurrently(
     success_callback (callable): Função executada ao finalizar a execução de cada job.
     exception_callback (callable): Função executada durante o tratamento de exceções.
     update_bar (callable): Função responsável por atualizar a posição da barra de status.
+    max_pending (integer): Quantidade máxima de jobs submetidos e ainda não
+        finalizados. Quando informado, ``jobs`` pode ser um gerador, que é
+        consumido à medida que os jobs são finalizados.
 
     Returns:
         None
     """
     poison_pill = PoisonPill()
 
-    with executor(max_workers=max_workers) as _executor:
-        futures = {
-            _executor.submit(func, **job, poison_pill=poison_pill): job for job in jobs
-        }
+    def handle(future, job):
+        try:
+            result = future.result()
+        except Exception as exc:
+            exception_callback(exc, job)
+        else:
+            success_callback(result)
+        finally:
+            update_bar()
 
+    with executor(max_workers=max_workers) as _executor:
         try:
-            for future in concurrent.futures.as_completed(futures):
-                job = futures[future]
-                try:
-                    result = future.result()
-                except Exception as exc:
-                    exception_callback(exc, job)
-                else:
-                    success_callback(result)
-                finally:
-                    update_bar()
+            if max_pending is None:
+                futures = {
+                    _executor.submit(func, **job, poison_pill=poison_pill): job
+                    for job in jobs
+                }
+                for future in concurrent.futures.as_completed(futures):
+                    handle(future, futures[future])
+            else:
+                futures = {}
+                for job in jobs:
+                    if len(futures) >= max_pending:
+                        done, _ = concurrent.futures.wait(
+                            futures, return_when=concurrent.futures.FIRST_COMPLETED
+                        )
+                        for future in done:
+                            handle(future, futures.pop(future))
+                    futures[
+                        _executor.submit(func, **job, poison_pill=poison_pill)
+                    ] = job
+                for future in concurrent.futures.as_completed(futures):
+                    handle(future, futures[future])
         except KeyboardInterrupt:
             logging.info(
                 "Finalizando as tarefas pendentes antes de encerrar."
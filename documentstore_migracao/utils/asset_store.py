@@ -0,0 +1,241 @@
+# Coding: utf-8
+
+"""
+Armazenamento local de ativos digitais endereçado pelo conteúdo.
+
+Os mesmos ativos (`seta.gif`, logos de periódicos, figuras compartilhadas) são
+empacotados em milhares de pacotes SPS. O `AssetStore` mantém uma única cópia
+de cada conteúdo, identificada pela soma SHA-1, na seguinte estrutura:
+
+    <ASSET_STORE_DIR>/ab/abcdef0123456789...
+
+Os pacotes referenciam os objetos do armazenamento por meio de hard links. A
+soma SHA-1 de cada ativo disponibilizado é registrada fora dos pacotes, no
+banco SQLite `checksums.db` do armazenamento, permitindo que as etapas
+seguintes (ex: registro no object storage) conheçam a soma sem ler o arquivo
+novamente.
+
+O registro é identificado pelo dispositivo e pelo inode do arquivo, e não
+pelo caminho, pois os pacotes são montados em uma pasta temporária e movidos
+ao final do empacotamento. O tamanho e o mtime registrados descartam as somas
+de arquivos alterados depois do registro, e o registro anterior de um mesmo
+caminho é substituído quando o pacote é reconstruído.
+"""
+
+import os
+import sqlite3
+import logging
+import tempfile
+import threading
+from functools import lru_cache
+from typing import Optional
+
+from documentstore_migracao import config
+from documentstore_migracao.utils import files
+
+logger = logging.getLogger(__name__)
+
+CHECKSUMS_FILENAME = "checksums.db"
+
+# `ChecksumIndex` consultado por `known_sha1`, ver `checksum_index`
+CHECKSUM_INDEX = None
+
+
+@lru_cache(maxsize=65536)
+def _sha1(path: str, size: int, mtime_ns: int) -> str:
+    return files.sha1(path)
+
+
+def file_sha1(path: str) -> str:
+    """Retorna a soma SHA-1 de `path`. O resultado é memorizado pelo caminho,
+    tamanho e mtime do arquivo, evitando que um mesmo ativo de origem seja lido
+    novamente a cada pacote que o referencia."""
+    stat = os.stat(path)
+    return _sha1(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+class ChecksumIndex:
+    """Somas SHA-1 dos ativos disponibilizados nos pacotes.
+
+    O banco é compartilhado pelas threads e pelos processos de empacotamento
+    e de importação, como o cache de `object_store.known_objects`. Falhas no
+    acesso são tratadas como somas desconhecidas.
+
+    Args:
+        path: arquivo SQLite do índice
+        timeout: tempo máximo, em segundos, de espera por um banco bloqueado
+    """
+
+    def __init__(self, path: str, timeout: float = 30):
+        self.path = path
+        self.timeout = timeout
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(_connection=None, _lock=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=self.timeout, check_same_thread=False
+            )
+            try:
+                connection.execute("PRAGMA journal_mode=WAL")
+                with connection:
+                    connection.execute(
+                        "CREATE TABLE IF NOT EXISTS checksums ("
+                        "dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER, "
+                        "sha1 TEXT, path TEXT, PRIMARY KEY (dev, ino))"
+                    )
+                    connection.execute(
+                        "CREATE INDEX IF NOT EXISTS checksums_path "
+                        "ON checksums (path)"
+                    )
+            except sqlite3.Error:
+                connection.close()
+                raise
+            self._connection = connection
+        return self._connection
+
+    def record(self, path: str, sha1: str) -> None:
+        """Registra a soma SHA-1 do arquivo `path`"""
+        stat = os.stat(path)
+        path = os.path.abspath(path)
+        try:
+            with self._lock:
+                connection = self._connect()
+                with connection:
+                    connection.execute("DELETE FROM checksums WHERE path = ?", (path,))
+                    connection.execute(
+                        "INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?, ?)",
+                        (
+                            stat.st_dev,
+                            stat.st_ino,
+                            stat.st_size,
+                            stat.st_mtime_ns,
+                            sha1,
+                            path,
+                        ),
+                    )
+        except sqlite3.Error as exc:
+            logger.warning("Could not record checksum of '%s': %s", path, exc)
+
+    def get(self, path: str) -> Optional[str]:
+        """Retorna a soma SHA-1 registrada para `path` ou None caso não exista
+        registro ou caso o arquivo tenha sido alterado depois do registro"""
+        try:
+            stat = os.stat(path)
+            with self._lock:
+                row = (
+                    self._connect()
+                    .execute(
+                        "SELECT size, mtime_ns, sha1 FROM checksums "
+                        "WHERE dev = ? AND ino = ?",
+                        (stat.st_dev, stat.st_ino),
+                    )
+                    .fetchone()
+                )
+        except OSError:
+            return None
+        except sqlite3.Error as exc:
+            logger.warning("Could not read checksums from '%s': %s", self.path, exc)
+            return None
+
+        if row is None or (stat.st_size, stat.st_mtime_ns) != row[:2]:
+            return None
+        return row[2]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def checksum_index() -> Optional[ChecksumIndex]:
+    """Retorna o índice do `AssetStore` utilizado neste processo ou, na
+    ausência deste, o do armazenamento em `ASSET_STORE_DIR`, caso exista"""
+    global CHECKSUM_INDEX
+    if CHECKSUM_INDEX is None:
+        store_path = config.get("ASSET_STORE_DIR")
+        index_path = store_path and os.path.join(store_path, CHECKSUMS_FILENAME)
+        if index_path and os.path.isfile(index_path):
+            CHECKSUM_INDEX = ChecksumIndex(index_path)
+    return CHECKSUM_INDEX
+
+
+def known_sha1(path: str) -> Optional[str]:
+    """Retorna a soma SHA-1 registrada para `path` pelo `AssetStore`. Retorna
+    None caso não exista registro ou caso o arquivo tenha sido alterado
+    (tamanho ou mtime) depois do registro."""
+    index = checksum_index()
+    if index is None:
+        return None
+    return index.get(path)
+
+
+class AssetStore:
+    """Armazenamento de ativos digitais endereçado pela soma SHA-1.
+
+    Os objetos são incluídos no armazenamento por meio de reflink ou cópia e
+    disponibilizados nos pacotes de acordo com `mode` (por padrão `hardlink`).
+    """
+
+    def __init__(self, path: str, mode: str = "hardlink"):
+        global CHECKSUM_INDEX
+        self.path = path
+        self.mode = mode
+        os.makedirs(path, exist_ok=True)
+        self.checksums = CHECKSUM_INDEX = ChecksumIndex(
+            os.path.join(path, CHECKSUMS_FILENAME)
+        )
+
+    def __setstate__(self, state):
+        global CHECKSUM_INDEX
+        self.__dict__.update(state)
+        CHECKSUM_INDEX = self.checksums
+
+    def object_path(self, sha1: str) -> str:
+        return os.path.join(self.path, sha1[:2], sha1)
+
+    def add(self, source: str) -> str:
+        """Inclui `source` no armazenamento, caso o seu conteúdo ainda não
+        esteja presente, e retorna a sua soma SHA-1"""
+        sha1 = file_sha1(source)
+        object_path = self.object_path(sha1)
+        if os.path.exists(object_path):
+            return sha1
+
+        folder = os.path.dirname(object_path)
+        os.makedirs(folder, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=folder, prefix=".tmp-")
+        os.close(fd)
+        try:
+            files.materialize_file(source, temp_path, "reflink")
+            os.replace(temp_path, object_path)
+        except Exception:
+            if os.path.lexists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+        logger.debug("Ativo %s armazenado em %s", source, object_path)
+        return sha1
+
+    def materialize(self, source: str, destination: str) -> str:
+        """Disponibiliza `source` em `destination` a partir do objeto
+        armazenado e registra a sua soma SHA-1.
+
+        Retorna o caminho do arquivo criado."""
+        sha1 = self.add(source)
+        if os.path.isdir(destination):
+            destination = os.path.join(destination, os.path.basename(source))
+        files.materialize_file(self.object_path(sha1), destination, self.mode)
+        self.checksums.record(destination, sha1)
+        return destination
@@ -1,6 +1,7 @@
 #!/usr/bin/python
 # coding: utf-8
 import os
+import errno
 import shutil
 import sys
 import argparse
@@ -8,8 +9,14 @@ import textwrap
 import json
 import csv
 import logging
+import time
+import queue
 import pathlib
+import threading
+import multiprocessing
+import concurrent.futures
 from copy import deepcopy
+from collections import Counter
 
 import fs
 import packtools
@@ -18,7 +25,13 @@ from lxml import etree
 from tqdm import tqdm
 
 from documentstore_migracao import config
-from documentstore_migracao.utils import xml, files, DoJobsConcurrently
+from documentstore_migracao.utils import (
+    xml,
+    files,
+    optimised_assets,
+    package_fingerprints,
+    DoJobsConcurrently,
+)
 from documentstore_migracao.export.sps_package import SPS_Package
 from documentstore_migracao.export.sps_package import (
     InvalidAttributeValueError,
@@ -43,14 +56,51 @@ class BuildPSPackage(object):
     """
 
     def __init__(
-        self, xml_folder, img_folder, pdf_folder, out_folder, articles_csvfile
+        self,
+        xml_folder,
+        img_folder,
+        pdf_folder,
+        out_folder,
+        articles_csvfile,
+        assets_mode=None,
+        asset_store=None,
+        acrons=None,
+        years=None,
+        skip_pids=None,
+        optimised_cache=None,
+        fingerprints=None,
+        site_index=None,
     ):
         self.xml_folder = xml_folder
         self.img_folder = img_folder
         self.pdf_folder = pdf_folder
         self.out_folder = out_folder
         self.articles_csvfile = articles_csvfile
+        self.assets_mode = assets_mode or config.get("ASSET_MATERIALIZATION_MODE")
+        self.asset_store = asset_store
+        self.acrons = set(acron.lower() for acron in acrons or [])
+        self.years = set(years or [])
+        self.skip_pids = set(skip_pids or [])
+        self.optimised_cache = optimised_cache
+        self.fingerprints = fingerprints
+        self.site_index = site_index
+        self.rejected_rows = Counter()
         self.issns = {}
+        self._package_sources = {}
+        self._sources_lock = threading.Lock()
+
+    def __getstate__(self):
+        # as fontes dos pacotes em coleta não são compartilhadas entre
+        # processos
+        state = self.__dict__.copy()
+        for attr in ("_package_sources", "_sources_lock"):
+            del state[attr]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._package_sources = {}
+        self._sources_lock = threading.Lock()
 
     @property
     def xml_fs(self):
@@ -89,6 +139,167 @@ class BuildPSPackage(object):
         except errors.ResourceNotFound as e:
             logger.error(e)
 
+    def materialize_asset(self, source_path, target_path):
+        """Disponibiliza o ativo ``source_path`` no pacote ``target_path`` a
+        partir do ``asset_store``, se configurado, ou de acordo com
+        ``assets_mode``."""
+        fingerprint = self.source_fingerprint(source_path)
+        if self.asset_store is not None:
+            result = self.asset_store.materialize(source_path, target_path)
+        else:
+            result = files.materialize_file(source_path, target_path, self.assets_mode)
+        if self.fingerprints is not None:
+            self.add_package_source(os.path.dirname(result), source_path, fingerprint)
+        return result
+
+    def _site_index_key(self, source_path):
+        """Retorna (pasta raiz, árvore, acrônimo, pasta do número, nome) de
+        ``source_path`` no índice do site ou None"""
+        for tree, root in (
+            ("xml", self.xml_folder),
+            ("pdf", self.pdf_folder),
+            ("img", self.img_folder),
+        ):
+            relative = os.path.relpath(source_path, root)
+            if relative.startswith(os.pardir):
+                continue
+            parts = relative.split(os.sep, 2)
+            if len(parts) == 3:
+                return (root, tree) + tuple(parts)
+        return None
+
+    def find_source(self, source_path):
+        """Retorna o caminho de ``source_path`` encontrado no ``site_index`` ou
+        None caso o arquivo não exista. O nome do arquivo encontrado pode
+        diferir de ``source_path`` na caixa.
+
+        Sem índice, ``source_path`` é retornado caso exista."""
+        key = self.site_index and self._site_index_key(source_path)
+        if not key:
+            return source_path if os.path.isfile(source_path) else None
+        root, tree, acron, issue_folder, filename = key
+        found = self.site_index.find(tree, acron, issue_folder, filename)
+        return found and os.path.join(root, *found.split("/"))
+
+    def collect_source(self, source_path, target_path):
+        """Disponibiliza ``source_path`` no pacote ``target_path``.
+
+        Com o ``site_index``, a ausência do arquivo é verificada em memória e
+        o arquivo encontrado com outra caixa é gravado no pacote com o nome
+        de ``source_path``, referenciado no XML."""
+        if self.site_index is None:
+            return self.materialize_asset(source_path, target_path)
+
+        found = self.find_source(source_path)
+        if found is None:
+            raise FileNotFoundError(errno.ENOENT, "No such file or directory", source_path)
+        if found != source_path:
+            target_path = os.path.join(target_path, os.path.basename(source_path))
+        return self.materialize_asset(found, target_path)
+
+    def list_source_files(self, source_path):
+        """Retorna as tuplas (nome, caminho) dos arquivos da pasta
+        ``source_path``, obtidas do ``site_index`` se configurado"""
+        key = self.site_index and self._site_index_key(
+            os.path.join(source_path, "*")
+        )
+        if not key:
+            with os.scandir(source_path) as it:
+                return [(entry.name, entry.path) for entry in it if entry.is_file()]
+        root, tree, acron, issue_folder, __ = key
+        return [
+            (name, os.path.join(root, *path.split("/")))
+            for name, path in self.site_index.listdir(tree, acron, issue_folder)
+            if "/" not in name
+        ]
+
+    def source_fingerprint(self, source_path):
+        """Impressão digital de ``source_path`` no modo incremental, obtida
+        antes da leitura do arquivo: uma alteração durante o empacotamento
+        provoca a reconstrução do pacote na próxima execução"""
+        if self.fingerprints is None:
+            return None
+        return package_fingerprints.file_fingerprint(source_path)
+
+    def add_package_source(self, target_path, source_path, fingerprint):
+        """Registra ``source_path``, com a sua impressão digital, como fonte do
+        pacote ``target_path`` no modo incremental"""
+        if self.fingerprints is None:
+            return
+        with self._sources_lock:
+            sources = self._package_sources.get(target_path)
+            if sources is not None:
+                sources["files"][source_path] = fingerprint
+
+    def package_inputs(self, row):
+        """Resumo dos dados de entrada de um pacote, além das suas fontes"""
+        return package_fingerprints.inputs_digest(
+            list(row.values()),
+            self.issns and self.issns.get(row["pid"][1:10]),
+            self.assets_mode,
+            optimised_assets.OPTIMISER_SETTINGS,
+        )
+
+    def is_package_up_to_date(self, row, xml_relative_path):
+        """Indica, no modo incremental, se o pacote de ``xml_relative_path``
+        foi gerado a partir das mesmas fontes e dados de entrada"""
+        if self.fingerprints is None:
+            return False
+        target_folder, ext = os.path.splitext(xml_relative_path)
+        return self.fingerprints.is_up_to_date(
+            xml_relative_path,
+            self.package_inputs(row),
+            os.path.join(self.out_folder, target_folder),
+        )
+
+    def start_package_sources(self, row, xml_relative_path, target_path):
+        if self.fingerprints is None:
+            return
+        # um pacote interrompido durante a montagem deve ser reconstruído
+        self.fingerprints.forget(xml_relative_path)
+        acron, issue_folder, pack_name = self.get_acron_issuefolder_packname(
+            xml_relative_path
+        )
+        with self._sources_lock:
+            self._package_sources[target_path] = {
+                "package": xml_relative_path,
+                "inputs": self.package_inputs(row),
+                "files": {},
+                "dirs": {
+                    path: package_fingerprints.file_fingerprint(path)
+                    for path in (
+                        os.path.join(self.pdf_folder, acron, issue_folder),
+                        os.path.join(self.img_folder, acron, issue_folder),
+                    )
+                },
+            }
+
+    def finish_package(self, target_path):
+        """Registra, no modo incremental, as impressões digitais das fontes do
+        pacote ``target_path`` gerado com sucesso"""
+        if self.fingerprints is None:
+            return
+        with self._sources_lock:
+            sources = self._package_sources.pop(target_path, None)
+        if sources is None:
+            return
+        self.fingerprints.record(
+            sources["package"], sources["inputs"], sources["files"], sources["dirs"]
+        )
+        self.fingerprints.report(sources["package"], package_fingerprints.REBUILT)
+
+    def discard_package(self, target_path):
+        """Descarta, no modo incremental, as fontes do pacote ``target_path``
+        que não pôde ser gerado, de forma que seja reconstruído na próxima
+        execução"""
+        if self.fingerprints is None:
+            return
+        with self._sources_lock:
+            sources = self._package_sources.pop(target_path, None)
+        if sources is None:
+            return
+        self.fingerprints.report(sources["package"], package_fingerprints.FAILED)
+
     def _update_sps_package_obj(self, sps_package, pack_name, row, xml_target_path) -> SPS_Package:
         """
         Atualiza instancia SPS_Package com os dados de artigos do arquivo
@@ -210,7 +421,13 @@ class BuildPSPackage(object):
             xml_path = pathlib.PurePosixPath(file_path)
 
         csv_file_path = pathlib.Path(self.xml_folder) / xml_path
-        if csv_file_path.is_file():
+        if self.site_index is not None:
+            found = self.find_source(str(csv_file_path))
+            if found == str(csv_file_path):
+                return str(file_path)
+            elif found is not None:
+                return os.path.relpath(found, self.xml_folder)
+        elif csv_file_path.is_file():
             return str(file_path)
 
         logger.debug(
@@ -236,7 +453,9 @@ class BuildPSPackage(object):
 
     def collect_xml(self, xml_relative_path, target_path):
         source_xml_path = os.path.join(self.xml_folder, xml_relative_path)
+        fingerprint = self.source_fingerprint(source_xml_path)
         shutil.copy(source_xml_path, target_path)
+        self.add_package_source(target_path, source_xml_path, fingerprint)
         xml_target_path = os.path.join(
             target_path, os.path.basename(xml_relative_path))
         return xml_target_path
@@ -279,7 +498,7 @@ class BuildPSPackage(object):
                 source_file_path = os.path.join(source_path, rendition)
 
                 try:
-                    shutil.copy(source_file_path, target_path)
+                    self.collect_source(source_file_path, target_path)
                 except FileNotFoundError:
                     logger.error(
                         "[%s] - Could not find rendition '%s' during packing XML '%s.xml'.",
@@ -307,15 +526,14 @@ class BuildPSPackage(object):
         # Try to find other files with the same filename root
         filenames_to_update = []
         filename_root, __ = os.path.splitext(img_filename)
-        with os.scandir(source_path) as it:
-            for entry in it:
-                entry_name_root, __ = os.path.splitext(os.path.basename(entry.name))
-                if entry.is_file() and entry_name_root == filename_root:
-                    logger.debug(
-                        'Found alternative "%s" for asset "%s"', entry.name, img_filename
-                    )
-                    shutil.copy(os.path.join(source_path, entry.name), target_path)
-                    filenames_to_update.append(entry.name)
+        for entry_name, entry_path in self.list_source_files(source_path):
+            entry_name_root, __ = os.path.splitext(entry_name)
+            if entry_name_root == filename_root:
+                logger.debug(
+                    'Found alternative "%s" for asset "%s"', entry_name, img_filename
+                )
+                self.materialize_asset(entry_path, target_path)
+                filenames_to_update.append(entry_name)
         return filenames_to_update
 
     def update_xml_with_alternatives(
@@ -395,7 +613,7 @@ class BuildPSPackage(object):
                     os.path.join(self.pdf_folder, acron, issue_folder),
                     os.path.join(self.img_folder, acron, issue_folder),
                 ]:
-                    if os.path.exists(os.path.join(path, asset_name)):
+                    if self.find_source(os.path.join(path, asset_name)) is not None:
                         return path
             return os.path.join(self.img_folder, acron, issue_folder)
 
@@ -407,7 +625,7 @@ class BuildPSPackage(object):
             logger.debug('Collection asset "%s" to %s', asset_source_path, target_path)
 
             try:
-                shutil.copy(asset_source_path, target_path)
+                self.collect_source(asset_source_path, target_path)
             except FileNotFoundError:
                 alternatives = self.collect_asset_alternatives(
                     asset_name, source_path, target_path
@@ -425,6 +643,10 @@ class BuildPSPackage(object):
             self.update_xml_with_alternatives(assets_alternatives, sps_package, xml_target_path)
 
     def optimise_xml_to_web(self, target_path, xml_target_path, pid):
+        """Otimiza o XML e os ativos digitais do pacote ``target_path``.
+
+        Retorna False caso o XML não possa ser otimizado ou algum ativo
+        otimizado não possa ser gravado."""
         xml_filename = os.path.basename(xml_target_path)
 
         def read_file(filename):
@@ -446,9 +668,18 @@ class BuildPSPackage(object):
 
         logger.debug("Optimizing XML file %s", xml_filename)
         try:
-            xml_web_optimiser = packtools.XMLWebOptimiser(
-                xml_filename, os.listdir(target_path), read_file, target_path
-            )
+            if self.optimised_cache is not None:
+                xml_web_optimiser = optimised_assets.CachedXMLWebOptimiser(
+                    xml_filename,
+                    os.listdir(target_path),
+                    read_file,
+                    target_path,
+                    cache=self.optimised_cache,
+                )
+            else:
+                xml_web_optimiser = packtools.XMLWebOptimiser(
+                    xml_filename, os.listdir(target_path), read_file, target_path
+                )
         except (etree.XMLSyntaxError, etree.SerialisationError) as exc:
             logger.error(
                 '[%s] - Error creating XMLWebOptimiser for "%s": %s',
@@ -456,7 +687,9 @@ class BuildPSPackage(object):
                 xml_target_path,
                 str(exc),
             )
+            return False
         else:
+            optimised = True
             optimised_xml = xml_web_optimiser.get_xml_file()
             logger.debug("Saving optimised XML file %s", xml_filename)
             xml.objXML2file(xml_target_path, etree.fromstring(optimised_xml), pretty=True)
@@ -471,10 +704,9 @@ class BuildPSPackage(object):
                         asset_filename,
                         xml_filename,
                     )
+                    optimised = False
                 else:
-                    image_target_path = os.path.join(target_path, asset_filename)
-                    logger.debug('Saving image file "%s"', image_target_path)
-                    files.write_file_binary(image_target_path, asset_bytes)
+                    self.save_optimised_asset(target_path, asset_filename, asset_bytes)
             for asset_filename, asset_bytes in xml_web_optimiser.get_assets_thumbnails():
                 if asset_bytes is None:
                     logger.error(
@@ -484,10 +716,18 @@ class BuildPSPackage(object):
                         asset_filename,
                         xml_filename,
                     )
+                    optimised = False
                 else:
-                    image_target_path = os.path.join(target_path, asset_filename)
-                    logger.debug('Saving image file "%s"', image_target_path)
-                    files.write_file_binary(image_target_path, asset_bytes)
+                    self.save_optimised_asset(target_path, asset_filename, asset_bytes)
+            return optimised
+
+    def save_optimised_asset(self, target_path, asset_filename, asset_bytes):
+        image_target_path = os.path.join(target_path, asset_filename)
+        logger.debug('Saving image file "%s"', image_target_path)
+        # O arquivo existente pode ser um hard link para o ativo de origem
+        if os.path.lexists(image_target_path):
+            os.unlink(image_target_path)
+        files.write_file_binary(image_target_path, asset_bytes)
 
     def get_acron_issuefolder_packname(self, xml_relative_path):
         dirname = os.path.dirname(xml_relative_path)
@@ -497,7 +737,13 @@ class BuildPSPackage(object):
         issue_folder = os.path.basename(dirname)
         return acron, issue_folder, pack_name
 
-    def start_collect(self, row, poison_pill=None):
+    def collect_package(self, row):
+        """Etapa de I/O do empacotamento: copia o XML, atualiza-o com os dados
+        de ``row`` e obtém as manifestações e os ativos digitais.
+
+        Retorna a tupla (``target_path``, ``xml_target_path``, PID) a ser
+        otimizada por ``optimise_xml_to_web`` ou None caso o pacote não possa
+        ser montado."""
         if len(row) == 0:
             return
 
@@ -514,7 +760,25 @@ class BuildPSPackage(object):
         ) = row.values()
 
         xml_relative_path = self.get_existing_xml_path(f_file, f_acron, f_volnum)
+        if self.is_package_up_to_date(row, xml_relative_path):
+            logger.debug("[%s] Package '%s' is up to date.", f_pid, xml_relative_path)
+            self.fingerprints.report(xml_relative_path, package_fingerprints.SKIPPED)
+            return
         target_path = self.get_target_path(xml_relative_path)
+        self.start_package_sources(row, xml_relative_path, target_path)
+        try:
+            package = self._collect_package(
+                row, xml_relative_path, target_path
+            )
+        except Exception:
+            self.discard_package(target_path)
+            raise
+        if package is None:
+            self.discard_package(target_path)
+        return package
+
+    def _collect_package(self, row, xml_relative_path, target_path):
+        f_pid, *_ = row.values()
         logger.debug(
             "Processing ID: %s, XML: %s, Package: %s",
             f_pid,
@@ -560,9 +824,53 @@ class BuildPSPackage(object):
                     xml_target_path,
                     f_pid,
                 )
-                self.optimise_xml_to_web(target_path, xml_target_path, f_pid)
+                return target_path, xml_target_path, f_pid
 
-    def run(self):
+    def start_collect(self, row, poison_pill=None):
+        package = self.collect_package(row)
+        if package is not None:
+            self.optimise_package(package)
+
+    def optimise_package(self, package):
+        """Otimiza ``package`` e registra as suas fontes caso a otimização
+        tenha sucesso"""
+        try:
+            optimised = self.optimise_xml_to_web(*package)
+        except Exception:
+            self.discard_package(package[0])
+            raise
+        if optimised:
+            self.finish_package(package[0])
+        else:
+            self.discard_package(package[0])
+
+    def accept_row(self, row):
+        """Indica se o artigo de ``row`` deve ser empacotado de acordo com os
+        filtros de acrônimos, de anos (obtido do PID) e a lista de PIDs a
+        serem ignorados. As linhas recusadas são contadas por motivo em
+        ``rejected_rows`` e as linhas sem PID são registradas no log"""
+        if not row:
+            return False
+        if not row.get("pid"):
+            logger.error("Could not pack article without pid: '%s'.", row)
+            self.rejected_rows["pid"] += 1
+            return False
+        if self.acrons and (row.get("acron") or "").lower() not in self.acrons:
+            self.rejected_rows["acron"] += 1
+            return False
+        if self.years and row["pid"][10:14] not in self.years:
+            self.rejected_rows["year"] += 1
+            return False
+        if self.skip_pids and (
+            row["pid"] in self.skip_pids or row.get("aop_pid") in self.skip_pids
+        ):
+            self.rejected_rows["skip_pids"] += 1
+            return False
+        return True
+
+    def read_jobs(self):
+        """Lê o arquivo CSV de artigos sob demanda, produzindo um job para
+        cada linha aceita por ``accept_row``"""
         fieldnames = (
             "pid",
             "aop_pid",
@@ -577,8 +885,153 @@ class BuildPSPackage(object):
         with open(self.articles_csvfile, encoding="utf-8", errors="replace") as csvfile:
             # pid, aoppid, file, pubdate, epubdate, update, acron, volnum
             articles_data_reader = csv.DictReader(csvfile, fieldnames=fieldnames)
-            jobs = [{"row": row} for row in articles_data_reader]
-            with tqdm(total=len(jobs)) as pbar:
+            for row in articles_data_reader:
+                if self.accept_row(row):
+                    yield {"row": row}
+
+    def run(self):
+        max_workers = int(config.get("THREADPOOL_MAX_WORKERS"))
+        with tqdm() as pbar:
+
+            def update_bar(pbar=pbar):
+                pbar.update(1)
+
+            def exception_callback(exception, job, logger=logger):
+                logger.error(
+                    "Could not import package '%s'. The following exception "
+                    "was raised: '%s'.",
+                    job["row"],
+                    exception,
+                 )
+
+            DoJobsConcurrently(
+                self.start_collect,
+                jobs=self.read_jobs(),
+                max_workers=max_workers,
+                exception_callback=exception_callback,
+                update_bar=update_bar,
+                max_pending=max_workers * 2,
+            )
+
+        self.log_summary()
+
+    def log_summary(self):
+        if self.rejected_rows:
+            logger.info(
+                "Rows not packed: %s",
+                ", ".join(
+                    "%s by %s" % (count, reason)
+                    for reason, count in sorted(self.rejected_rows.items())
+                ),
+            )
+        if self.fingerprints is not None:
+            self.fingerprints.close()
+            self.fingerprints.log_summary()
+        if self.optimised_cache is not None and (
+            self.optimised_cache.hits or self.optimised_cache.misses
+        ):
+            logger.info(
+                "Optimised assets cache: %s hits, %s misses",
+                self.optimised_cache.hits,
+                self.optimised_cache.misses,
+            )
+
+    def run_pipeline(self, cpu_workers=None):
+        """Empacota os artigos em duas etapas ligadas por uma fila limitada:
+        a etapa de I/O (``collect_package``) executada por threads e a etapa
+        de CPU (``optimise_xml_to_web``) executada por processos.
+
+        A atualização do XML permanece na etapa de I/O pois os idiomas e os
+        ativos referenciados no XML atualizado determinam quais arquivos são
+        copiados."""
+        io_workers = int(config.get("THREADPOOL_MAX_WORKERS"))
+        cpu_workers = cpu_workers or int(config.get("PROCESSPOOL_MAX_WORKERS"))
+        packages = queue.Queue(maxsize=cpu_workers * 2)
+        io_stats = StageStats("I/O")
+        cpu_stats = StageStats("CPU")
+        io_finished = threading.Event()
+
+        def collect_package(row, poison_pill=None):
+            started = time.monotonic()
+            try:
+                package = self.collect_package(row)
+            except Exception:
+                io_stats.add(time.monotonic() - started, error=True)
+                raise
+            io_stats.add(time.monotonic() - started)
+            if package is not None:
+                # bloqueia enquanto a etapa de CPU estiver atrasada
+                packages.put(package)
+
+        def next_package():
+            package = packages.get()
+            if package is None:
+                io_finished.set()
+            return package
+
+        def optimise_packages():
+            try:
+                submit_packages()
+            except Exception as exc:
+                logger.error("Could not optimise packages: '%s'.", exc)
+            # descarta os pacotes restantes para não bloquear a etapa de I/O
+            while not io_finished.is_set():
+                package = next_package()
+                if package is not None:
+                    cpu_stats.add(0, error=True)
+                    self.discard_package(package[0])
+
+        def submit_packages():
+            def handle(future, package):
+                try:
+                    seconds, optimised, hits, misses = future.result()
+                except Exception as exc:
+                    cpu_stats.add(0, error=True)
+                    self.discard_package(package[0])
+                    logger.error(
+                        "[%s] Could not optimise package '%s'. The exception '%s' "
+                        "was raised.",
+                        package[2],
+                        package[0],
+                        exc,
+                    )
+                else:
+                    cpu_stats.add(seconds, error=not optimised)
+                    if self.optimised_cache is not None:
+                        # cada processo utiliza uma cópia do cache
+                        self.optimised_cache.add_counts(hits, misses)
+                    if optimised:
+                        self.finish_package(package[0])
+                    else:
+                        self.discard_package(package[0])
+
+            # processos criados por "spawn" não herdam o estado das threads
+            # da etapa de I/O em execução
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=cpu_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_pipeline_worker,
+                initargs=(self,),
+            ) as executor:
+                futures = {}
+                while True:
+                    package = next_package()
+                    if package is None:
+                        break
+                    if len(futures) >= cpu_workers * 2:
+                        done, _ = concurrent.futures.wait(
+                            futures, return_when=concurrent.futures.FIRST_COMPLETED
+                        )
+                        for future in done:
+                            handle(future, futures.pop(future))
+                    futures[executor.submit(_optimise_package, *package)] = package
+                for future in concurrent.futures.as_completed(futures):
+                    handle(future, futures[future])
+
+        consumer = threading.Thread(target=optimise_packages)
+        consumer.start()
+        try:
+            with tqdm() as pbar:
 
                 def update_bar(pbar=pbar):
                     pbar.update(1)
@@ -589,15 +1042,78 @@ class BuildPSPackage(object):
                         "was raised: '%s'.",
                         job["row"],
                         exception,
-                     )
+                    )
 
                 DoJobsConcurrently(
-                    self.start_collect,
-                    jobs=jobs,
-                    max_workers=int(config.get("THREADPOOL_MAX_WORKERS")),
+                    collect_package,
+                    jobs=self.read_jobs(),
+                    max_workers=io_workers,
                     exception_callback=exception_callback,
                     update_bar=update_bar,
+                    max_pending=io_workers * 2,
                 )
+        finally:
+            packages.put(None)
+            consumer.join()
+
+        io_stats.log()
+        cpu_stats.log()
+        self.log_summary()
+        return io_stats, cpu_stats
+
+
+class StageStats:
+    """Contabiliza os pacotes processados por uma etapa do empacotamento e o
+    tempo gasto com eles"""
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.errors = 0
+        self.busy = 0.0
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, seconds, error=False):
+        with self._lock:
+            self.count += 1
+            self.errors += int(error)
+            self.busy += seconds
+
+    def log(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        logger.info(
+            "%s stage: %d packages (%d errors) in %.1fs, %.2f packages/s, "
+            "%.1fs of work",
+            self.name,
+            self.count,
+            self.errors,
+            elapsed,
+            self.count / elapsed,
+            self.busy,
+        )
+
+
+# Instância de ``BuildPSPackage`` utilizada pelos processos da etapa de CPU
+_PIPELINE_BUILDER = None
+
+
+def _init_pipeline_worker(builder):
+    global _PIPELINE_BUILDER
+    _PIPELINE_BUILDER = builder
+
+
+def _optimise_package(target_path, xml_target_path, pid):
+    """Otimiza o pacote e retorna o tempo gasto, se foi otimizado e os
+    acertos e as faltas do cache de ativos otimizados durante a chamada"""
+    cache = _PIPELINE_BUILDER.optimised_cache
+    hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    started = time.monotonic()
+    optimised = _PIPELINE_BUILDER.optimise_xml_to_web(target_path, xml_target_path, pid)
+    seconds = time.monotonic() - started
+    if cache is not None:
+        hits, misses = cache.hits - hits, cache.misses - misses
+    return seconds, optimised, hits, misses
 
 
 def main():
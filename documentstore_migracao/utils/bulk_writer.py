@@ -0,0 +1,333 @@
+# Coding: utf-8
+
+"""
+Gravação em lote de entidades e registros de mudança no banco de dados do
+Kernel.
+
+``utils.add_document`` e as funções semelhantes gravam a entidade e o seu
+registro de mudança com uma requisição ao MongoDB cada. O ``BulkWriter``
+acumula as entidades adicionadas por diversas threads e as grava em lotes com
+``insert_many(ordered=False)``. Os registros de mudança são gravados em
+seguida, apenas para as entidades efetivamente inseridas, preservando o
+comportamento das funções de ``utils``.
+
+Entidades já existentes podem ser atualizadas em lote, substituindo os
+registros com ``bulk_write``.
+
+Falhas de gravação são registradas por item: cada entidade que não pôde ser
+gravada é informada ao seu ``on_error``, e as demais entidades do lote seguem
+gravadas normalmente. ``flush`` não propaga essas falhas, uma vez que o lote
+pode ser gravado por qualquer uma das threads que adicionam entidades.
+
+Sessões sem cliente MongoDB (ex: as sessões em memória utilizadas nos testes)
+são gravadas item a item por meio das funções de ``utils``.
+"""
+
+import logging
+import threading
+from collections import Counter, OrderedDict
+from typing import Callable, List, Optional
+
+from bson.objectid import ObjectId
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError, WriteError
+from documentstore.exceptions import AlreadyExists
+from documentstore.services import DocumentRenditions
+
+from documentstore_migracao.utils import (
+    _change,
+    add_document,
+    add_journal,
+    add_bundle,
+    update_bundle,
+    mongodb_collection,
+)
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY_ERROR = 11000
+
+COLLECTIONS = {
+    "Document": "documents",
+    "Journal": "journals",
+    "DocumentsBundle": "documents_bundles",
+}
+
+
+class _Item:
+    __slots__ = (
+        "entity",
+        "instance",
+        "changes",
+        "on_duplicate",
+        "replace",
+        "on_written",
+        "on_error",
+    )
+
+    def __init__(
+        self,
+        entity,
+        instance,
+        changes,
+        on_duplicate,
+        replace=False,
+        on_written=None,
+        on_error=None,
+    ):
+        self.entity = entity
+        self.instance = instance
+        self.changes = changes
+        self.on_duplicate = on_duplicate
+        self.replace = replace
+        self.on_written = on_written
+        self.on_error = on_error
+
+
+class BulkWriter:
+    """Acumula entidades do Kernel e as grava em lotes de ``batch_size``.
+
+    Args:
+        session: sessão do Kernel (``documentstore.adapters.Session``)
+        batch_size: quantidade de entidades acumuladas antes da gravação
+    """
+
+    def __init__(self, session, batch_size: int = 500):
+        self.session = session
+        self.batch_size = batch_size
+        self.counts = Counter()
+        self._bulk = mongodb_collection(session, "documents") is not None
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def add(
+        self,
+        entity: str,
+        instance,
+        changes: List[tuple] = None,
+        on_duplicate: Optional[Callable[[AlreadyExists], None]] = None,
+        replace: bool = False,
+        on_written: Optional[Callable[[], None]] = None,
+        on_error: Optional[Callable[[Exception], None]] = None,
+    ) -> None:
+        """Adiciona ``instance`` ao lote. Caso a entidade já exista na base,
+        ``on_duplicate`` é chamado com a exceção ``AlreadyExists``.
+
+        ``changes`` são registros de mudança adicionais, no formato
+        (instância, entidade, id), gravados após o da própria entidade.
+
+        Com ``replace``, a entidade existente é substituída por ``instance``.
+
+        Após a gravação do lote, ``on_written`` é chamado quando a entidade e os
+        seus registros de mudança foram gravados, e ``on_error`` com a exceção
+        quando a gravação falhou. Sem ``on_error``, a falha é registrada no
+        log."""
+        item = _Item(
+            entity,
+            instance,
+            list(changes or []),
+            on_duplicate,
+            replace,
+            on_written,
+            on_error,
+        )
+        with self._lock:
+            self._pending.append(item)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def add_document(
+        self,
+        document,
+        renditions=False,
+        on_duplicate=None,
+        on_written=None,
+        on_error=None,
+    ) -> None:
+        changes = []
+        if renditions:
+            changes.append(
+                (DocumentRenditions(document), "DocumentRendition", document.id())
+            )
+        self.add(
+            "Document",
+            document,
+            changes,
+            on_duplicate,
+            on_written=on_written,
+            on_error=on_error,
+        )
+
+    def add_journal(self, journal, on_duplicate=None) -> None:
+        self.add("Journal", journal, on_duplicate=on_duplicate)
+
+    def add_bundle(self, bundle, on_duplicate=None) -> None:
+        self.add("DocumentsBundle", bundle, on_duplicate=on_duplicate)
+
+    def update_bundle(self, bundle) -> None:
+        self.add("DocumentsBundle", bundle, replace=True)
+
+    def flush(self) -> None:
+        """Grava as entidades acumuladas e os seus registros de mudança.
+
+        As falhas são informadas a cada item, sem interromper a gravação das
+        demais entidades do lote."""
+        with self._flush_lock:
+            with self._lock:
+                items, self._pending = self._pending, []
+            if not items:
+                return
+            if not self._bulk:
+                self._write_one_by_one(items)
+            else:
+                self._write_many(items)
+
+    def _write_one_by_one(self, items):
+        add = {"Document": add_document, "Journal": add_journal, "DocumentsBundle": add_bundle}
+        update = {"DocumentsBundle": update_bundle}
+        for item in items:
+            try:
+                (update if item.replace else add)[item.entity](
+                    self.session, item.instance
+                )
+                for change in item.changes:
+                    self.session.changes.add(_change(*change))
+            except AlreadyExists as exc:
+                self._duplicate(item, exc)
+            except Exception as exc:
+                self._failed(item, exc)
+            else:
+                self._written(item)
+
+    def _write_many(self, items):
+        by_entity = OrderedDict()
+        for item in items:
+            by_entity.setdefault((item.entity, item.replace), []).append(item)
+
+        written = []
+        changes = []
+        owners = []
+        for (entity, replace), entity_items in by_entity.items():
+            records = []
+            for item in entity_items:
+                record = dict(item.instance.manifest)
+                record["_id"] = item.instance.id()
+                records.append(record)
+
+            try:
+                if replace:
+                    duplicates, failed = self._replace_many(COLLECTIONS[entity], records)
+                else:
+                    duplicates, failed = self._insert_many(COLLECTIONS[entity], records)
+            except Exception as exc:
+                for item in entity_items:
+                    self._failed(item, exc)
+                continue
+
+            for index, item in enumerate(entity_items):
+                if index in duplicates:
+                    self._duplicate(
+                        item,
+                        AlreadyExists(
+                            'cannot add data with id "%s": the id is already in use'
+                            % item.instance.id()
+                        ),
+                    )
+                    continue
+                if index in failed:
+                    self._failed(item, failed[index])
+                    continue
+                written.append(item)
+                for change in [_change(item.instance, entity)] + [
+                    _change(*change) for change in item.changes
+                ]:
+                    changes.append(change)
+                    owners.append(item)
+
+        for change in changes:
+            change.setdefault("_id", str(ObjectId()))
+        try:
+            duplicates, failed = self._insert_many("changes", changes)
+        except Exception as exc:
+            duplicates, failed = set(), {index: exc for index in range(len(changes))}
+        for index in sorted(duplicates):
+            logger.error(
+                'Could not add change "%s": the id is already in use', changes[index]["_id"]
+            )
+
+        not_written = {}
+        for index, exc in failed.items():
+            not_written.setdefault(id(owners[index]), exc)
+        for item in written:
+            if id(item) in not_written:
+                self._failed(item, not_written[id(item)])
+            else:
+                self._written(item)
+
+    def _insert_many(self, collection_name, records) -> tuple:
+        """Insere ``records`` e retorna os índices dos registros duplicados e
+        um dicionário com a exceção de cada registro não gravado por outros
+        motivos"""
+        if not records:
+            return set(), {}
+        collection = mongodb_collection(self.session, collection_name)
+        try:
+            collection.insert_many(records, ordered=False)
+        except BulkWriteError as exc:
+            return self._write_errors(exc)
+        return set(), {}
+
+    def _replace_many(self, collection_name, records) -> tuple:
+        """Substitui os registros existentes pelos de ``records``. O retorno
+        segue o de ``_insert_many``"""
+        collection = mongodb_collection(self.session, collection_name)
+        try:
+            collection.bulk_write(
+                [ReplaceOne({"_id": record["_id"]}, record) for record in records],
+                ordered=False,
+            )
+        except BulkWriteError as exc:
+            return self._write_errors(exc)
+        return set(), {}
+
+    @staticmethod
+    def _write_errors(exc: BulkWriteError) -> tuple:
+        duplicates = set()
+        failed = {}
+        for error in exc.details.get("writeErrors", []):
+            if error.get("code") == DUPLICATE_KEY_ERROR:
+                duplicates.add(error["index"])
+            else:
+                failed[error["index"]] = WriteError(
+                    error.get("errmsg"), error.get("code"), error
+                )
+        return duplicates, failed
+
+    def _written(self, item):
+        self.counts[item.entity] += 1
+        if item.on_written is not None:
+            item.on_written()
+
+    def _failed(self, item, exc):
+        self.counts["failed"] += 1
+        if item.on_error is not None:
+            item.on_error(exc)
+        else:
+            logger.error(
+                "Could not write %s '%s': %s", item.entity, item.instance.id(), exc
+            )
+
+    def _duplicate(self, item, exc):
+        self.counts["duplicates"] += 1
+        if item.on_duplicate is not None:
+            item.on_duplicate(exc)
+        else:
+            logger.error(exc)
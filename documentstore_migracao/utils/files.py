@@ -1,15 +1,22 @@
 """ module to utils methods to file """
 
 import os
+import uuid
+import errno
 import shutil
 import logging
 import hashlib
-from typing import List, Tuple, Set
+import threading
+from collections import OrderedDict
+from typing import List, Tuple, Set, Dict, Optional, Iterator
 
 from documentstore_migracao import config
 
 logger = logging.getLogger(__name__)
 
+# Tamanho dos blocos lidos no cálculo de somas de verificação
+READ_BUFFER_SIZE = 1024 * 1024
+
 
 def setup_processing_folder():
 
@@ -108,7 +115,7 @@ def sha1(path):
     _sum = hashlib.sha1()
     with open(path, "rb") as file:
         while True:
-            chunk = file.read(1024)
+            chunk = file.read(READ_BUFFER_SIZE)
             if not chunk:
                 break
             _sum.update(chunk)
@@ -170,6 +177,47 @@ def fetch_stages_info(content: List[str], func_name: str) -> Tuple[Set[str], Set
     return fetch_stages_to_do(path=stages_file_path, all_stages=content)
 
 
+def iter_package_folders(path: str) -> Iterator[str]:
+    """Percorre `path` com `os.scandir` e retorna, à medida que são
+    encontradas, as pastas que contêm arquivos, na mesma ordem de `os.walk`.
+
+    Assim como em `os.walk`, links simbólicos para pastas não são percorridos
+    e pastas que não podem ser lidas são ignoradas."""
+    pending = [path]
+    while pending:
+        folder = pending.pop()
+        subfolders = []
+        has_files = False
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if not is_dir:
+                        has_files = True
+                    elif not entry.is_symlink():
+                        subfolders.append(entry.path)
+        except OSError as exc:
+            logger.error("Could not list folder '%s': %s", folder, exc)
+            continue
+
+        if has_files:
+            yield folder
+        pending.extend(reversed(subfolders))
+
+
+def iter_package_list(path: str, folder: str = "") -> Iterator[str]:
+    """Retorna as pastas de pacotes listadas no arquivo `path`, uma por
+    linha. Caminhos relativos são resolvidos a partir de `folder`."""
+    with open(path) as package_list:
+        for line in package_list:
+            line = line.strip()
+            if line:
+                yield os.path.join(folder, line)
+
+
 def get_files_in_path(path: str, extension) -> List[str]:
     """Retorna uma lista com os arquivos encontrados em um determinado path"""
     if os.path.isfile(path):
@@ -186,3 +234,180 @@ def get_files_in_path(path: str, extension) -> List[str]:
         )
 
     return files
+
+
+def group_by_lowercase(names: List[str]) -> Dict[str, List[str]]:
+    """Agrupa uma lista de nomes de arquivos pelo nome em minúsculo,
+    preservando a ordem original dos nomes reais"""
+    grouped = {}
+    for name in names:
+        grouped.setdefault(name.lower(), []).append(name)
+    return grouped
+
+
+class DirectoryIndex:
+    """Índice de diretórios utilizado na busca de arquivos sem distinção
+    entre maiúsculas e minúsculas.
+
+    Cada diretório é listado apenas uma vez e o resultado, um mapa do nome em
+    minúsculo para os nomes reais, é mantido em um cache LRU. A entrada do
+    cache é descartada sempre que o `mtime` do diretório for alterado."""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, dirname: str) -> Optional[Dict[str, List[str]]]:
+        """Retorna o mapa de nomes de `dirname` ou None caso o diretório
+        não exista"""
+        try:
+            mtime = os.stat(dirname).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+        with self._lock:
+            cached = self._entries.get(dirname)
+            if cached is not None and cached[0] == mtime:
+                self._entries.move_to_end(dirname)
+                return cached[1]
+
+        try:
+            names = group_by_lowercase(os.listdir(dirname))
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+        logger.debug("Indexando pasta: %s (%s arquivos)", dirname, len(names))
+        with self._lock:
+            self._entries[dirname] = (mtime, names)
+            self._entries.move_to_end(dirname)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return names
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+MATERIALIZATION_MODES = ("copy", "hardlink", "reflink")
+
+# ioctl FICLONE do Linux (linux/fs.h), utilizado para criar reflinks
+FICLONE = 0x40049409
+
+
+def _kernel_copy(source: str, destination: str) -> None:
+    """Copia o conteúdo e as permissões de `source` para `destination` sem
+    trazer os bytes para o espaço do usuário, utilizando `copy_file_range` ou
+    `sendfile`. Caso nenhuma das chamadas seja suportada ou a cópia fique
+    incompleta, utiliza `shutil.copyfile`."""
+
+    copied = False
+    with open(source, "rb") as fsrc, open(destination, "wb") as fdst:
+        src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+        size = os.fstat(src_fd).st_size
+
+        for syscall in ("copy_file_range", "sendfile"):
+            if not hasattr(os, syscall):
+                continue
+            offset = 0
+            try:
+                while offset < size:
+                    if syscall == "copy_file_range":
+                        sent = os.copy_file_range(
+                            src_fd, dst_fd, size - offset, offset, offset
+                        )
+                    else:
+                        sent = os.sendfile(dst_fd, src_fd, offset, size - offset)
+                    if sent == 0:
+                        break
+                    offset += sent
+            except OSError as exc:
+                logger.debug("%s não suportado para %s: %s", syscall, source, exc)
+            else:
+                if offset == size:
+                    copied = True
+                    break
+                logger.debug(
+                    "%s copiou %s de %s bytes de %s", syscall, offset, size, source
+                )
+            os.ftruncate(dst_fd, 0)
+            os.lseek(dst_fd, 0, os.SEEK_SET)
+
+    if not copied:
+        shutil.copyfile(source, destination)
+    shutil.copymode(source, destination)
+
+
+def _reflink(source: str, destination: str) -> None:
+    import fcntl
+
+    with open(source, "rb") as fsrc, open(destination, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def materialize_file(source: str, destination: str, mode: str = None) -> str:
+    """Disponibiliza o arquivo `source` em `destination` de acordo com o
+    `mode` informado:
+
+    copy     :: cópia realizada pelo kernel (`copy_file_range`/`sendfile`)
+    hardlink :: cria um hard link para `source`
+    reflink  :: cria uma cópia copy-on-write (btrfs, xfs)
+
+    Os modos `hardlink` e `reflink` utilizam `copy` quando não são suportados
+    pelo sistema de arquivos. O arquivo é criado com um nome temporário na
+    pasta de `destination` e renomeado em seguida, de forma que um
+    `destination` existente é sempre substituído e nunca sobrescrito, evitando
+    alterar o arquivo de origem de um hard link, e gravações concorrentes do
+    mesmo arquivo nunca deixam um arquivo parcial. Arquivos criados como hard
+    link devem ser tratados como somente leitura.
+
+    Retorna o caminho do arquivo criado."""
+
+    mode = mode or config.get("ASSET_MATERIALIZATION_MODE")
+    if mode not in MATERIALIZATION_MODES:
+        raise ValueError(
+            "Invalid materialization mode '%s', use one of %s"
+            % (mode, ", ".join(MATERIALIZATION_MODES))
+        )
+
+    if os.path.isdir(destination):
+        destination = os.path.join(destination, os.path.basename(source))
+
+    if not os.path.isfile(source):
+        raise FileNotFoundError(
+            errno.ENOENT, "No such file or directory", source
+        )
+
+    folder, filename = os.path.split(destination)
+    temp_path = os.path.join(folder, ".%s.%s.tmp" % (filename, uuid.uuid4().hex))
+
+    logger.debug("Materializando arquivo (%s): %s -> %s", mode, source, destination)
+    try:
+        _materialize(source, temp_path, mode)
+        os.replace(temp_path, destination)
+    except BaseException:
+        if os.path.lexists(temp_path):
+            os.unlink(temp_path)
+        raise
+    return destination
+
+
+def _materialize(source: str, destination: str, mode: str) -> None:
+    if mode == "hardlink":
+        try:
+            os.link(source, destination)
+        except OSError as exc:
+            logger.debug("Não foi possível criar hard link para %s: %s", source, exc)
+        else:
+            return
+    elif mode == "reflink":
+        try:
+            _reflink(source, destination)
+        except (OSError, ImportError) as exc:
+            logger.debug("Não foi possível criar reflink para %s: %s", source, exc)
+        else:
+            shutil.copymode(source, destination)
+            return
+
+    _kernel_copy(source, destination)
@@ -0,0 +1,216 @@
+# Coding: utf-8
+
+"""
+Cache, entre execuções, das imagens produzidas pela otimização de XML para a
+WEB (PNG a partir de TIFF e miniaturas).
+
+A conversão das imagens pelo `packtools.XMLWebOptimiser` é a etapa de maior
+uso de CPU do empacotamento a partir do site. As imagens geradas são
+armazenadas por uma chave composta pela soma SHA-1 da imagem de origem, pelo
+tipo de imagem gerada e pelos parâmetros do otimizador, na seguinte estrutura:
+
+    <OPTIMISED_ASSET_CACHE_DIR>/ab/abcdef0123456789...
+
+Quando o tamanho do cache ultrapassa o limite configurado, as imagens menos
+utilizadas recentemente (mtime atualizado a cada acerto) são removidas.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from typing import Optional
+
+import PIL
+import packtools
+from packtools import exceptions
+
+from documentstore_migracao.utils import asset_store
+
+logger = logging.getLogger(__name__)
+
+# Parâmetros utilizados por ``packtools.utils.WebImageGenerator``. Alterações
+# nestes valores (ou nas versões das bibliotecas) invalidam o cache.
+OPTIMISER_SETTINGS = {
+    "packtools": packtools.__version__,
+    "pillow": PIL.__version__,
+    "png": "PNG",
+    "thumbnail": ("JPEG", 267, 140),
+}
+
+# Proporção do tamanho máximo mantida após a remoção de imagens
+EVICTION_RATIO = 0.9
+
+
+class OptimisedAssetCache:
+    """Cache de imagens otimizadas em disco, compartilhável entre processos.
+
+    Args:
+        path: pasta do cache
+        max_size: tamanho máximo em bytes (sem limite se None ou 0)
+        settings: parâmetros do otimizador que compõem a chave
+    """
+
+    def __init__(self, path: str, max_size: int = None, settings: dict = None):
+        self.path = path
+        self.max_size = max_size or None
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        self._lock = threading.Lock()
+        self._settings_digest = hashlib.sha1(
+            json.dumps(settings or OPTIMISER_SETTINGS, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        os.makedirs(path, exist_ok=True)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def add_counts(self, hits: int, misses: int) -> None:
+        """Soma aos contadores os acertos e as faltas de outro processo"""
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def key(self, source_sha1: str, kind: str) -> str:
+        return hashlib.sha1(
+            ("%s:%s:%s" % (source_sha1, kind, self._settings_digest)).encode("utf-8")
+        ).hexdigest()
+
+    def object_path(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Retorna os bytes armazenados para ``key`` ou None"""
+        object_path = self.object_path(key)
+        try:
+            with open(object_path, "rb") as fp:
+                data = fp.read()
+            os.utime(object_path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """Armazena ``data`` para ``key`` e remove as imagens menos utilizadas
+        caso o tamanho máximo seja ultrapassado"""
+        object_path = self.object_path(key)
+        folder = os.path.dirname(object_path)
+        os.makedirs(folder, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=folder, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(data)
+            os.replace(temp_path, object_path)
+        except Exception:
+            if os.path.lexists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+        if self.max_size is None:
+            return
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(entry[2] for entry in self._entries())
+            else:
+                self._size += len(data)
+            if self._size > self.max_size:
+                self._evict()
+
+    def _entries(self):
+        """Lista (mtime, caminho, tamanho) das imagens armazenadas"""
+        entries = []
+        for folder in os.scandir(self.path):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, entry.path, stat.st_size))
+        return entries
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        size = sum(entry[2] for entry in entries)
+        limit = self.max_size * EVICTION_RATIO
+        removed = 0
+        for _, object_path, object_size in entries:
+            if size <= limit:
+                break
+            try:
+                os.unlink(object_path)
+            except FileNotFoundError:
+                pass
+            size -= object_size
+            removed += 1
+        self._size = size
+        logger.debug("%s imagens removidas do cache %s", removed, self.path)
+
+
+class CachedXMLWebOptimiser(packtools.XMLWebOptimiser):
+    """``packtools.XMLWebOptimiser`` que obtém do ``cache`` as imagens já
+    otimizadas, evitando a leitura e a conversão da imagem de origem."""
+
+    def __init__(self, *args, cache: OptimisedAssetCache, **kwargs):
+        self._cache = cache
+        super().__init__(*args, **kwargs)
+
+    def _source_sha1(self, image_filename):
+        image_path = os.path.join(self.work_dir, image_filename)
+        sha1 = asset_store.known_sha1(image_path)
+        if sha1 is None:
+            sha1 = hashlib.sha1(self._read_file(image_filename)).hexdigest()
+        return sha1
+
+    def _add_cached_image(self, image_filename, kind, new_filename, add_image, assets):
+        try:
+            key = self._cache.key(self._source_sha1(image_filename), kind)
+        except exceptions.SPPackageError:
+            return add_image(image_filename)
+
+        data = self._cache.get(key)
+        if data is not None:
+            assets.append((new_filename, data))
+            return new_filename
+
+        count = len(assets)
+        result = add_image(image_filename)
+        if result is not None and len(assets) > count and assets[-1][1] is not None:
+            self._cache.put(key, assets[-1][1])
+        return result
+
+    def _add_optimised_image(self, image_filename):
+        return self._add_cached_image(
+            image_filename,
+            "png",
+            os.path.splitext(image_filename)[0] + ".png",
+            super()._add_optimised_image,
+            self._optimised_assets,
+        )
+
+    def _add_assets_thumbnails(self, image_filename):
+        return self._add_cached_image(
+            image_filename,
+            "thumbnail",
+            os.path.splitext(image_filename)[0] + ".thumbnail.jpg",
+            super()._add_assets_thumbnails,
+            self._assets_thumbnails,
+        )
@@ -0,0 +1,165 @@
+# Coding: utf-8
+
+"""
+Registro das impressões digitais das fontes de cada pacote gerado a partir do
+site, utilizado pelo empacotamento incremental.
+
+Para cada pacote são registrados:
+
+    - um resumo dos dados de entrada (linha do CSV de artigos, ISSNs e
+      parâmetros do empacotamento);
+    - o tamanho e o mtime de cada arquivo de origem (XML, PDFs e imagens);
+    - o mtime das pastas de origem, de modo que um arquivo que passe a existir
+      (ex: uma tradução em PDF antes ausente) também provoque a reconstrução.
+
+Um pacote cujas fontes não foram alteradas desde o último empacotamento não é
+reconstruído. Os pacotes reconstruídos, ignorados e com falha são registrados
+em um relatório JSONL.
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import Counter
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+REBUILT = "rebuilt"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+
+def file_fingerprint(path: str) -> Optional[list]:
+    """Retorna [tamanho, mtime_ns] de ``path`` ou None caso não exista"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def inputs_digest(*inputs) -> str:
+    """Retorna o resumo SHA-1 dos dados de entrada ``inputs``, que devem ser
+    serializáveis em JSON"""
+    return hashlib.sha1(
+        json.dumps(inputs, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+class PackageFingerprints:
+    """Armazena em um banco SQLite as impressões digitais das fontes de cada
+    pacote e registra em ``report_file`` os pacotes reconstruídos e ignorados.
+    """
+
+    def __init__(self, path: str, report_file: str = None):
+        self.path = path
+        self.report_file = report_file or "%s.report.jsonl" % os.path.splitext(path)[0]
+        self.counts = Counter()
+        self._connection = None
+        self._report = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # a conexão e o relatório pertencem ao processo que os abriu
+        state = self.__dict__.copy()
+        state.update(_connection=None, _report=None, _lock=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS fingerprints ("
+                "package TEXT PRIMARY KEY, inputs TEXT, sources TEXT)"
+            )
+        return self._connection
+
+    def is_up_to_date(self, package: str, inputs: str, target_path: str) -> bool:
+        """Indica se ``package`` foi gerado em ``target_path`` a partir das
+        mesmas entradas e das mesmas fontes, não alteradas desde então"""
+        with self._lock:
+            row = (
+                self._connect()
+                .execute(
+                    "SELECT inputs, sources FROM fingerprints WHERE package = ?",
+                    (package,),
+                )
+                .fetchone()
+            )
+        if row is None or row[0] != inputs or not os.path.isdir(target_path):
+            return False
+
+        sources = json.loads(row[1])
+        for path, fingerprint in sources["files"].items():
+            if file_fingerprint(path) != fingerprint:
+                return False
+        for path, fingerprint in sources["dirs"].items():
+            if file_fingerprint(path) != fingerprint:
+                return False
+        return True
+
+    def record(
+        self,
+        package: str,
+        inputs: str,
+        files: Dict[str, Optional[list]],
+        dirs: Dict[str, Optional[list]],
+    ) -> None:
+        """Registra as impressões digitais dos arquivos ``files`` e das pastas
+        ``dirs`` utilizados na geração de ``package``, obtidas com
+        ``file_fingerprint`` no momento em que as fontes foram lidas"""
+        sources = {"files": dict(files), "dirs": dict(dirs)}
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?)",
+                    (package, inputs, json.dumps(sources)),
+                )
+
+    def forget(self, package: str) -> None:
+        """Remove o registro de ``package``, forçando a sua reconstrução"""
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "DELETE FROM fingerprints WHERE package = ?", (package,)
+                )
+
+    def report(self, package: str, status: str) -> None:
+        """Registra que ``package`` foi reconstruído, ignorado ou falhou"""
+        with self._lock:
+            if self._report is None:
+                self._report = open(self.report_file, "w", encoding="utf-8")
+            self._report.write(json.dumps({"package": package, "status": status}) + "\n")
+            self.counts[status] += 1
+
+    def close(self) -> None:
+        with self._lock:
+            if self._report is not None:
+                self._report.close()
+                self._report = None
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def log_summary(self) -> None:
+        logger.info(
+            "%s packages rebuilt, %s packages skipped, %s packages failed. "
+            "Report written to '%s'.",
+            self.counts[REBUILT],
+            self.counts[SKIPPED],
+            self.counts[FAILED],
+            self.report_file,
+        )
@@ -6,7 +6,7 @@ import requests
 from tqdm import tqdm
 
 from documentstore_migracao import config
-from documentstore_migracao.utils import DoJobsConcurrently
+from documentstore_migracao.utils import DoJobsConcurrently, result_writer
 
 logger = logging.getLogger(__name__)
 
@@ -58,8 +58,9 @@ def check_documents_availability_in_website(
                     "Cannot write in the file. The exception '%s' was raided ", exc
                 )
 
+    results = result_writer.ResultWriter(output) if output is not None else None
     jobs = [
-        {"url": template.substitute({"id": pid.strip()}), "output": output}
+        {"url": template.substitute({"id": pid.strip()}), "output": results}
         for pid in pids
     ]
 
@@ -78,10 +79,14 @@ def check_documents_availability_in_website(
 
             logger.exception(exception)
 
-        DoJobsConcurrently(
-            access_website_and_report,
-            jobs,
-            max_workers=int(config.get("THREADPOOL_MAX_WORKERS")),
-            exception_callback=exception_callback,
-            update_bar=update_bar,
-        )
+        try:
+            DoJobsConcurrently(
+                access_website_and_report,
+                jobs,
+                max_workers=int(config.get("THREADPOOL_MAX_WORKERS")),
+                exception_callback=exception_callback,
+                update_bar=update_bar,
+            )
+        finally:
+            if results is not None:
+                results.close()
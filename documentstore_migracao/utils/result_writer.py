@@ -0,0 +1,149 @@
+# coding: utf-8
+
+"""
+Gravação dos resultados das tarefas executadas concorrentemente pelos
+comandos de importação, rollback e verificação de qualidade.
+
+As linhas são enfileiradas pelas threads das tarefas e gravadas no arquivo de
+saída por uma única thread, que mantém o arquivo aberto durante toda a
+execução. O conteúdo é descarregado e sincronizado em disco (fsync) a cada
+`flush_interval` segundos e ao fim da gravação, evitando a abertura do
+arquivo a cada resultado e a mistura de linhas gravadas por threads
+diferentes.
+"""
+
+import io
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from typing import IO, Union
+
+from documentstore_migracao import config
+
+logger = logging.getLogger(__name__)
+
+# Sinaliza o fim da gravação para a thread de escrita
+_CLOSE = object()
+
+
+class ResultWriter:
+    """Grava linhas em `output` por meio de uma única thread.
+
+    Args:
+        output: caminho do arquivo, aberto em modo `mode` na gravação da
+            primeira linha, ou arquivo já aberto, que não é fechado ao fim da
+            gravação
+        flush_interval: intervalo em segundos entre as sincronizações em disco
+            (padrão `RESULT_FLUSH_INTERVAL`)
+        mode: modo de abertura de `output` quando informado o caminho
+    """
+
+    def __init__(
+        self, output: Union[str, IO], flush_interval: float = None, mode: str = "a"
+    ):
+        if flush_interval is None:
+            flush_interval = float(config.get("RESULT_FLUSH_INTERVAL"))
+        self.flush_interval = flush_interval
+        self.lines = 0
+        self.mode = mode
+        self._owns_file = isinstance(output, (str, os.PathLike))
+        self._output = output
+        self._file = None if self._owns_file else output
+        self._queue = queue.Queue()
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name="result-writer", daemon=True
+        )
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, line: str) -> None:
+        """Enfileira `line` para gravação, acrescentando a quebra de linha
+        quando ausente"""
+        if self._closed:
+            raise ValueError("I/O operation on closed result writer.")
+        if not line.endswith("\n"):
+            line += "\n"
+        self._queue.put(line)
+
+    def write_json(self, result) -> None:
+        """Enfileira `result` serializado como uma linha JSON"""
+        self.write(json.dumps(result))
+
+    def close(self) -> None:
+        """Grava as linhas pendentes, sincroniza o arquivo em disco e encerra
+        a thread de escrita. Exceções ocorridas na gravação são lançadas
+        aqui."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_CLOSE)
+        self._thread.join()
+        if self._owns_file and self._file is not None:
+            self._file.close()
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        last_sync = time.monotonic()
+        pending = False
+        while True:
+            timeout = max(0, last_sync + self.flush_interval - time.monotonic())
+            try:
+                line = self._queue.get(timeout=timeout if pending else None)
+            except queue.Empty:
+                line = None
+
+            # grava de uma vez as linhas já enfileiradas
+            lines = []
+            while line is not None and line is not _CLOSE:
+                lines.append(line)
+                try:
+                    line = self._queue.get_nowait()
+                except queue.Empty:
+                    line = None
+
+            if lines and self._error is None:
+                try:
+                    if self._file is None:
+                        self._file = open(self._output, self.mode)
+                    self._file.write("".join(lines))
+                except Exception as exc:
+                    logger.error("Could not write results: '%s'.", exc)
+                    self._error = exc
+                else:
+                    self.lines += len(lines)
+                    pending = True
+
+            if line is _CLOSE or (
+                pending and time.monotonic() - last_sync >= self.flush_interval
+            ):
+                if pending and self._error is None:
+                    self._sync()
+                pending = False
+                last_sync = time.monotonic()
+            if line is _CLOSE:
+                return
+
+    def _sync(self):
+        try:
+            self._file.flush()
+        except Exception as exc:
+            logger.error("Could not write results: '%s'.", exc)
+            self._error = exc
+            return
+
+        try:
+            os.fsync(self._file.fileno())
+        except (AttributeError, io.UnsupportedOperation, OSError) as exc:
+            # saídas como pipes e terminais não podem ser sincronizadas
+            logger.debug("Could not sync results to disk: '%s'.", exc)
@@ -0,0 +1,269 @@
+# Coding: utf-8
+
+"""
+Índice das árvores de arquivos do site legado (`bases/xml`, `bases/pdf` e
+`htdocs/img/revistas`).
+
+O empacotamento a partir do site procura XMLs, manifestações e ativos
+digitais por tentativa e erro, o que resulta em muitas chamadas de sistema que
+falham. O índice é gerado em uma única passagem pelas árvores e gravado em um
+banco SQLite, com um registro por arquivo:
+
+    (árvore, acrônimo, pasta do número, nome do arquivo, caminho)
+
+O acrônimo e a pasta do número são gravados em minúsculas, o nome do arquivo
+é o caminho relativo à pasta do número e o caminho é relativo à raiz da
+árvore, com a caixa original. Durante o empacotamento os arquivos de cada
+pasta do número são carregados em memória uma única vez e agrupados pelo
+nome em minúsculas.
+
+O índice registra as pastas raiz de cada árvore e o momento da sua geração.
+Um índice gerado para outras pastas, ou cujas pastas raiz, de acrônimos ou de
+números foram alteradas após a geração (arquivos criados, removidos ou
+renomeados), é gerado novamente por `SiteIndex.open`.
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Margem para a diferença entre o relógio utilizado pelo sistema de arquivos
+# no mtime das pastas e o horário registrado na geração do índice
+MTIME_SLACK_NS = 10 ** 9
+
+
+def tree_folders(root: str) -> Iterator[str]:
+    """Produz ``root`` e as suas pastas de acrônimos e de números"""
+    yield root
+    for acron in os.scandir(root):
+        if not acron.is_dir():
+            continue
+        yield acron.path
+        for issue_folder in os.scandir(acron.path):
+            if issue_folder.is_dir():
+                yield issue_folder.path
+
+
+def scan_tree(root: str) -> Iterator[Tuple[str, str, str]]:
+    """Percorre ``root`` e produz (acrônimo, pasta do número, nome do arquivo)
+    de cada arquivo em ``root/acrônimo/pasta do número/``"""
+
+    def walk(path, prefix):
+        try:
+            entries = list(os.scandir(path))
+        except OSError as exc:
+            logger.error("Could not scan '%s': %s", path, exc)
+            return
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk(entry.path, prefix + entry.name + "/")
+            elif entry.is_file():
+                yield prefix + entry.name
+
+    for acron in os.scandir(root):
+        if not acron.is_dir():
+            continue
+        for issue_folder in os.scandir(acron.path):
+            if not issue_folder.is_dir():
+                continue
+            for name in walk(issue_folder.path, ""):
+                yield acron.name, issue_folder.name, name
+
+
+class SiteIndex:
+    """Índice dos arquivos do site legado gravado em ``path``.
+
+    Args:
+        path: arquivo SQLite do índice
+        maxsize: quantidade de pastas de números mantidas em memória
+    """
+
+    def __init__(self, path: str, maxsize: int = 4096):
+        self.path = path
+        self.maxsize = maxsize
+        self._connection = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(_connection=None, _cache=OrderedDict(), _lock=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, path: str, roots: Dict[str, str], batch_size: int = 10000):
+        """Gera o índice das árvores ``roots`` ({árvore: pasta}) em ``path``.
+
+        O índice é gravado em um arquivo temporário e renomeado ao final, de
+        modo que um índice incompleto nunca seja utilizado."""
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=folder, prefix=".tmp-", suffix=".db")
+        os.close(fd)
+        built_at = time.time_ns() - MTIME_SLACK_NS
+        try:
+            connection = sqlite3.connect(temp_path)
+            with connection:
+                connection.execute(
+                    "CREATE TABLE files "
+                    "(tree TEXT, acron TEXT, issue TEXT, name TEXT, path TEXT)"
+                )
+                connection.execute(
+                    "CREATE TABLE roots (tree TEXT, root TEXT, built_at INTEGER)"
+                )
+                connection.executemany(
+                    "INSERT INTO roots VALUES (?, ?, ?)",
+                    [
+                        (tree, os.path.abspath(root), built_at)
+                        for tree, root in roots.items()
+                    ],
+                )
+                for tree, root in roots.items():
+                    count = 0
+                    batch = []
+                    for acron, issue_folder, name in scan_tree(root):
+                        batch.append(
+                            (
+                                tree,
+                                acron.lower(),
+                                issue_folder.lower(),
+                                name,
+                                "/".join((acron, issue_folder, name)),
+                            )
+                        )
+                        if len(batch) >= batch_size:
+                            connection.executemany(
+                                "INSERT INTO files VALUES (?, ?, ?, ?, ?)", batch
+                            )
+                            count += len(batch)
+                            batch = []
+                    connection.executemany(
+                        "INSERT INTO files VALUES (?, ?, ?, ?, ?)", batch
+                    )
+                    count += len(batch)
+                    logger.info("%s files indexed in '%s' (%s)", count, root, tree)
+                connection.execute(
+                    "CREATE INDEX files_issue ON files (tree, acron, issue)"
+                )
+            connection.close()
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        return cls(path)
+
+    @classmethod
+    def open(cls, path: str, roots: Dict[str, str], rebuild: bool = False):
+        """Retorna o índice ``path`` das árvores ``roots``, gerando-o caso não
+        exista, ``rebuild`` seja verdadeiro ou o índice esteja desatualizado
+        (ver ``is_up_to_date``)"""
+        if not rebuild and os.path.isfile(path):
+            index = cls(path)
+            if index.is_up_to_date(roots):
+                return index
+            index.close()
+        return cls.build(path, roots)
+
+    def is_up_to_date(self, roots: Dict[str, str]) -> bool:
+        """Indica se o índice foi gerado para as árvores ``roots`` e se as
+        suas pastas raiz, de acrônimos e de números não foram alteradas desde
+        a geração"""
+        try:
+            with self._lock:
+                indexed = {
+                    tree: (root, built_at)
+                    for tree, root, built_at in self._connect().execute(
+                        "SELECT tree, root, built_at FROM roots"
+                    )
+                }
+        except sqlite3.Error as exc:
+            logger.info("Site index '%s' has no roots: %s", self.path, exc)
+            return False
+
+        if {tree: root for tree, (root, _) in indexed.items()} != {
+            tree: os.path.abspath(root) for tree, root in roots.items()
+        }:
+            logger.info("Site index '%s' was built for other folders", self.path)
+            return False
+
+        for tree, (root, built_at) in indexed.items():
+            try:
+                for folder in tree_folders(root):
+                    if os.stat(folder).st_mtime_ns > built_at:
+                        logger.info(
+                            "Site index '%s' is older than '%s'", self.path, folder
+                        )
+                        return False
+            except OSError as exc:
+                logger.info("Could not check site index folder: %s", exc)
+                return False
+        return True
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        return self._connection
+
+    def names(
+        self, tree: str, acron: str, issue_folder: str
+    ) -> Dict[str, List[Tuple[str, str]]]:
+        """Retorna os arquivos da pasta do número, como tuplas (nome, caminho),
+        agrupados pelo nome em minúsculas"""
+        key = (tree, acron.lower(), issue_folder.lower())
+        with self._lock:
+            names = self._cache.get(key)
+            if names is not None:
+                self._cache.move_to_end(key)
+                return names
+
+            names = {}
+            for name, path in self._connect().execute(
+                "SELECT name, path FROM files WHERE tree = ? AND acron = ? AND issue = ?",
+                key,
+            ):
+                names.setdefault(name.lower(), []).append((name, path))
+            self._cache[key] = names
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+            return names
+
+    def find(
+        self, tree: str, acron: str, issue_folder: str, filename: str
+    ) -> Optional[str]:
+        """Retorna o caminho, relativo à raiz da árvore, de ``filename`` na
+        pasta do número ou None. O nome idêntico tem preferência sobre os que
+        diferem apenas na caixa"""
+        candidates = self.names(tree, acron, issue_folder).get(filename.lower())
+        if not candidates:
+            return None
+        for name, path in candidates:
+            if name == filename:
+                return path
+        return candidates[0][1]
+
+    def listdir(self, tree: str, acron: str, issue_folder: str) -> List[Tuple[str, str]]:
+        """Retorna as tuplas (nome, caminho) dos arquivos da pasta do número"""
+        return [
+            entry
+            for entries in self.names(tree, acron, issue_folder).values()
+            for entry in entries
+        ]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+            self._cache.clear()
@@ -1,4 +1,5 @@
 import io
+import os
 import csv
 import pathlib
 import tempfile
@@ -9,7 +10,12 @@ from lxml import etree
 from PIL import Image
 
 from . import utils
-from documentstore_migracao.utils import build_ps_package
+from documentstore_migracao.utils import (
+    build_ps_package,
+    optimised_assets,
+    package_fingerprints,
+    site_index,
+)
 from documentstore_migracao.export.sps_package import SPS_Package
 
 
@@ -149,7 +155,7 @@ class TestBuildSPSPackage(TestBuildSPSPackageBase):
         self.assertEqual(issue_folder, "v1n1")
         self.assertEqual(pack_name, "bla")
 
-    @mock.patch("documentstore_migracao.utils.build_ps_package.shutil.copy")
+    @mock.patch("documentstore_migracao.utils.build_ps_package.files.materialize_file")
     def test_collect_renditions_for_document_without_translations(self, mock_copy):
         result = self.builder.collect_renditions(
             "/data/output/abc/v1n1/bla",
@@ -160,11 +166,11 @@ class TestBuildSPSPackage(TestBuildSPSPackageBase):
             "S0101-02022020000010001",
         )
         mock_copy.assert_called_once_with(
-            "/data/pdfs/abc/v1n1/bla.pdf", "/data/output/abc/v1n1/bla"
+            "/data/pdfs/abc/v1n1/bla.pdf", "/data/output/abc/v1n1/bla", "copy"
         )
         self.assertEqual(result, {"pt": "bla.pdf"})
 
-    @mock.patch("documentstore_migracao.utils.build_ps_package.shutil.copy")
+    @mock.patch("documentstore_migracao.utils.build_ps_package.files.materialize_file")
     def test_collect_renditions_for_document_with_translations_in_en_and_es(self, mock_copy):
         result = self.builder.collect_renditions(
             "/data/output/abc/v1n1/bla",
@@ -176,20 +182,20 @@ class TestBuildSPSPackage(TestBuildSPSPackageBase):
         )
         assert mock_copy.call_args_list == [
             mock.call(
-                "/data/pdfs/abc/v1n1/bla.pdf", "/data/output/abc/v1n1/bla"
+                "/data/pdfs/abc/v1n1/bla.pdf", "/data/output/abc/v1n1/bla", "copy"
             ),
             mock.call(
-                "/data/pdfs/abc/v1n1/en_bla.pdf", "/data/output/abc/v1n1/bla"
+                "/data/pdfs/abc/v1n1/en_bla.pdf", "/data/output/abc/v1n1/bla", "copy"
             ),
             mock.call(
-                "/data/pdfs/abc/v1n1/es_bla.pdf", "/data/output/abc/v1n1/bla"
+                "/data/pdfs/abc/v1n1/es_bla.pdf", "/data/output/abc/v1n1/bla", "copy"
             ),
         ]
         self.assertEqual(
             result, {"pt": "bla.pdf", "en": "en_bla.pdf", "es": "es_bla.pdf"}
         )
 
-    @mock.patch("documentstore_migracao.utils.build_ps_package.shutil.copy")
+    @mock.patch("documentstore_migracao.utils.build_ps_package.files.materialize_file")
     def test_collect_renditions_for_document_with_translation_using_prefix(self, mock_copy):
         mock_copy.side_effect = [None, FileNotFoundError, None]
         result = self.builder.collect_renditions(
@@ -1117,6 +1123,49 @@ class TestBuildSPSPackageXMLWEBOptimiser(TestBuildSPSPackageBase):
             self.assertIn("1234-5678-rctb-45-05-0110-e04.tif", img_filenames)
             self.assertIn("1234-5678-rctb-45-05-0110-e04.png", img_filenames)
 
+    def test_optimise_xml_to_web_returns_False_for_invalid_xml(self):
+        self.xml_target_path.write_text("<article")
+        self.assertFalse(
+            self.builder.optimise_xml_to_web(
+                self.target_path, str(self.xml_target_path), "S0101-01012019000100001"
+            )
+        )
+
+    def test_optimised_cache_skips_image_conversion(self):
+        cache = optimised_assets.OptimisedAssetCache(
+            os.path.join(self.target_path, ".cache")
+        )
+        self.builder.optimised_cache = cache
+        create_image_file(
+            pathlib.Path(self.target_path, "1234-5678-rctb-45-05-0110-e01.tif"), "TIFF"
+        )
+        graphic_01 = '<graphic xlink:href="1234-5678-rctb-45-05-0110-e01.tif"/>'
+        xml = self.xml.format(graphic_01=graphic_01, graphic_02="")
+
+        results = []
+        for _ in range(2):
+            with self.xml_target_path.open("w") as xml_file:
+                xml_file.write(xml)
+            self.builder.optimise_xml_to_web(
+                self.target_path, str(self.xml_target_path), "S0101-01012019000100001"
+            )
+            results.append(
+                (
+                    self.xml_target_path.read_bytes(),
+                    pathlib.Path(
+                        self.target_path, "1234-5678-rctb-45-05-0110-e01.png"
+                    ).read_bytes(),
+                )
+            )
+            if len(results) == 1:
+                patcher = mock.patch("packtools.utils.WebImageGenerator")
+                mk_web_image_generator = patcher.start()
+                self.addCleanup(patcher.stop)
+
+        mk_web_image_generator.assert_not_called()
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(2, cache.hits)
+
 
 class TestBuildSPSPackageHasISSNsToFix(TestCase):
 
@@ -1194,3 +1243,393 @@ class TestBuildSPSPackageHasISSNsToFix(TestCase):
         # {"ppub": "9999-9999", "epub": "8888-8888"}
         expected = {"ppub": "0101-0101", "epub": "8888-0101"}
         self.assertEqual(expected, result.issns)
+
+
+class TestBuildSPSPackageReadJobs(TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.csvfile = pathlib.Path(self.folder) / "articles.csv"
+        self.csvfile.write_text(
+            "S0101-01012019000100001,,test/v1n1/a01.xml,,,,test,v1n1,pt\n"
+            "S0101-01012019000100002,S0101-01012019005000001,test/v1n1/a02.xml,"
+            "20190200,20190115,20190507,test,v1n1,es\n"
+            "S0101-01012019000100003,,test/v1n1/a03.xml,,,,test,v1n1,en\n"
+            "\n"
+            ",,test/v1n1/a04.xml,,,,test,v1n1,pt\n"
+            "S0202-02022018000100001,,other/v1n1/a01.xml,,,,other,v1n1,pt\n",
+            encoding="utf-8",
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def get_builder(self, **kwargs):
+        return build_ps_package.BuildPSPackage(
+            "/data/xmls",
+            "/data/imgs",
+            "/data/pdfs",
+            "/data/output",
+            str(self.csvfile),
+            **kwargs
+        )
+
+    def read_pids(self, builder):
+        return [job["row"]["pid"] for job in builder.read_jobs()]
+
+    def test_read_jobs_skips_empty_rows(self):
+        self.assertEqual(
+            [
+                "S0101-01012019000100001",
+                "S0101-01012019000100002",
+                "S0101-01012019000100003",
+                "S0202-02022018000100001",
+            ],
+            self.read_pids(self.get_builder()),
+        )
+
+    def test_read_jobs_filters_acrons(self):
+        self.assertEqual(
+            ["S0202-02022018000100001"],
+            self.read_pids(self.get_builder(acrons=["other"])),
+        )
+
+    def test_read_jobs_filters_acrons_ignoring_case(self):
+        builder = self.get_builder(acrons=["OTHER"])
+        self.assertEqual(["S0202-02022018000100001"], self.read_pids(builder))
+        self.assertEqual(3, builder.rejected_rows["acron"])
+
+    def test_read_jobs_logs_rows_without_pid(self):
+        builder = self.get_builder()
+        with self.assertLogs(build_ps_package.logger, level="ERROR") as logs:
+            self.read_pids(builder)
+        self.assertEqual(1, builder.rejected_rows["pid"])
+        self.assertIn("test/v1n1/a04.xml", logs.output[0])
+
+    def test_read_jobs_filters_years(self):
+        self.assertEqual(
+            ["S0202-02022018000100001"],
+            self.read_pids(self.get_builder(years=["2018"])),
+        )
+
+    def test_read_jobs_skips_pids_and_aop_pids(self):
+        builder = self.get_builder(
+            skip_pids=["S0101-01012019000100001", "S0101-01012019005000001"]
+        )
+        self.assertEqual(
+            ["S0101-01012019000100003", "S0202-02022018000100001"],
+            self.read_pids(builder),
+        )
+
+    def test_read_jobs_is_lazy(self):
+        jobs = self.get_builder().read_jobs()
+        self.assertEqual("S0101-01012019000100001", next(jobs)["row"]["pid"])
+        jobs.close()
+
+    @mock.patch.object(build_ps_package.BuildPSPackage, "start_collect")
+    def test_run_collects_accepted_rows(self, mk_start_collect):
+        with utils.environ(THREADPOOL_MAX_WORKERS="2"):
+            self.get_builder(acrons=["test"]).run()
+        self.assertEqual(
+            [
+                "S0101-01012019000100001",
+                "S0101-01012019000100002",
+                "S0101-01012019000100003",
+            ],
+            sorted(
+                call[1]["row"]["pid"] for call in mk_start_collect.call_args_list
+            ),
+        )
+
+
+class TestBuildSPSPackageRunPipeline(TestBuildSPSPackageBase):
+    def setUp(self):
+        super().setUp()
+        self.target_path = tempfile.mkdtemp()
+        self.packages = []
+        for index in range(3):
+            package_path = pathlib.Path(self.target_path, "pkg%s" % index)
+            package_path.mkdir()
+            create_image_file(package_path / "1234-5678-rctb-45-05-0110-e01.tif", "TIFF")
+            xml_target_path = package_path / "pkg.xml"
+            xml_target_path.write_text(
+                self.xml.format(
+                    graphic_01='<graphic xlink:href="1234-5678-rctb-45-05-0110-e01.tif"/>',
+                    graphic_02="",
+                )
+            )
+            self.packages.append(
+                (str(package_path), str(xml_target_path), "S0101-0101201900010000%s" % index)
+            )
+
+    def tearDown(self):
+        shutil.rmtree(self.target_path)
+
+    def test_run_pipeline_optimises_collected_packages_in_processes(self):
+        rows = [{"row": {"pid": package[2]}} for package in self.packages]
+        rows.append({"row": {"pid": "S0101-01012019000100009"}})
+        packages = dict((package[2], package) for package in self.packages)
+
+        with mock.patch.object(
+            build_ps_package.BuildPSPackage, "read_jobs", return_value=iter(rows)
+        ), mock.patch.object(
+            build_ps_package.BuildPSPackage,
+            "collect_package",
+            side_effect=lambda row: packages.get(row["pid"]),
+        ), utils.environ(THREADPOOL_MAX_WORKERS="2"):
+            io_stats, cpu_stats = self.builder.run_pipeline(cpu_workers=1)
+
+        self.assertEqual((4, 0), (io_stats.count, io_stats.errors))
+        self.assertEqual((3, 0), (cpu_stats.count, cpu_stats.errors))
+        for package_path, xml_target_path, _ in self.packages:
+            self.assertTrue(
+                os.path.isfile(
+                    os.path.join(package_path, "1234-5678-rctb-45-05-0110-e01.png")
+                )
+            )
+            with open(xml_target_path) as xmlfile:
+                self.assertIn("1234-5678-rctb-45-05-0110-e01.png", xmlfile.read())
+
+    def test_run_pipeline_counts_cache_use_of_worker_processes(self):
+        rows = [{"row": {"pid": package[2]}} for package in self.packages]
+        packages = dict((package[2], package) for package in self.packages)
+        self.builder.optimised_cache = optimised_assets.OptimisedAssetCache(
+            os.path.join(self.target_path, "cache")
+        )
+
+        with mock.patch.object(
+            build_ps_package.BuildPSPackage, "read_jobs", return_value=iter(rows)
+        ), mock.patch.object(
+            build_ps_package.BuildPSPackage,
+            "collect_package",
+            side_effect=lambda row: packages.get(row["pid"]),
+        ), utils.environ(THREADPOOL_MAX_WORKERS="2"):
+            self.builder.run_pipeline(cpu_workers=1)
+
+        # os pacotes compartilham a mesma imagem, otimizada uma única vez
+        self.assertEqual(
+            (4, 2),
+            (self.builder.optimised_cache.hits, self.builder.optimised_cache.misses),
+        )
+
+    def test_run_pipeline_does_not_block_if_process_pool_fails(self):
+        rows = [{"row": {"pid": package[2]}} for package in self.packages] * 4
+        with mock.patch.object(
+            build_ps_package.BuildPSPackage, "read_jobs", return_value=iter(rows)
+        ), mock.patch.object(
+            build_ps_package.BuildPSPackage,
+            "collect_package",
+            return_value=self.packages[0],
+        ), mock.patch.object(
+            build_ps_package.concurrent.futures,
+            "ProcessPoolExecutor",
+            side_effect=OSError("no processes"),
+        ), utils.environ(THREADPOOL_MAX_WORKERS="2"):
+            io_stats, cpu_stats = self.builder.run_pipeline(cpu_workers=1)
+
+        self.assertEqual(12, io_stats.count)
+        self.assertEqual((12, 12), (cpu_stats.count, cpu_stats.errors))
+
+
+class TestBuildSPSPackageIncremental(TestCase):
+    def setUp(self):
+        self.folder = pathlib.Path(tempfile.mkdtemp())
+        for name in ("xml", "img", "pdf", "out"):
+            (self.folder / name / "test" / "v1n1").mkdir(parents=True)
+        xml_string = utils.build_xml(
+            '<article-id pub-id-type="publisher-id">S0101-01012019000100001</article-id>',
+            "10.1590/S0074-02761962000200006",
+        )
+        (self.folder / "xml" / "test" / "v1n1" / "a01.xml").write_bytes(
+            xml_string.encode("utf-8")
+        )
+        self.pdf = self.folder / "pdf" / "test" / "v1n1" / "a01.pdf"
+        self.pdf.write_bytes(b"PDF")
+        self.row = dict(
+            zip(
+                (
+                    "pid",
+                    "aop_pid",
+                    "file_path",
+                    "date_collection",
+                    "date_created",
+                    "date_updated",
+                    "acron",
+                    "volnum",
+                    "lang",
+                ),
+                (
+                    "S0101-01012019000100001",
+                    "",
+                    "test/v1n1/a01.xml",
+                    "",
+                    "",
+                    "",
+                    "test",
+                    "v1n1",
+                    "pt",
+                ),
+            )
+        )
+        self.fingerprints = package_fingerprints.PackageFingerprints(
+            str(self.folder / "fingerprints.db")
+        )
+        self.builder = build_ps_package.BuildPSPackage(
+            str(self.folder / "xml"),
+            str(self.folder / "img"),
+            str(self.folder / "pdf"),
+            str(self.folder / "out"),
+            "/data/article_data_file.csv",
+            fingerprints=self.fingerprints,
+        )
+        patcher = mock.patch.object(
+            build_ps_package.BuildPSPackage, "optimise_xml_to_web"
+        )
+        self.mk_optimise = patcher.start()
+        self.mk_optimise.return_value = True
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.fingerprints.close()
+        shutil.rmtree(str(self.folder))
+
+    def collect(self):
+        self.builder.start_collect(self.row)
+
+    def test_unchanged_package_is_skipped(self):
+        self.collect()
+        self.collect()
+        self.assertEqual(1, self.mk_optimise.call_count)
+        self.assertEqual({"rebuilt": 1, "skipped": 1}, dict(self.fingerprints.counts))
+        self.assertTrue((self.folder / "out" / "test" / "v1n1" / "a01" / "a01.pdf").exists())
+
+    def test_changed_rendition_rebuilds_package(self):
+        self.collect()
+        stat = self.pdf.stat()
+        os.utime(str(self.pdf), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.collect()
+        self.assertEqual(2, self.mk_optimise.call_count)
+
+    def test_rendition_changed_while_packing_rebuilds_package(self):
+        def change_rendition(*args):
+            stat = self.pdf.stat()
+            os.utime(str(self.pdf), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+            return True
+
+        self.mk_optimise.side_effect = change_rendition
+        self.collect()
+        self.mk_optimise.side_effect = None
+        self.collect()
+        self.assertEqual(2, self.mk_optimise.call_count)
+
+    def test_changed_row_rebuilds_package(self):
+        self.collect()
+        self.row["lang"] = "en"
+        self.collect()
+        self.assertEqual(2, self.mk_optimise.call_count)
+
+    def test_failed_package_is_rebuilt(self):
+        self.mk_optimise.side_effect = OSError
+        with self.assertRaises(OSError):
+            self.collect()
+        self.mk_optimise.side_effect = None
+        self.collect()
+        self.assertEqual(2, self.mk_optimise.call_count)
+        self.assertEqual({"rebuilt": 1, "failed": 1}, dict(self.fingerprints.counts))
+        self.assertEqual({}, self.builder._package_sources)
+
+    def test_package_not_optimised_is_rebuilt(self):
+        self.mk_optimise.return_value = False
+        self.collect()
+        self.assertEqual({"failed": 1}, dict(self.fingerprints.counts))
+        self.assertEqual({}, self.builder._package_sources)
+        self.mk_optimise.return_value = True
+        self.collect()
+        self.assertEqual(2, self.mk_optimise.call_count)
+        self.assertEqual({"rebuilt": 1, "failed": 1}, dict(self.fingerprints.counts))
+
+    def test_package_not_collected_is_released(self):
+        with mock.patch.object(
+            build_ps_package.BuildPSPackage, "collect_xml", side_effect=FileNotFoundError
+        ):
+            self.collect()
+        self.mk_optimise.assert_not_called()
+        self.assertEqual({"failed": 1}, dict(self.fingerprints.counts))
+        self.assertEqual({}, self.builder._package_sources)
+
+
+class TestBuildSPSPackageSiteIndex(TestCase):
+    def setUp(self):
+        self.folder = pathlib.Path(tempfile.mkdtemp())
+        for path in (
+            "xml/test/v1n1/a01.xml",
+            "pdf/TEST/v1n1/A01.PDF",
+            "pdf/TEST/v1n1/a01-en.pdf",
+            "img/test/v1n1/Fig1.JPG",
+            "img/test/v1n1/fig2.tif",
+            "img/test/v1n1/fig2.png",
+        ):
+            path = self.folder / path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(path.name.encode("utf-8"))
+        (self.folder / "out").mkdir()
+        self.target_path = str(self.folder / "out")
+        self.index = site_index.SiteIndex.build(
+            str(self.folder / "site.db"),
+            {
+                "xml": str(self.folder / "xml"),
+                "pdf": str(self.folder / "pdf"),
+                "img": str(self.folder / "img"),
+            },
+        )
+        self.builder = build_ps_package.BuildPSPackage(
+            str(self.folder / "xml"),
+            str(self.folder / "img"),
+            str(self.folder / "pdf"),
+            str(self.folder / "out"),
+            "/data/article_data_file.csv",
+            site_index=self.index,
+        )
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(str(self.folder))
+
+    def test_get_existing_xml_path_looks_up_index(self):
+        with mock.patch("pathlib.Path.is_file") as mk_is_file:
+            result = self.builder.get_existing_xml_path("TEST/V1N1/a01.xml", "test", "v1n1")
+            mk_is_file.assert_not_called()
+        self.assertEqual(os.path.join("test", "v1n1", "a01.xml"), result)
+
+    def test_find_source_does_not_touch_filesystem(self):
+        with mock.patch(
+            "documentstore_migracao.utils.build_ps_package.os.path.isfile"
+        ) as mk_isfile:
+            self.assertIsNone(
+                self.builder.find_source(str(self.folder / "pdf/test/v1n1/en_a01.pdf"))
+            )
+            mk_isfile.assert_not_called()
+
+    def test_collect_renditions_copies_files_with_requested_names(self):
+        result = self.builder.collect_renditions(
+            self.target_path, "test", "v1n1", "a01", ["pt", "en"], "pid"
+        )
+        self.assertEqual({"pt": "a01.pdf", "en": "a01-en.pdf"}, result)
+        self.assertEqual(
+            ["a01-en.pdf", "a01.pdf"], sorted(os.listdir(self.target_path))
+        )
+        self.assertEqual(
+            b"A01.PDF", (self.folder / "out" / "a01.pdf").read_bytes()
+        )
+
+    @mock.patch.object(build_ps_package.BuildPSPackage, "update_xml_with_alternatives")
+    def test_collect_assets_resolves_assets_and_alternatives(self, mk_update_xml):
+        sps_package = mock.Mock(assets=["fig1.jpg", "fig2.jpg"])
+        self.builder.collect_assets(
+            self.target_path, "test", "v1n1", "a01", sps_package, "a01.xml", "pid"
+        )
+        self.assertEqual(
+            ["fig1.jpg", "fig2.png", "fig2.tif"], sorted(os.listdir(self.target_path))
+        )
+        alternatives = mk_update_xml.call_args[0][0]
+        self.assertEqual(["fig2.jpg"], list(alternatives))
+        self.assertEqual(["fig2.png", "fig2.tif"], sorted(alternatives["fig2.jpg"]))
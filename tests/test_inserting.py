@@ -4,12 +4,16 @@ from copy import deepcopy
 import os
 import shutil
 import json
+import random
+import tempfile
+import threading
+import concurrent.futures
 
 from documentstore.domain import DocumentsBundle, Journal
 from documentstore.exceptions import DoesNotExist
 
 from documentstore_migracao.utils.xml import loadToXML
-from documentstore_migracao.utils import manifest
+from documentstore_migracao.utils import bulk_writer, manifest
 from documentstore_migracao.processing import inserting
 from documentstore_migracao import config
 from documentstore_migracao.processing.inserting import (
@@ -72,6 +76,74 @@ class TestLinkDocumentsBundleWithDocuments(unittest.TestCase):
         self.assertEqual("DocumentsBundle", _changes[0]["entity"])
 
 
+    def test_should_update_documents_bundle_with_writer(self):
+        writer = Mock()
+        inserting.link_documents_bundles_with_documents(
+            self.documents_bundle, [{"id": "doc-1", "order": "0001"}], self.session, writer
+        )
+
+        writer.update_bundle.assert_called_once()
+        documents_bundle = writer.update_bundle.call_args[0][0]
+        self.assertEqual(self.documents_bundle.id(), documents_bundle.id())
+        self.assertEqual([{"id": "doc-1", "order": "0001"}], documents_bundle.documents)
+        self.assertEqual([], self.session.changes.filter())
+
+
+class TestAddDocumentsToBundle(unittest.TestCase):
+    def setUp(self):
+        self.documents_bundle = DocumentsBundle(
+            manifest=manifest.get_document_bundle_manifest(
+                "0001-3714-aop", "2019-01-01T00:00:00.000000Z"
+            )
+        )
+
+    def test_new_documents_are_appended_in_order(self):
+        self.documents_bundle.add_document({"id": "doc-2", "order": "0002"})
+        documents_bundle = inserting.add_documents_to_bundle(
+            self.documents_bundle,
+            [
+                {"id": "doc-3", "order": "0003"},
+                {"id": "doc-2", "order": "0002"},
+                {"id": "doc-1", "order": "0001"},
+                {"id": "doc-3", "order": "0003"},
+            ],
+        )
+        self.assertEqual(
+            ["doc-2", "doc-3", "doc-1"],
+            [item["id"] for item in documents_bundle.documents],
+        )
+        self.assertNotEqual("2019-01-01T00:00:00.000000Z", documents_bundle.manifest["updated"])
+
+    def test_large_bundles_are_linked_without_add_document(self):
+        items = [{"id": "doc-%s" % index, "order": ""} for index in range(50000)]
+        with patch.object(DocumentsBundle, "add_document") as mk_add_document:
+            documents_bundle = inserting.add_documents_to_bundle(
+                self.documents_bundle, items[:25000]
+            )
+            documents_bundle = inserting.add_documents_to_bundle(documents_bundle, items)
+        mk_add_document.assert_not_called()
+        self.assertEqual(items, documents_bundle.documents)
+
+
+class TestFetchDocumentsBundles(unittest.TestCase):
+    def test_bundles_are_fetched_in_batches(self):
+        session = Mock()
+        session._mongodb_client.documents_bundles.find.side_effect = lambda query: [
+            {"_id": bundle_id, "id": bundle_id, "items": []}
+            for bundle_id in query["_id"]["$in"]
+        ]
+        bundles = inserting.fetch_documents_bundles(
+            session, ["bundle-%s" % index for index in range(5)], batch_size=2
+        )
+
+        self.assertEqual(3, session._mongodb_client.documents_bundles.find.call_count)
+        self.assertEqual(["bundle-%s" % index for index in range(5)], list(bundles))
+        self.assertEqual("bundle-4", bundles["bundle-4"].id())
+
+    def test_without_mongodb_client_nothing_is_fetched(self):
+        self.assertEqual({}, inserting.fetch_documents_bundles(Session(), ["bundle-0"]))
+
+
 class TestProcessingInserting(unittest.TestCase):
     def setUp(self):
         self.data = dict(
@@ -467,6 +539,7 @@ class TestProcessingInserting(unittest.TestCase):
             documents_bundle,
             [{"id": "JwqGdMDrdcV3Z7MFHgtKvVk", "order": "00349"}],
             session_db,
+            ANY,
         )
 
 
@@ -645,3 +718,442 @@ class TestDocumentRegister(unittest.TestCase):
                 assets, "some-prefix", mk_store, ignore_missing_assets=False
             )
 
+
+def legacy_get_document_assets_path(static_assets, folder_files, folder, prefered_types):
+    """Implementação anterior de `get_document_assets_path`, que compara todos
+    os arquivos do pacote com todos os assets do XML"""
+    static_assets = dict([(asset, None) for asset in static_assets])
+    static_additionals = {}
+
+    for folder_file in folder_files:
+        file_name, extension = os.path.splitext(folder_file)
+
+        for key in static_assets.keys():
+            path = os.path.join(folder, folder_file)
+
+            if key == folder_file:
+                static_assets[key] = path
+            elif key in folder_file and extension in prefered_types:
+                static_assets[key] = path
+            elif key in folder_file and static_assets[key] is None:
+                static_assets[key] = path
+            elif file_name == key:
+                static_additionals[key] = path
+            elif file_name == os.path.splitext(key)[0]:
+                static_additionals[file_name] = path
+
+    return (static_assets, static_additionals)
+
+
+class TestDocumentAssetsIndex(unittest.TestCase):
+    def get_document_assets_path(self, static_assets, folder_files, prefered_types):
+        with patch(
+            "documentstore_migracao.processing.inserting.get_static_assets",
+            return_value=[(asset, "graphic") for asset in static_assets],
+        ):
+            return get_document_assets_path(
+                None, folder_files, "/pkg", prefered_types=prefered_types
+            )
+
+    def assertSameAsLegacy(self, static_assets, folder_files, prefered_types=[".tif"]):
+        expected = legacy_get_document_assets_path(
+            static_assets, folder_files, "/pkg", prefered_types
+        )
+        result = self.get_document_assets_path(
+            static_assets, folder_files, prefered_types
+        )
+        self.assertEqual(expected, result)
+        self.assertEqual(list(expected[1].keys()), list(result[1].keys()))
+
+    def test_sample_packages_have_the_same_assets(self):
+        self.assertSameAsLegacy(
+            ["0034-8910-rsp-47-02-0231-gf01", "0034-8910-rsp-47-02-0231-gf01-en"],
+            [
+                "0034-8910-rsp-47-02-0231-en.pdf",
+                "0034-8910-rsp-47-02-0231-gf01-en.jpg",
+                "0034-8910-rsp-47-02-0231-gf01-en.tif",
+                "0034-8910-rsp-47-02-0231-gf01.jpg",
+                "0034-8910-rsp-47-02-0231-gf01.tif",
+                "0034-8910-rsp-47-02-0231.pdf",
+                "0034-8910-rsp-47-02-0231.xml",
+            ],
+        )
+
+    def test_asset_references_with_extension(self):
+        self.assertSameAsLegacy(
+            ["pkg-img.gif", "pkg-gf01.jpg", "pkg-gf02"],
+            ["pkg-gf02.png", "pkg-img.tif", "pkg-gf01.jpg", "pkg-img.gif", "pkg-gf01.tif"],
+        )
+
+    def test_files_are_matched_in_package_order(self):
+        files = ["pkg-gf01-en.jpg", "pkg-gf01.jpg", "pkg-gf01.png", "pkg-gf01-en.png"]
+        for folder_files in (files, list(reversed(files))):
+            with self.subTest(folder_files=folder_files):
+                self.assertSameAsLegacy(["pkg-gf01", "pkg-gf01-en"], folder_files)
+
+    def test_random_packages_have_the_same_assets(self):
+        generator = random.Random(2020)
+        names = ["pkg-gf1", "pkg-gf10", "pkg-gf01", "pkg-gf01-en", "pkg-img", "pkg-fx1"]
+        extensions = ["", ".tif", ".tiff", ".jpg", ".png", ".gif", ".tif.jpg"]
+        for _ in range(500):
+            folder_files = generator.sample(
+                [name + extension for name in names for extension in extensions],
+                generator.randint(0, 20),
+            )
+            static_assets = [
+                generator.choice(names) + generator.choice(extensions[:3])
+                for _ in range(generator.randint(0, 6))
+            ]
+            prefered_types = generator.choice([[".tif"], [".tif", ".tiff"], []])
+            with self.subTest(static_assets=static_assets, folder_files=folder_files):
+                self.assertSameAsLegacy(static_assets, folder_files, prefered_types)
+
+    def test_large_packages(self):
+        static_assets = ["pkg-gf%04d" % index for index in range(5000)]
+        folder_files = [
+            asset + extension
+            for asset in static_assets
+            for extension in (".jpg", ".tif", ".png")
+        ]
+        assets, additionals = self.get_document_assets_path(
+            static_assets, folder_files, [".tif"]
+        )
+        self.assertEqual("/pkg/pkg-gf4999.tif", assets["pkg-gf4999"])
+        self.assertEqual("/pkg/pkg-gf4999.png", additionals["pkg-gf4999"])
+        self.assertEqual(5000, len(additionals))
+
+
+class TestRegisterFiles(unittest.TestCase):
+    def setUp(self):
+        self.storage = Mock()
+        self.storage.register.side_effect = lambda path, prefix, *args: (
+            "http://storage.io/%s/%s" % (prefix, path)
+        )
+
+    def tearDown(self):
+        inserting.UPLOAD_EXECUTOR = None
+
+    def test_register_files_returns_urls_in_order(self):
+        self.assertEqual(
+            ["http://storage.io/p/a.jpg", "http://storage.io/p/b.jpg"],
+            inserting.register_files(self.storage, [("a.jpg", "p"), ("b.jpg", "p")]),
+        )
+
+    def test_register_files_uses_shared_upload_executor(self):
+        barrier = threading.Barrier(3, timeout=5)
+
+        def register(path, prefix):
+            # os três envios precisam estar em andamento ao mesmo tempo
+            barrier.wait()
+            return "http://storage.io/%s/%s" % (prefix, path)
+
+        self.storage.register.side_effect = register
+        assets = {"gf%s" % index: "gf%s.tif" % index for index in range(3)}
+        with concurrent.futures.ThreadPoolExecutor(3) as executor:
+            inserting.UPLOAD_EXECUTOR = executor
+            results = put_static_assets_into_storage(assets, "p", self.storage)
+
+        self.assertEqual(
+            [
+                {"asset_id": "gf%s" % index, "asset_url": "http://storage.io/p/gf%s.tif" % index}
+                for index in range(3)
+            ],
+            results,
+        )
+
+    def test_register_files_raises_upload_exceptions(self):
+        self.storage.register.side_effect = [TypeError, "http://storage.io/b.jpg"]
+        with concurrent.futures.ThreadPoolExecutor(1) as executor:
+            inserting.UPLOAD_EXECUTOR = executor
+            with self.assertRaises(TypeError):
+                inserting.register_files(self.storage, [("a.jpg", "p"), ("b.jpg", "p")])
+
+
+class TestImportedDocuments(unittest.TestCase):
+    def tearDown(self):
+        inserting.IMPORTED_DOCUMENTS = None
+
+    def test_fetch_imported_documents_reads_only_ids(self):
+        session = Mock()
+        session._mongodb_client.documents.find.return_value = iter(
+            [{"_id": "doc-1"}, {"_id": "doc-2"}]
+        )
+        self.assertEqual(
+            {"doc-1", "doc-2"}, inserting.fetch_imported_documents(session)
+        )
+        session._mongodb_client.documents.find.assert_called_once_with(
+            {}, projection={"_id": True}
+        )
+
+    def test_fetch_imported_documents_without_mongodb_client(self):
+        self.assertIsNone(inserting.fetch_imported_documents(Session()))
+
+    def test_fetch_imported_documents_without_documents_collection(self):
+        session = Mock(_mongodb_client=object())
+        self.assertIsNone(inserting.fetch_imported_documents(session))
+
+    def test_document_exists_uses_imported_documents(self):
+        session = Mock()
+        inserting.IMPORTED_DOCUMENTS = {"doc-1"}
+        self.assertTrue(inserting.document_exists(session, "doc-1"))
+        self.assertFalse(inserting.document_exists(session, "doc-2"))
+        session.documents.fetch.assert_not_called()
+
+    def test_document_exists_fetches_document_when_ids_are_not_loaded(self):
+        session = Mock()
+        session.documents.fetch.side_effect = [Mock(), DoesNotExist]
+        self.assertTrue(inserting.document_exists(session, "doc-1"))
+        self.assertFalse(inserting.document_exists(session, "doc-2"))
+        session.documents.fetch.assert_has_calls([call(id="doc-1"), call(id="doc-2")])
+
+
+class TestImportWorker(unittest.TestCase):
+    def setUp(self):
+        self.storage = Mock()
+        self.worker = inserting.ImportWorker(
+            mongodb_uri="mongodb://localhost:27017",
+            mongodb_name="document-store",
+            pid_database_dsn="sqlite:///pid_manager_database.db",
+            storage=self.storage,
+        )
+
+    def tearDown(self):
+        inserting.IMPORT_WORKER = None
+        inserting.IMPORTED_DOCUMENTS = None
+        if inserting.UPLOAD_EXECUTOR is not None:
+            inserting.UPLOAD_EXECUTOR.shutdown()
+        inserting.UPLOAD_EXECUTOR = None
+
+    @patch("documentstore_migracao.processing.inserting.create_engine")
+    @patch("documentstore_migracao.processing.inserting.ds_adapters")
+    def test_resources_are_created_on_first_use(self, mk_adapters, mk_create_engine):
+        mk_adapters.Session.assert_not_called()
+        self.assertIs(self.worker.session, self.worker.session)
+        self.assertIs(self.worker.pid_database_engine, self.worker.pid_database_engine)
+        mk_adapters.MongoDB.assert_called_once_with(
+            uri="mongodb://localhost:27017", dbname="document-store", options=None
+        )
+        mk_create_engine.assert_called_once_with(
+            "sqlite:///pid_manager_database.db", connect_args=ANY
+        )
+
+    def test_connections_are_not_transferred_between_processes(self):
+        self.worker._session = object()
+        self.worker._pid_database_engine = object()
+        state = self.worker.__getstate__()
+        self.assertIsNone(state["_session"])
+        self.assertIsNone(state["_pid_database_engine"])
+        self.assertIs(self.storage, state["storage"])
+
+    @patch("documentstore_migracao.processing.inserting.multiprocessing.util.Finalize")
+    @patch("documentstore_migracao.processing.inserting.register_document")
+    def test_packages_are_registered_with_worker_resources(
+        self, mk_register_document, mk_finalize
+    ):
+        self.worker._session = Mock()
+        self.worker._pid_database_engine = Mock()
+        mk_register_document.return_value = {"pid_v3": "doc-1"}
+        inserting.init_import_worker(self.worker, {"doc-0"}, 2, 0)
+
+        self.assertEqual({"doc-0"}, inserting.IMPORTED_DOCUMENTS)
+        self.assertIsNotNone(inserting.UPLOAD_EXECUTOR)
+        mk_finalize.assert_called_once_with(
+            None, inserting.finish_import, args=(self.storage,), exitpriority=10
+        )
+        self.assertEqual({"pid_v3": "doc-1"}, inserting.register_package("/pkg"))
+        mk_register_document.assert_called_once_with(
+            "/pkg",
+            self.worker._session,
+            self.storage,
+            self.worker._pid_database_engine,
+            ANY,
+        )
+
+    @patch("documentstore_migracao.processing.inserting.multiprocessing.util.Finalize")
+    @patch("documentstore_migracao.processing.inserting.prepare_document")
+    def test_documents_written_in_bulk_are_returned_to_main_process(
+        self, mk_prepare_document, mk_finalize
+    ):
+        self.worker._session = Mock()
+        self.worker._pid_database_engine = Mock()
+        prepared = ({"pid_v3": "doc-1"}, {"id": "doc-1"}, False)
+        mk_prepare_document.return_value = prepared
+        inserting.init_import_worker(self.worker, {"doc-0"}, 2, 10)
+
+        self.assertEqual(prepared, inserting.register_package("/pkg"))
+        mk_prepare_document.assert_called_once_with(
+            "/pkg",
+            self.worker._session,
+            self.storage,
+            self.worker._pid_database_engine,
+            ANY,
+        )
+
+    def test_finish_import_stops_uploads(self):
+        inserting.UPLOAD_EXECUTOR = concurrent.futures.ThreadPoolExecutor(1)
+        inserting.finish_import(self.storage)
+
+        self.assertIsNone(inserting.UPLOAD_EXECUTOR)
+        self.storage.log_summary.assert_called_once_with()
+
+    def test_package_result_is_written_after_document(self):
+        writer = bulk_writer.BulkWriter(Session(), batch_size=2)
+        results = Mock()
+        inserting.write_prepared_document(
+            writer,
+            results,
+            ({"package": "/pkg-1"}, {"id": "doc-1"}, True),
+        )
+        results.write_json.assert_not_called()
+
+        writer.flush()
+        results.write_json.assert_called_once_with({"package": "/pkg-1"})
+
+    def test_package_with_document_not_written_is_not_in_results(self):
+        writer = bulk_writer.BulkWriter(Session(), batch_size=2)
+        results = Mock()
+        with patch.object(
+            bulk_writer, "add_document", side_effect=ValueError("invalid")
+        ), self.assertLogs(inserting.logger, "ERROR") as logs:
+            inserting.write_prepared_document(
+                writer,
+                results,
+                ({"package": "/pkg-1"}, {"id": "doc-1"}, False),
+            )
+            writer.flush()
+
+        results.write_json.assert_not_called()
+        self.assertIn("Could not import package '/pkg-1'", logs.output[0])
+
+    def test_package_already_registered_is_written_immediately(self):
+        writer = Mock()
+        results = Mock()
+        inserting.write_prepared_document(
+            writer, results, ({"package": "/pkg-1"}, None, False)
+        )
+        results.write_json.assert_called_once_with({"package": "/pkg-1"})
+        writer.add_document.assert_not_called()
+
+    @patch("documentstore_migracao.processing.inserting.DoJobsConcurrently")
+    def test_import_in_process_pool(self, mk_do_jobs):
+        output = os.path.join(SAMPLES_PATH, "import-output.jsonl")
+        inserting.import_documents_to_kernel(
+            Session(),
+            None,
+            self.storage,
+            SAMPLES_PATH,
+            output,
+            upload_workers=2,
+            bulk_write_size=10,
+            executor="process",
+            worker=self.worker,
+        )
+
+        func = mk_do_jobs.call_args[0][0]
+        kwargs = mk_do_jobs.call_args[1]
+        self.assertIs(inserting.register_package, func)
+        self.assertIn(
+            {"folder": os.path.join(SAMPLES_PATH, "0034-8910-rsp-47-02-0231")},
+            list(kwargs["jobs"]),
+        )
+        self.assertIs(concurrent.futures.ProcessPoolExecutor, kwargs["executor"].func)
+        self.assertEqual(
+            (self.worker, None, 2, 10), kwargs["executor"].keywords["initargs"]
+        )
+        self.assertIs(
+            inserting.write_prepared_document, kwargs["success_callback"].func
+        )
+        self.assertIsNone(inserting.UPLOAD_EXECUTOR)
+        self.storage.log_summary.assert_not_called()
+        self.assertFalse(os.path.exists(output))
+
+
+class TestPackageDiscovery(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        for package in ("a01", "a02", "a03"):
+            os.makedirs(self.package(package))
+            open(os.path.join(self.package(package), "a.xml"), "w").close()
+        self.output = os.path.join(self.folder, "output.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+        inserting.UPLOAD_EXECUTOR = None
+
+    def package(self, name):
+        return os.path.join(self.folder, "packages", "rsp", name)
+
+    def import_packages(self, **kwargs):
+        folders = []
+
+        def do_jobs(func, jobs, **options):
+            folders.extend(job["folder"] for job in jobs)
+
+        with patch(
+            "documentstore_migracao.processing.inserting.DoJobsConcurrently",
+            side_effect=do_jobs,
+        ) as mk_do_jobs:
+            inserting.import_documents_to_kernel(
+                Session(),
+                None,
+                Mock(),
+                os.path.join(self.folder, "packages"),
+                self.output,
+                **kwargs
+            )
+        self.assertIsNotNone(mk_do_jobs.call_args[1]["max_pending"])
+        return folders
+
+    def test_packages_are_found_in_folder(self):
+        self.assertEqual(
+            [self.package("a01"), self.package("a02"), self.package("a03")],
+            sorted(self.import_packages()),
+        )
+
+    def test_packages_already_in_output_are_skipped(self):
+        with open(self.output, "w") as fp:
+            fp.write(json.dumps({"pid_v3": "doc-1", "package": self.package("a02")}) + "\n")
+            fp.write("null\n")
+        self.assertEqual(
+            [self.package("a01"), self.package("a03")], sorted(self.import_packages())
+        )
+
+    def test_packages_are_read_from_package_list(self):
+        package_list = os.path.join(self.folder, "packages.txt")
+        with open(package_list, "w") as fp:
+            fp.write("rsp/a03\nrsp/a01\n")
+        self.assertEqual(
+            [self.package("a03"), self.package("a01")],
+            self.import_packages(package_list=package_list),
+        )
+
+    @patch("documentstore_migracao.processing.inserting.DoJobsConcurrently")
+    def test_results_are_written_after_documents_in_bulk(self, mk_do_jobs):
+        inserting.import_documents_to_kernel(
+            Session(),
+            None,
+            Mock(),
+            os.path.join(self.folder, "packages"),
+            self.output,
+            bulk_write_size=10,
+        )
+        self.assertIs(inserting.prepare_document, mk_do_jobs.call_args[0][0])
+        self.assertIs(
+            inserting.write_prepared_document,
+            mk_do_jobs.call_args[1]["success_callback"].func,
+        )
+
+    @patch("documentstore_migracao.processing.inserting.DoJobsConcurrently")
+    def test_documents_are_written_one_by_one(self, mk_do_jobs):
+        inserting.import_documents_to_kernel(
+            Session(),
+            None,
+            Mock(),
+            os.path.join(self.folder, "packages"),
+            self.output,
+            bulk_write_size=0,
+        )
+        self.assertIs(inserting.register_document, mk_do_jobs.call_args[0][0])
+
+    def test_imported_packages_without_output(self):
+        self.assertEqual(set(), inserting.imported_packages(self.output))
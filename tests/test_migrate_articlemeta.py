@@ -63,7 +63,16 @@ class TestMigrateProcess(unittest.TestCase):
             SOURCE_IMG_FILE=os.path.join(os.path.dirname(__file__), "samples"),
         ):
             migrate_articlemeta_parser(["pack"])
-            mk_pack_article_ALLxml.assert_called_once_with()
+            mk_pack_article_ALLxml.assert_called_once_with(executor="thread")
+
+    @patch("documentstore_migracao.processing.packing.pack_article_ALLxml")
+    def test_command_pack_sps_with_process_executor(self, mk_pack_article_ALLxml):
+        with utils.environ(
+            SOURCE_PDF_FILE=os.path.join(os.path.dirname(__file__), "samples"),
+            SOURCE_IMG_FILE=os.path.join(os.path.dirname(__file__), "samples"),
+        ):
+            migrate_articlemeta_parser(["pack", "--executor", "process"])
+            mk_pack_article_ALLxml.assert_called_once_with(executor="process")
 
     @patch("documentstore_migracao.processing.packing.pack_article_xml")
     def test_command_pack_sps_arg_pathFile(self, mk_pack_article_xml):
@@ -107,7 +116,16 @@ class TestMigrateProcess(unittest.TestCase):
             ]
         )
         mk_import_documents_to_kernel.assert_called_once_with(
-            session_db=ANY, pid_database_engine=ANY, storage=ANY, folder=ANY, output_path=ANY
+            session_db=ANY,
+            pid_database_engine=ANY,
+            storage=ANY,
+            folder=ANY,
+            output_path=ANY,
+            upload_workers=16,
+            bulk_write_size=500,
+            executor="thread",
+            worker=None,
+            package_list=None,
         )
 
     @patch("documentstore_migracao.processing.inserting.register_documents_in_documents_bundle")
@@ -122,9 +140,14 @@ class TestMigrateProcess(unittest.TestCase):
                 "document-store",
                 "/tmp/docs.json",
                 "/tmp/jornal.json",
+                "--workers",
+                "8",
             ]
         )
         mk_register_documents_in_documents_bundle.assert_called_once_with(
-            session_db=ANY, file_documents=ANY, file_journals=ANY
+            session_db=ANY,
+            file_documents=ANY,
+            file_journals=ANY,
+            max_workers=8,
         )
 
@@ -0,0 +1,84 @@
+import os
+import pickle
+import hashlib
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from documentstore_migracao.object_store import local
+
+
+class TestLocalObjectStorage(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.folder, "a01.pdf")
+        with open(self.file_path, "wb") as fp:
+            fp.write(b"PDF")
+        self.object_name = "prefix/%s.pdf" % hashlib.sha1(b"PDF").hexdigest()
+        self.root = os.path.join(self.folder, "objects")
+        self.storage = local.LocalObjectStorage(
+            self.root, base_url="http://static.scielo.org/documentstore/"
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_register_stores_content_addressed_object(self):
+        url = self.storage.register(self.file_path, "prefix")
+        self.assertEqual(
+            "http://static.scielo.org/documentstore/" + self.object_name, url
+        )
+        with open(os.path.join(self.root, *self.object_name.split("/")), "rb") as fp:
+            self.assertEqual(b"PDF", fp.read())
+        self.assertEqual([], [
+            name for name in os.listdir(os.path.join(self.root, "prefix"))
+            if name.startswith(".tmp-")
+        ])
+
+    def test_register_skips_existing_objects(self):
+        self.storage.register(self.file_path, "prefix")
+        with mock.patch(
+            "documentstore_migracao.object_store.local.files.materialize_file"
+        ) as mk_materialize:
+            self.storage.register(self.file_path, "prefix")
+            mk_materialize.assert_not_called()
+        self.assertEqual(1, self.storage.uploaded_objects)
+
+    def test_default_base_url_is_folder_uri(self):
+        storage = local.LocalObjectStorage(self.root)
+        self.assertEqual(
+            "file://%s/prefix/a%%20b.pdf" % os.path.realpath(self.root),
+            storage.get_urls("prefix/a b.pdf"),
+        )
+
+    def test_remove_deletes_object(self):
+        self.storage.register(self.file_path, "prefix")
+        self.storage.remove(self.object_name)
+        self.assertFalse(self.storage.exists(self.object_name))
+        self.storage.remove(self.object_name)
+
+    def test_objects_are_synced_in_batches(self):
+        storage = local.LocalObjectStorage(self.root, fsync_batch=2)
+        with mock.patch("documentstore_migracao.object_store.local.os.fsync") as mk_fsync:
+            storage.register(self.file_path, "prefix")
+            mk_fsync.assert_not_called()
+            storage.register(self.file_path, "other")
+            # dois objetos e as suas pastas
+            self.assertEqual(4, mk_fsync.call_count)
+
+    def test_flush_syncs_pending_objects(self):
+        storage = local.LocalObjectStorage(self.root, fsync_batch=10)
+        storage.register(self.file_path, "prefix")
+        with mock.patch("documentstore_migracao.object_store.local.os.fsync") as mk_fsync:
+            storage.flush()
+            self.assertEqual(2, mk_fsync.call_count)
+            storage.flush()
+            self.assertEqual(2, mk_fsync.call_count)
+
+    def test_storage_can_be_pickled(self):
+        storage = pickle.loads(pickle.dumps(self.storage))
+        self.assertEqual(
+            "http://static.scielo.org/documentstore/" + self.object_name,
+            storage.register(self.file_path, "prefix"),
+        )
@@ -0,0 +1,353 @@
+import os
+import math
+import pickle
+import sqlite3
+import hashlib
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+from unittest import mock
+
+import urllib3
+from minio import Minio
+from minio.error import NoSuchBucket, NoSuchKey
+
+from documentstore_migracao.object_store import minio, known_objects
+
+
+class TestMinioStorage(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.folder, "a01.xml")
+        with open(self.file_path, "wb") as fp:
+            fp.write(b"<article/>")
+        self.sha1 = hashlib.sha1(b"<article/>").hexdigest()
+        self.storage = minio.MinioStorage(
+            "localhost:9000", "access", "secret", minio_secure=False
+        )
+        self.mk_client = mock.Mock()
+        self.mk_client.stat_object.side_effect = NoSuchKey(mock.Mock())
+        self.storage._client_instance = self.mk_client
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_register_uploads_content_read_once(self):
+        with mock.patch(
+            "documentstore_migracao.object_store.minio.files.sha1"
+        ) as mk_sha1:
+            self.storage.register(self.file_path, "0034-8910-rsp")
+            mk_sha1.assert_not_called()
+
+        kwargs = self.mk_client.put_object.call_args[1]
+        self.assertEqual(
+            "0034-8910-rsp/%s.xml" % self.sha1, kwargs["object_name"]
+        )
+        self.assertEqual(b"<article/>", kwargs["data"].read())
+        self.assertEqual(10, kwargs["length"])
+
+    def test_register_builds_url_without_signing_it(self):
+        url = self.storage.register(self.file_path, "0034-8910-rsp")
+        self.assertEqual(
+            "http://localhost:9000/documentstore/0034-8910-rsp/%s.xml"
+            % self.sha1,
+            url,
+        )
+        self.mk_client.presigned_get_object.assert_not_called()
+
+    def test_register_uploads_large_files_from_disk(self):
+        self.storage.single_read_max_size = 5
+        self.storage.register(self.file_path, "0034-8910-rsp")
+        kwargs = self.mk_client.put_object.call_args[1]
+        self.assertEqual("0034-8910-rsp/%s.xml" % self.sha1, kwargs["object_name"])
+        self.assertEqual(self.file_path, kwargs["data"].name)
+        self.assertEqual(10, kwargs["length"])
+
+    def test_register_uses_sha1_known_by_asset_store(self):
+        with mock.patch(
+            "documentstore_migracao.object_store.minio.asset_store.known_sha1",
+            return_value="abc",
+        ):
+            url = self.storage.register(self.file_path, "prefix")
+        self.assertEqual("http://localhost:9000/documentstore/prefix/abc.xml", url)
+        self.assertEqual(self.file_path, self.mk_client.put_object.call_args[1]["data"].name)
+
+    def test_register_creates_bucket_if_it_does_not_exist(self):
+        self.mk_client.put_object.side_effect = [NoSuchBucket(mock.Mock()), None]
+        self.storage.register(self.file_path, "prefix")
+        self.mk_client.make_bucket.assert_called_once()
+        self.assertEqual(2, self.mk_client.put_object.call_count)
+
+    def test_single_read_max_size_is_read_from_config(self):
+        with mock.patch.dict(os.environ, {"MINIO_SINGLE_READ_MAX_MB": "2"}):
+            storage = minio.MinioStorage("localhost:9000", "access", "secret")
+        self.assertEqual(2 * minio.MB, storage.single_read_max_size)
+
+    def test_get_urls_uses_https_for_secure_servers(self):
+        storage = minio.MinioStorage("minio.scielo.br", "access", "secret")
+        self.assertEqual(
+            "https://minio.scielo.br/documentstore/prefix/a01.pdf",
+            storage.get_urls("prefix/a01.pdf"),
+        )
+
+    def test_get_urls_quotes_object_name(self):
+        self.assertEqual(
+            "http://localhost:9000/documentstore/prefix/a%20b.pdf",
+            self.storage.get_urls("prefix/a b.pdf"),
+        )
+
+    def test_get_urls_matches_presigned_urls(self):
+        # a região informada evita a consulta da localização do bucket
+        for host, secure, region in (
+            ("127.0.0.1:9000", False, "us-east-1"),
+            ("minio.scielo.br", True, "us-east-1"),
+            ("s3.amazonaws.com", True, "us-east-1"),
+            ("s3.amazonaws.com", True, "sa-east-1"),
+        ):
+            with self.subTest(host=host, region=region):
+                storage = minio.MinioStorage(host, "access", "secret", secure)
+                storage._client_instance = Minio(
+                    host,
+                    access_key="access",
+                    secret_key="secret",
+                    secure=secure,
+                    region=region,
+                )
+                self.assertEqual(
+                    storage._client.presigned_get_object(
+                        "documentstore", "prefix/a b.tif"
+                    ).split("?")[0],
+                    storage.get_urls("prefix/a b.tif"),
+                )
+
+    def test_get_urls_uses_virtual_host_for_aws(self):
+        storage = minio.MinioStorage("s3.amazonaws.com", "access", "secret")
+        storage._client_instance = mock.Mock()
+        storage._client_instance._get_bucket_region.return_value = "us-east-1"
+        self.assertEqual(
+            "https://documentstore.s3.amazonaws.com/x/y.tif", storage.get_urls("x/y.tif")
+        )
+
+
+class TestMinioStorageKnownObjects(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.folder, "a01.pdf")
+        with open(self.file_path, "wb") as fp:
+            fp.write(b"PDF")
+        self.object_name = "prefix/%s.pdf" % hashlib.sha1(b"PDF").hexdigest()
+        self.known_objects = known_objects.KnownObjects(
+            os.path.join(self.folder, "known.db")
+        )
+        self.storage = minio.MinioStorage(
+            "localhost:9000",
+            "access",
+            "secret",
+            minio_secure=False,
+            known_objects=self.known_objects,
+        )
+        self.mk_client = mock.Mock()
+        self.mk_client.stat_object.side_effect = NoSuchKey(mock.Mock())
+        self.storage._client_instance = self.mk_client
+
+    def tearDown(self):
+        self.known_objects.close()
+        shutil.rmtree(self.folder)
+
+    def test_uploaded_object_is_recorded(self):
+        self.storage.register(self.file_path, "prefix")
+        self.mk_client.put_object.assert_called_once()
+        self.assertIn(("documentstore", self.object_name), self.known_objects)
+
+    def test_known_object_is_skipped_without_network_calls(self):
+        self.storage.register(self.file_path, "prefix")
+        self.mk_client.reset_mock()
+        url = self.storage.register(self.file_path, "prefix")
+        self.assertEqual(
+            "http://localhost:9000/documentstore/" + self.object_name, url
+        )
+        self.mk_client.stat_object.assert_not_called()
+        self.mk_client.put_object.assert_not_called()
+
+    def test_object_found_in_bucket_is_skipped_and_recorded(self):
+        self.mk_client.stat_object.side_effect = None
+        self.storage.register(self.file_path, "prefix")
+        self.mk_client.stat_object.assert_called_once_with(
+            "documentstore", self.object_name
+        )
+        self.mk_client.put_object.assert_not_called()
+        self.assertIn(("documentstore", self.object_name), self.known_objects)
+
+    def test_known_objects_are_kept_between_runs(self):
+        self.storage.register(self.file_path, "prefix")
+        self.known_objects.close()
+        other = known_objects.KnownObjects(os.path.join(self.folder, "known.db"))
+        self.assertIn(("documentstore", self.object_name), other)
+        self.assertNotIn(("other-bucket", self.object_name), other)
+        other.close()
+
+    def test_cache_is_opened_in_wal_mode(self):
+        journal_mode = self.known_objects._connect().execute(
+            "PRAGMA journal_mode"
+        ).fetchone()[0]
+        self.assertEqual("wal", journal_mode)
+
+    def test_locked_cache_does_not_fail_upload(self):
+        cache = known_objects.KnownObjects(
+            os.path.join(self.folder, "known.db"), timeout=0.1
+        )
+        self.storage.known_objects = cache
+        self.known_objects._connect()
+        other = sqlite3.connect(os.path.join(self.folder, "known.db"))
+        other.execute("BEGIN EXCLUSIVE")
+        try:
+            with self.assertLogs(known_objects.logger, level="WARNING"):
+                url = self.storage.register(self.file_path, "prefix")
+        finally:
+            other.rollback()
+            other.close()
+            cache.close()
+        self.assertEqual("http://localhost:9000/documentstore/" + self.object_name, url)
+        self.mk_client.put_object.assert_called_once()
+
+    def test_unreadable_cache_is_a_cache_miss(self):
+        with mock.patch.object(
+            self.known_objects,
+            "_connect",
+            side_effect=sqlite3.OperationalError("database is locked"),
+        ):
+            self.mk_client.stat_object.side_effect = None
+            self.storage.register(self.file_path, "prefix")
+        self.mk_client.stat_object.assert_called_once()
+        self.mk_client.put_object.assert_not_called()
+
+    def test_objects_are_recorded_by_concurrent_processes(self):
+        path = os.path.join(self.folder, "shared.db")
+        known_objects.KnownObjects(path).close()
+        context = multiprocessing.get_context("fork")
+        processes = [
+            context.Process(target=add_known_objects, args=(path, index))
+            for index in range(4)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.assertEqual([0, 0, 0, 0], [process.exitcode for process in processes])
+        cache = known_objects.KnownObjects(path)
+        count = cache._connect().execute("SELECT COUNT(*) FROM objects").fetchone()[0]
+        cache.close()
+        self.assertEqual(4 * 200, count)
+
+    def test_remove_forgets_object(self):
+        self.storage.register(self.file_path, "prefix")
+        self.storage.remove(self.object_name)
+        self.assertNotIn(("documentstore", self.object_name), self.known_objects)
+
+
+def add_known_objects(path, index):
+    cache = known_objects.KnownObjects(path)
+    with mock.patch.object(known_objects.logger, "warning", side_effect=SystemExit(1)):
+        for name in range(200):
+            cache.add("documentstore", "%s/%s" % (index, name))
+    cache.close()
+
+
+class FakeS3:
+    """Cliente Min.io em memória"""
+
+    def __init__(self):
+        self.objects = {}
+        self.puts = []
+
+    def stat_object(self, bucket_name, object_name):
+        if (bucket_name, object_name) not in self.objects:
+            raise NoSuchKey(mock.Mock())
+
+    def put_object(self, bucket_name, object_name, data, length, part_size=None):
+        self.objects[(bucket_name, object_name)] = data.read(length)
+        self.puts.append((length, part_size))
+
+
+class TestMinioStorageMultipart(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.folder, "a01.pdf")
+        self.data = os.urandom(minio.MIN_PART_SIZE * 3 + 10)
+        with open(self.file_path, "wb") as fp:
+            fp.write(self.data)
+        self.object_name = "prefix/%s.pdf" % hashlib.sha1(self.data).hexdigest()
+        self.client = FakeS3()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def storage(self, **kwargs):
+        storage = minio.MinioStorage(
+            "localhost:9000", "access", "secret", minio_secure=False, **kwargs
+        )
+        storage._client_instance = self.client
+        return storage
+
+    def test_small_objects_are_uploaded_in_a_single_request(self):
+        self.storage(multipart_threshold=len(self.data)).register(self.file_path, "prefix")
+        self.assertEqual([(len(self.data), len(self.data))], self.client.puts)
+        self.assertEqual(self.data, self.client.objects[("documentstore", self.object_name)])
+
+    def test_small_objects_use_the_minimum_part_size(self):
+        with open(self.file_path, "wb") as fp:
+            fp.write(b"PDF")
+        self.storage().register(self.file_path, "prefix")
+        self.assertEqual([(3, minio.MIN_PART_SIZE)], self.client.puts)
+
+    def test_big_objects_are_uploaded_in_parts(self):
+        storage = self.storage(
+            multipart_threshold=minio.MIN_PART_SIZE, part_size=minio.MIN_PART_SIZE
+        )
+        storage.register(self.file_path, "prefix")
+        self.assertEqual([(len(self.data), minio.MIN_PART_SIZE)], self.client.puts)
+        self.assertEqual(self.data, self.client.objects[("documentstore", self.object_name)])
+
+    def test_part_size_grows_to_respect_the_maximum_number_of_parts(self):
+        storage = self.storage(
+            multipart_threshold=minio.MIN_PART_SIZE, part_size=minio.MIN_PART_SIZE
+        )
+        with mock.patch.object(minio, "MAX_PARTS", 2):
+            storage.register(self.file_path, "prefix")
+        self.assertEqual(
+            [(len(self.data), math.ceil(len(self.data) / 2))], self.client.puts
+        )
+
+    def test_upload_statistics_are_recorded(self):
+        storage = self.storage()
+        storage.register(self.file_path, "prefix")
+        self.assertEqual(1, storage.uploaded_objects)
+        self.assertEqual(len(self.data), storage.uploaded_bytes)
+        with self.assertLogs("documentstore_migracao.object_store.minio") as logs:
+            storage.log_summary()
+        self.assertIn("1 objects uploaded", logs.output[0])
+
+    def test_part_size_smaller_than_minimum_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.storage(part_size=1024)
+
+
+class TestMinioStoragePickling(unittest.TestCase):
+    def test_client_is_recreated_in_other_processes(self):
+        http_client = urllib3.PoolManager(
+            timeout=20000, maxsize=16, retries=urllib3.Retry(total=5)
+        )
+        storage = minio.MinioStorage(
+            "localhost:9000", "access", "secret", minio_http_client=http_client
+        )
+        storage._client_instance = mock.Mock()
+
+        copy = pickle.loads(pickle.dumps(storage))
+
+        self.assertIsNone(copy._client_instance)
+        self.assertIsNot(http_client, copy.http_client)
+        self.assertEqual(16, copy.http_client.connection_pool_kw["maxsize"])
+        self.assertEqual(5, copy.http_client.connection_pool_kw["retries"].total)
+        with copy._stats_lock:
+            pass
@@ -1,4 +1,5 @@
 import os
+import json
 import unittest
 import tempfile
 import shutil
@@ -172,7 +173,7 @@ class TestProcessingValidation(unittest.TestCase):
             "S0036-36341997000100001.xml",
         ]
         calls = [
-            call(os.path.join(SAMPLES_PATH, file_xml), False)
+            call(os.path.join(SAMPLES_PATH, file_xml), False, content=ANY)
             for file_xml in list_files_xmls
         ]
 
@@ -180,6 +181,61 @@ class TestProcessingValidation(unittest.TestCase):
             validation.validate_article_ALLxml()
             mk_validate_article_xml.assert_has_calls(calls, any_order=True)
 
+    @patch("documentstore_migracao.processing.validation.validate_article_xml")
+    def test_validate_article_ALLxml_writes_jsonl_report(self, mk_validate_article_xml):
+        mk_validate_article_xml.side_effect = lambda path, *args, **kwargs: (
+            {
+                "Element p is not declared in p list of possible children": {
+                    "count": 2,
+                    "lineno": [410, 419],
+                    "level": ["ERROR", "ERROR"],
+                    "filename": {path},
+                    "message": [
+                        "Element p is not declared in p list of possible children",
+                        "Element p is not declared in p list of possible children",
+                    ],
+                }
+            }
+            if path.endswith("S0044-59672003000300001.pt.xml")
+            else {}
+        )
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        report_file = os.path.join(temp_dir, "validation.jsonl")
+
+        with utils.environ(
+            CONVERSION_PATH=SAMPLES_PATH, VALID_XML_PATH="", XML_ERRORS_PATH=temp_dir
+        ):
+            validation.validate_article_ALLxml(report_file=report_file)
+
+        with open(report_file) as fp:
+            records = [json.loads(line) for line in fp]
+
+        self.assertEqual(2, len(records))
+        self.assertEqual(
+            {
+                "file": os.path.join(SAMPLES_PATH, "S0044-59672003000300001.pt.xml"),
+                "line": 410,
+                "level": "ERROR",
+                "message_key": "Element p is not declared in p list of possible children",
+                "message": "Element p is not declared in p list of possible children",
+            },
+            records[0],
+        )
+        with open(os.path.join(temp_dir, "S0044-59672003000300001.err"), "rb") as fp:
+            err_content = fp.read()
+        with open(
+            os.path.join(SAMPLES_PATH, "S0044-59672003000300001.pt.xml"), "rb"
+        ) as fp:
+            self.assertTrue(err_content.startswith(fp.read()))
+        self.assertIn(
+            b"410:Element p is not declared in p list of possible children",
+            err_content,
+        )
+        self.assertFalse(
+            os.path.exists(os.path.join(temp_dir, "S0036-36341997000100001.err"))
+        )
+
     @patch("documentstore_migracao.processing.validation.validate_article_xml")
     def test_validate_article_ALLxml_with_exception(self, mk_validate_article_xml):
 
@@ -191,6 +247,45 @@ class TestProcessingValidation(unittest.TestCase):
 
                 self.assertEqual("Test Error - Validation", str(cm.exception))
 
+    def test_validation_report_records_read_errors_without_level(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        report_file = os.path.join(temp_dir, "validation.jsonl")
+        with validation.ValidationReport(report_file) as report:
+            report.add(
+                "file.xml",
+                {
+                    "some error": {
+                        "count": 1,
+                        "lineno": [1],
+                        "message": ["some error"],
+                        "filename": {"file.xml"},
+                    }
+                },
+            )
+        with open(report_file) as fp:
+            self.assertIsNone(json.loads(fp.readline())["level"])
+
+    def test_validation_report_fails_if_levels_do_not_match_messages(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        with validation.ValidationReport(
+            os.path.join(temp_dir, "validation.jsonl")
+        ) as report:
+            with self.assertRaises(ValueError):
+                report.add(
+                    "file.xml",
+                    {
+                        "some error": {
+                            "count": 2,
+                            "lineno": [1, 2],
+                            "message": ["some error", "some error"],
+                            "level": ["ERROR"],
+                            "filename": {"file.xml"},
+                        }
+                    },
+                )
+
     @patch("documentstore_migracao.processing.validation.XMLValidator")
     def test_validation_should_fail_if_lxml_raise_an_exception(self, mk_xmlvalidator):
         mk_xmlvalidator.parse.side_effect = etree.XMLSyntaxError(
@@ -2,12 +2,29 @@ import os
 import json
 import shutil
 import unittest
+import concurrent.futures
 from unittest.mock import patch, ANY, Mock
 
 from documentstore_migracao.processing import packing
 from . import utils, SAMPLES_PATH, TEMP_TEST_PATH, COUNT_SAMPLES_FILES
 
 
+def fake_materialize_file(*results):
+    """Simula ``files.materialize_file`` gravando no destino cada um dos
+    conteúdos de ``results`` ou lançando a exceção informada"""
+    results = iter(results)
+
+    def materialize_file(source, destination, mode=None):
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        with open(destination, "wb") as fp:
+            fp.write(result)
+        return destination
+
+    return materialize_file
+
+
 class TestProcessingPacking(unittest.TestCase):
 
     def test_pack_article_xml_missing_media(self):
@@ -144,6 +161,50 @@ class TestProcessingPacking(unittest.TestCase):
             mk_pack_article_xml.assert_called_with(file_xml_path=ANY, poison_pill=ANY)
             self.assertEqual(len(mk_pack_article_xml.mock_calls), COUNT_SAMPLES_FILES)
 
+    @patch("documentstore_migracao.processing.packing.DoJobsConcurrently")
+    def test_pack_article_ALLxml_with_process_executor(self, mk_do_jobs):
+        with utils.environ(
+            VALID_XML_PATH=SAMPLES_PATH,
+            PROCESSPOOL_MAX_WORKERS="3",
+            PACKING_ASSET_THREADS="2",
+        ), patch.object(packing, "ISSNs", {"0001-3714": "0001-3765"}):
+            packing.pack_article_ALLxml(executor="process")
+
+        _, kwargs = mk_do_jobs.call_args
+        self.assertEqual(3, kwargs["max_workers"])
+        self.assertEqual(
+            concurrent.futures.ProcessPoolExecutor, kwargs["executor"].func
+        )
+        self.assertEqual(
+            packing.init_packing_worker, kwargs["executor"].keywords["initializer"]
+        )
+        self.assertEqual(
+            ({"0001-3714": "0001-3765"}, None, 2),
+            kwargs["executor"].keywords["initargs"],
+        )
+        self.assertEqual(COUNT_SAMPLES_FILES, len(kwargs["jobs"]))
+
+    def test_init_packing_worker(self):
+        with patch.object(packing, "ISSNs", {}), patch.object(
+            packing, "ASSET_STORE", None
+        ), patch.object(packing, "ASSETS_EXECUTOR", None), patch(
+            "documentstore_migracao.processing.packing.multiprocessing.util.Finalize"
+        ) as mk_finalize:
+            packing.init_packing_worker({"0001-3714": "0001-3765"}, "store", 2)
+            self.assertEqual({"0001-3714": "0001-3765"}, packing.ISSNs)
+            self.assertEqual("store", packing.ASSET_STORE)
+            self.assertIsInstance(
+                packing.ASSETS_EXECUTOR, concurrent.futures.ThreadPoolExecutor
+            )
+            mk_finalize.assert_called_once_with(
+                None, packing.finish_packing, exitpriority=10
+            )
+            executor = packing.ASSETS_EXECUTOR
+            packing.finish_packing()
+            self.assertIsNone(packing.ASSETS_EXECUTOR)
+            with self.assertRaises(RuntimeError):
+                executor.submit(print)
+
 
 class TestProcessingPackingGetAsset(unittest.TestCase):
     def setUp(self):
@@ -161,9 +222,9 @@ class TestProcessingPackingGetAsset(unittest.TestCase):
     def tearDown(self):
         shutil.rmtree(TEMP_TEST_PATH)
 
-    @patch("documentstore_migracao.utils.files.read_file_binary")
-    def test_get_asset(self, read_file_binary):
-        read_file_binary.return_value = b"conteudo"
+    @patch("documentstore_migracao.utils.files.materialize_file")
+    def test_get_asset(self, mk_materialize_file):
+        mk_materialize_file.side_effect = fake_materialize_file(b"conteudo")
         old_path = "/img/en/scielobre.gif"
         new_fname = "novo"
         dest_path = TEMP_TEST_PATH
@@ -202,9 +263,9 @@ class TestProcessingPackingGetAsset(unittest.TestCase):
             pdf_new_path = os.path.join(dest_path, new_fname + ".pdf")
             self.assertTrue(os.path.exists(pdf_new_path))
 
-    @patch("documentstore_migracao.utils.files.read_file_binary")
-    def test_get_asset_in_img_folder(self, read_file_binary):
-        read_file_binary.return_value = b"conteudo img"
+    @patch("documentstore_migracao.utils.files.materialize_file")
+    def test_get_asset_in_img_folder(self, mk_materialize_file):
+        mk_materialize_file.side_effect = fake_materialize_file(b"conteudo img")
         old_path = "/img/en/scielobre.gif"
         new_fname = "novo"
         dest_path = TEMP_TEST_PATH
@@ -218,9 +279,9 @@ class TestProcessingPackingGetAsset(unittest.TestCase):
         with open(self.dest_filename_img) as fp:
             self.assertTrue(fp.read(), b"conteudo img")
 
-    @patch("documentstore_migracao.utils.files.read_file_binary")
-    def test_get_asset_in_pdf_folder(self, read_file_binary):
-        read_file_binary.return_value = b"conteudo pdf"
+    @patch("documentstore_migracao.utils.files.materialize_file")
+    def test_get_asset_in_pdf_folder(self, mk_materialize_file):
+        mk_materialize_file.side_effect = fake_materialize_file(b"conteudo pdf")
         old_path = "/pdf/en/asset.pdf"
         new_fname = "novo"
         dest_path = TEMP_TEST_PATH
@@ -234,9 +295,9 @@ class TestProcessingPackingGetAsset(unittest.TestCase):
         with open(self.dest_filename_pdf) as fp:
             self.assertTrue(fp.read(), b"conteudo pdf")
 
-    @patch("documentstore_migracao.utils.files.read_file_binary")
-    def test_get_asset_raises_AssetNotFoundError_exception(self, mk_read_file_binary):
-        mk_read_file_binary.side_effect = IOError
+    @patch("documentstore_migracao.utils.files.materialize_file")
+    def test_get_asset_raises_AssetNotFoundError_exception(self, mk_materialize_file):
+        mk_materialize_file.side_effect = IOError
         old_path = "/img/en/scielobre.gif"
         new_fname = "novo"
         dest_path = TEMP_TEST_PATH
@@ -257,9 +318,9 @@ class TestProcessingPackingGetAsset(unittest.TestCase):
         )
 
     @patch("documentstore_migracao.processing.packing.find_file")
-    @patch("documentstore_migracao.utils.files.read_file_binary")
+    @patch("documentstore_migracao.utils.files.materialize_file")
     def test_get_asset_raises_AssetNotFoundError_exception(
-            self, mk_read_file_binary, mock_find_file):
+            self, mk_materialize_file, mock_find_file):
 
         with utils.environ(
             SOURCE_PATH=SAMPLES_PATH,
@@ -269,7 +330,6 @@ class TestProcessingPackingGetAsset(unittest.TestCase):
             SOURCE_PDF_FILE=os.path.join(os.path.dirname(__file__), "samples"),
             SOURCE_IMG_FILE=os.path.join(os.path.dirname(__file__), "samples")
         ):
-            mk_read_file_binary.return_value = b""
             old_path = "/img/revistas/acron/volume/seta.gif"
             new_fname = "novo"
             dest_path = TEMP_TEST_PATH
@@ -289,8 +349,8 @@ class TestProcessingpack_PackingAssets(unittest.TestCase):
     def tearDown(self):
         shutil.rmtree(TEMP_TEST_PATH)
 
-    @patch("documentstore_migracao.utils.files.read_file_binary")
-    def test__pack_incomplete_package(self, mk_read_file_binary):
+    @patch("documentstore_migracao.utils.files.materialize_file")
+    def test__pack_incomplete_package(self, mk_materialize_file):
         asset_replacements = [
             ("/img/revistas/a01.gif", "f01"),
             ("/img/revistas/a02.gif", "f02"),
@@ -301,7 +361,9 @@ class TestProcessingpack_PackingAssets(unittest.TestCase):
         bad_pkg_path = self.bad_pkg_path
         pkg_name = "pacote_sps"
 
-        mk_read_file_binary.side_effect = [IOError("Error"), m.return_value]
+        mk_materialize_file.side_effect = fake_materialize_file(
+            IOError("Error"), m.return_value
+        )
         result_path = packing.packing_assets(
             asset_replacements, pkg_path, bad_pkg_path, pkg_name, "pid"
         )
@@ -311,8 +373,8 @@ class TestProcessingpack_PackingAssets(unittest.TestCase):
         with open(os.path.join(bad_pkg_path, pkg_name + ".err")) as fp:
             self.assertIn("/img/revistas/a01.gif f01 Not found", fp.read())
 
-    @patch("documentstore_migracao.utils.files.read_file_binary")
-    def test__pack_incomplete_package_same_dir(self, mk_read_file_binary):
+    @patch("documentstore_migracao.utils.files.materialize_file")
+    def test__pack_incomplete_package_same_dir(self, mk_materialize_file):
         asset_replacements = [
             ("/img/revistas/a01.gif", "f01"),
             ("/img/revistas/a02.gif", "f02"),
@@ -323,7 +385,9 @@ class TestProcessingpack_PackingAssets(unittest.TestCase):
         bad_pkg_path = self.good_pkg_path
         renamed_path = pkg_path + "_INCOMPLETE"
         pkg_name = "pacote_sps"
-        mk_read_file_binary.side_effect = [IOError("Error"), m.return_value]
+        mk_materialize_file.side_effect = fake_materialize_file(
+            IOError("Error"), m.return_value
+        )
         result_path = packing.packing_assets(
             asset_replacements, pkg_path, bad_pkg_path, pkg_name, "pid"
         )
@@ -333,21 +397,17 @@ class TestProcessingpack_PackingAssets(unittest.TestCase):
         with open(os.path.join(renamed_path, pkg_name + ".err")) as fp:
             self.assertIn("/img/revistas/a01.gif f01 Not found", fp.read())
 
-    @patch("documentstore_migracao.utils.files.read_file_binary")
-    def test__pack_complete_package(self, mk_read_file_binary):
+    @patch("documentstore_migracao.utils.files.materialize_file")
+    def test__pack_complete_package(self, mk_materialize_file):
         asset_replacements = [
             ("/img/revistas/a01.gif", "f01"),
             ("/img/revistas/a02.gif", "f02"),
         ]
-        mk_read_file_binary_result1 = Mock()
-        mk_read_file_binary_result1.return_value = b"conteudo"
-        mk_read_file_binary_result2 = Mock()
-        mk_read_file_binary_result2.return_value = b"conteudo"
 
         pkg_path = self.good_pkg_path
         bad_pkg_path = self.bad_pkg_path
         pkg_name = "pacote_sps"
-        mk_read_file_binary.side_effect = [mk_read_file_binary_result1.return_value, mk_read_file_binary_result2.return_value]
+        mk_materialize_file.side_effect = fake_materialize_file(b"conteudo", b"conteudo")
         result_path = packing.packing_assets(
             asset_replacements, pkg_path, bad_pkg_path, pkg_name, "pid"
         )
@@ -355,6 +415,126 @@ class TestProcessingpack_PackingAssets(unittest.TestCase):
         self.assertFalse(os.path.isdir(bad_pkg_path))
         self.assertEqual({"f01.gif", "f02.gif"}, set(os.listdir(pkg_path)))
 
+    @patch("documentstore_migracao.processing.packing.get_asset")
+    def test__pack_incomplete_package_with_assets_executor(self, mk_get_asset):
+        asset_replacements = [
+            ("/img/revistas/a%02d.gif" % index, "f%02d" % index)
+            for index in range(1, 9)
+        ]
+
+        def get_asset(old_path, new_fname, dest_path):
+            if new_fname in ("f03", "f06"):
+                raise packing.AssetNotFoundError("Not found %s" % old_path)
+            with open(os.path.join(dest_path, new_fname + ".gif"), "wb") as fp:
+                fp.write(b"conteudo")
+
+        mk_get_asset.side_effect = get_asset
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            with patch.object(packing, "ASSETS_EXECUTOR", executor):
+                result_path = packing.packing_assets(
+                    asset_replacements,
+                    self.good_pkg_path,
+                    self.bad_pkg_path,
+                    "pacote_sps",
+                    "pid",
+                )
+        self.assertEqual(result_path, self.bad_pkg_path)
+        with open(os.path.join(self.bad_pkg_path, "pacote_sps.err")) as fp:
+            errors = fp.read().splitlines()
+        self.assertEqual(2, len(errors))
+        self.assertIn("/img/revistas/a03.gif f03 Not found", errors[0])
+        self.assertIn("/img/revistas/a06.gif f06 Not found", errors[1])
+        self.assertEqual(7, len(os.listdir(self.bad_pkg_path)))
+
+
+class TestProcessingPackingStaging(unittest.TestCase):
+    def setUp(self):
+        if os.path.isdir(TEMP_TEST_PATH):
+            shutil.rmtree(TEMP_TEST_PATH)
+        os.makedirs(TEMP_TEST_PATH)
+        self.staging_path = os.path.join(TEMP_TEST_PATH, "staging")
+        self.pkg_path = os.path.join(TEMP_TEST_PATH, "good", "pacote_sps")
+        self.bad_pkg_path = os.path.join(TEMP_TEST_PATH, "bad", "pacote_sps")
+        self.environ = utils.environ(STAGING_SPS_PKG_PATH=self.staging_path)
+        self.environ.__enter__()
+
+    def tearDown(self):
+        self.environ.__exit__(None, None, None)
+        shutil.rmtree(TEMP_TEST_PATH)
+
+    def write(self, path, content=b"conteudo"):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as fp:
+            fp.write(content)
+
+    def test_make_staging_dir_records_process_id(self):
+        staging_dir = packing.make_staging_dir("pacote_sps")
+        self.assertEqual(self.staging_path, os.path.dirname(staging_dir))
+        name, pid, _ = os.path.basename(staging_dir).rsplit(".", 2)
+        self.assertEqual(("pacote_sps", str(os.getpid())), (name, pid))
+
+    def test_publish_package_replaces_previous_package(self):
+        self.write(os.path.join(self.pkg_path, "antigo.gif"))
+        staging_dir = packing.make_staging_dir("pacote_sps")
+        self.write(os.path.join(staging_dir, "novo.gif"))
+
+        result = packing.publish_package(
+            staging_dir, self.pkg_path, self.bad_pkg_path, "pacote_sps", []
+        )
+        self.assertEqual(self.pkg_path, result)
+        self.assertEqual(["novo.gif"], os.listdir(self.pkg_path))
+        self.assertFalse(os.path.exists(staging_dir))
+        self.assertEqual([], os.listdir(self.staging_path))
+
+    def test_publish_incomplete_package_removes_previous_complete_package(self):
+        self.write(os.path.join(self.pkg_path, "antigo.gif"))
+        staging_dir = packing.make_staging_dir("pacote_sps")
+        self.write(os.path.join(staging_dir, "f02.gif"))
+
+        result = packing.publish_package(
+            staging_dir,
+            self.pkg_path,
+            self.bad_pkg_path,
+            "pacote_sps",
+            [("/img/a01.gif", "f01", "Not found /img/a01.gif")],
+        )
+        self.assertEqual(self.bad_pkg_path, result)
+        self.assertFalse(os.path.exists(self.pkg_path))
+        self.assertEqual(
+            {"f02.gif", "pacote_sps.err"}, set(os.listdir(self.bad_pkg_path))
+        )
+        self.assertEqual([], os.listdir(self.staging_path))
+
+    @patch("documentstore_migracao.processing.packing.get_assets")
+    def test_packing_assets_removes_staging_dir_on_failure(self, mk_get_assets):
+        mk_get_assets.side_effect = KeyboardInterrupt
+        with self.assertRaises(KeyboardInterrupt):
+            packing.packing_assets(
+                [("/img/a01.gif", "f01")],
+                self.pkg_path,
+                self.bad_pkg_path,
+                "pacote_sps",
+                "pid",
+            )
+        self.assertEqual([], os.listdir(self.staging_path))
+        self.assertFalse(os.path.exists(self.pkg_path))
+
+    @patch("documentstore_migracao.processing.packing._process_is_alive")
+    def test_clean_stale_staging_dirs(self, mk_process_is_alive):
+        mk_process_is_alive.side_effect = lambda pid: pid == 1234
+        own = packing.make_staging_dir("proprio")
+        alive = os.path.join(self.staging_path, "vivo.1234.abc")
+        stale = os.path.join(self.staging_path, "abandonado.999999.abc")
+        unknown = os.path.join(self.staging_path, "outro")
+        for path in (alive, stale, unknown):
+            self.write(os.path.join(path, "a.gif"))
+
+        self.assertEqual([stale], packing.clean_stale_staging_dirs())
+        self.assertEqual(
+            {os.path.basename(path) for path in (own, alive, unknown)},
+            set(os.listdir(self.staging_path)),
+        )
+
 
 class TestCaseInsensitiveFind(unittest.TestCase):
 
@@ -395,6 +575,9 @@ class TestCaseInsensitiveFind(unittest.TestCase):
 
 class TestFindFile(unittest.TestCase):
 
+    def setUp(self):
+        packing.DIRECTORY_INDEX.clear()
+
     @patch("documentstore_migracao.processing.packing.os.listdir")
     def test_find_file_a18tab02M(self, mock_listdir):
         mock_listdir.return_value = [
@@ -425,3 +608,12 @@ class TestFindFile(unittest.TestCase):
         result = packing.find_file("/tmp/07t3.gif")
         self.assertEqual(expected, result)
 
+    @patch("documentstore_migracao.processing.packing.os.listdir")
+    def test_find_file_lists_directory_once(self, mock_listdir):
+        mock_listdir.return_value = ["a18tab01.gif", "A18TAB02.GIF"]
+        self.assertEqual("/tmp/a18tab01.gif", packing.find_file("/tmp/a18tab01.gif"))
+        self.assertEqual("/tmp/A18TAB02.GIF", packing.find_file("/tmp/a18tab02.gif"))
+        mock_listdir.assert_called_once_with("/tmp")
+
+    def test_find_file_returns_none_if_directory_does_not_exist(self):
+        self.assertIsNone(packing.find_file("/tmp/does-not-exist/a18tab01.gif"))
@@ -1,11 +1,14 @@
 import os
+import shutil
 import unittest
 import tempfile
+import threading
 from requests.exceptions import HTTPError
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, ANY
 from lxml import etree
 from documentstore_migracao.utils.string import normalize
 from documentstore_migracao.utils import files, xml, request, dicts, string
+from documentstore_migracao.utils import DoJobsConcurrently
 
 from . import SAMPLES_PATH, COUNT_SAMPLES_FILES
 
@@ -92,6 +95,263 @@ class TestUtilsFiles(unittest.TestCase):
         self.assertEqual("16667b1e875308e3387091fb6203a9da25e03d28", str_hash)
 
 
+class TestDirectoryIndex(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        for name in ("a01.gif", "A02.GIF", "a02.gif"):
+            with open(os.path.join(self.folder, name), "w"):
+                pass
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_get_groups_names_by_lowercase(self):
+        index = files.DirectoryIndex()
+        self.assertEqual(
+            {"a01.gif": ["a01.gif"], "a02.gif": sorted(["A02.GIF", "a02.gif"])},
+            {k: sorted(v) for k, v in index.get(self.folder).items()},
+        )
+
+    def test_get_returns_none_if_directory_does_not_exist(self):
+        index = files.DirectoryIndex()
+        self.assertIsNone(index.get(os.path.join(self.folder, "missing")))
+
+    def test_get_uses_cache_while_mtime_is_unchanged(self):
+        index = files.DirectoryIndex()
+        index.get(self.folder)
+        with patch("documentstore_migracao.utils.files.os.listdir") as mk_listdir:
+            index.get(self.folder)
+            mk_listdir.assert_not_called()
+
+    def test_get_lists_directory_again_if_mtime_changes(self):
+        index = files.DirectoryIndex()
+        index.get(self.folder)
+        with open(os.path.join(self.folder, "a03.gif"), "w"):
+            pass
+        stat = os.stat(self.folder)
+        os.utime(self.folder, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+        self.assertIn("a03.gif", index.get(self.folder))
+
+    def test_get_evicts_least_recently_used_directory(self):
+        other_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, other_folder)
+        index = files.DirectoryIndex(maxsize=1)
+        index.get(self.folder)
+        index.get(other_folder)
+        with patch(
+            "documentstore_migracao.utils.files.os.listdir", return_value=[]
+        ) as mk_listdir:
+            index.get(self.folder)
+            mk_listdir.assert_called_once_with(self.folder)
+
+
+class TestMaterializeFile(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.source = os.path.join(self.folder, "a01.tif")
+        with open(self.source, "wb") as fp:
+            fp.write(b"conteudo" * 1024)
+        self.target_folder = os.path.join(self.folder, "package")
+        os.makedirs(self.target_folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def read(self, path):
+        with open(path, "rb") as fp:
+            return fp.read()
+
+    def test_copy_into_folder(self):
+        result = files.materialize_file(self.source, self.target_folder, "copy")
+        self.assertEqual(os.path.join(self.target_folder, "a01.tif"), result)
+        self.assertEqual(self.read(self.source), self.read(result))
+        self.assertNotEqual(os.stat(self.source).st_ino, os.stat(result).st_ino)
+
+    def test_copy_falls_back_to_copyfile_if_syscalls_are_not_supported(self):
+        with patch(
+            "documentstore_migracao.utils.files.os.copy_file_range",
+            side_effect=OSError,
+            create=True,
+        ), patch(
+            "documentstore_migracao.utils.files.os.sendfile", side_effect=OSError
+        ):
+            result = files.materialize_file(self.source, self.target_folder, "copy")
+        self.assertEqual(self.read(self.source), self.read(result))
+
+    def test_short_kernel_copy_falls_back_to_copyfile(self):
+        def short_copy(src_fd, dst_fd, count, offset_src=None, offset_dst=None):
+            if offset_src:
+                return 0
+            return os.write(dst_fd, os.pread(src_fd, 10, 0))
+
+        def copyfile(source, destination):
+            with open(source, "rb") as fsrc, open(destination, "wb") as fdst:
+                fdst.write(fsrc.read())
+
+        with patch(
+            "documentstore_migracao.utils.files.os.copy_file_range",
+            side_effect=short_copy,
+            create=True,
+        ), patch(
+            "documentstore_migracao.utils.files.os.sendfile", return_value=0
+        ), patch(
+            "documentstore_migracao.utils.files.shutil.copyfile", side_effect=copyfile
+        ) as mk_copyfile:
+            result = files.materialize_file(self.source, self.target_folder, "copy")
+        mk_copyfile.assert_called_once_with(self.source, ANY)
+        self.assertEqual(self.read(self.source), self.read(result))
+
+    def test_copy_keeps_permissions(self):
+        os.chmod(self.source, 0o640)
+        result = files.materialize_file(self.source, self.target_folder, "copy")
+        self.assertEqual(0o640, os.stat(result).st_mode & 0o777)
+
+    def test_hardlink_shares_inode_with_source(self):
+        result = files.materialize_file(self.source, self.target_folder, "hardlink")
+        self.assertEqual(os.stat(self.source).st_ino, os.stat(result).st_ino)
+
+    def test_hardlink_falls_back_to_copy(self):
+        with patch(
+            "documentstore_migracao.utils.files.os.link", side_effect=OSError
+        ):
+            result = files.materialize_file(
+                self.source, self.target_folder, "hardlink"
+            )
+        self.assertNotEqual(os.stat(self.source).st_ino, os.stat(result).st_ino)
+        self.assertEqual(self.read(self.source), self.read(result))
+
+    def test_reflink_falls_back_to_copy(self):
+        with patch(
+            "documentstore_migracao.utils.files._reflink", side_effect=OSError
+        ):
+            result = files.materialize_file(self.source, self.target_folder, "reflink")
+        self.assertEqual(self.read(self.source), self.read(result))
+
+    def test_replaces_destination_without_writing_through_hardlink(self):
+        result = files.materialize_file(self.source, self.target_folder, "hardlink")
+        other = os.path.join(self.folder, "other.tif")
+        with open(other, "wb") as fp:
+            fp.write(b"outro")
+        files.materialize_file(other, result, "copy")
+        self.assertEqual(b"outro", self.read(result))
+        self.assertEqual(b"conteudo" * 1024, self.read(self.source))
+
+    def test_destination_is_created_by_rename(self):
+        with patch(
+            "documentstore_migracao.utils.files.os.replace", wraps=os.replace
+        ) as mk_replace:
+            result = files.materialize_file(self.source, self.target_folder, "copy")
+        temp_path = mk_replace.call_args[0][0]
+        self.assertEqual(self.target_folder, os.path.dirname(temp_path))
+        mk_replace.assert_called_once_with(temp_path, result)
+        self.assertEqual(["a01.tif"], os.listdir(self.target_folder))
+
+    def test_temporary_file_is_removed_if_copy_fails(self):
+        with patch(
+            "documentstore_migracao.utils.files._kernel_copy", side_effect=OSError
+        ):
+            with self.assertRaises(OSError):
+                files.materialize_file(self.source, self.target_folder, "copy")
+        self.assertEqual([], os.listdir(self.target_folder))
+
+    def test_raises_FileNotFoundError_if_source_does_not_exist(self):
+        with self.assertRaises(FileNotFoundError):
+            files.materialize_file(
+                os.path.join(self.folder, "missing.tif"), self.target_folder, "copy"
+            )
+
+    def test_raises_ValueError_for_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            files.materialize_file(self.source, self.target_folder, "symlink")
+
+
+class TestPackageFolders(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        for package in ("rsp/v47n2/a01", "rsp/v47n2/a02", "csp/v1n1/a01", "empty/v1n1"):
+            os.makedirs(os.path.join(self.folder, package))
+        for package in ("rsp/v47n2/a01", "rsp/v47n2/a02", "csp/v1n1/a01", "rsp"):
+            open(os.path.join(self.folder, package, "a.xml"), "w").close()
+        os.symlink(
+            os.path.join(self.folder, "csp"), os.path.join(self.folder, "link")
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_same_folders_as_os_walk(self):
+        self.assertEqual(
+            [root for root, _, folder_files in os.walk(self.folder) if folder_files],
+            list(files.iter_package_folders(self.folder)),
+        )
+
+    def test_folders_are_found_lazily(self):
+        with patch(
+            "documentstore_migracao.utils.files.os.scandir", wraps=os.scandir
+        ) as mk_scandir:
+            next(files.iter_package_folders(os.path.join(self.folder, "rsp")))
+            mk_scandir.assert_called_once()
+
+    def test_unreadable_folders_are_skipped(self):
+        self.assertEqual(
+            [], list(files.iter_package_folders(os.path.join(self.folder, "missing")))
+        )
+
+    def test_package_list_is_relative_to_folder(self):
+        package_list = os.path.join(self.folder, "packages.txt")
+        with open(package_list, "w") as fp:
+            fp.write("rsp/v47n2/a01\n\n/abs/a02\n")
+        self.assertEqual(
+            [os.path.join(self.folder, "rsp/v47n2/a01"), "/abs/a02"],
+            list(files.iter_package_list(package_list, self.folder)),
+        )
+
+
+class TestDoJobsConcurrently(unittest.TestCase):
+    def test_max_pending_consumes_jobs_lazily(self):
+        lock = threading.Lock()
+        state = {"produced": 0, "finished": 0, "max_pending": 0}
+
+        def jobs():
+            for index in range(50):
+                with lock:
+                    state["produced"] += 1
+                    state["max_pending"] = max(
+                        state["max_pending"], state["produced"] - state["finished"]
+                    )
+                yield {"index": index}
+
+        def func(index, poison_pill):
+            with lock:
+                state["finished"] += 1
+            return index
+
+        results = []
+        DoJobsConcurrently(
+            func,
+            jobs=jobs(),
+            max_workers=2,
+            success_callback=results.append,
+            max_pending=4,
+        )
+        self.assertEqual(list(range(50)), sorted(results))
+        self.assertLessEqual(state["max_pending"], 5)
+
+    def test_exception_callback_receives_job(self):
+        def func(index, poison_pill):
+            raise ValueError(index)
+
+        errors = []
+        DoJobsConcurrently(
+            func,
+            jobs=iter([{"index": 1}, {"index": 2}]),
+            max_workers=2,
+            exception_callback=lambda exc, job: errors.append(job["index"]),
+            max_pending=1,
+        )
+        self.assertEqual([1, 2], sorted(errors))
+
+
 class TestString(unittest.TestCase):
     def test_string_normalize_excludes_exceding_spaces(self):
         text = "<a><b>barão  </b>             \t\n<b>serão</b></a>"
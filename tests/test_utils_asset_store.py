@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from documentstore_migracao.utils import asset_store, files
+
+
+class TestAssetStore(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.source = os.path.join(self.folder, "seta.gif")
+        with open(self.source, "wb") as fp:
+            fp.write(b"GIF89a seta")
+        self.sha1 = files.sha1(self.source)
+        self.store = asset_store.AssetStore(os.path.join(self.folder, "store"))
+        self.packages = [
+            os.path.join(self.folder, "pkg%s" % index) for index in range(3)
+        ]
+        for package in self.packages:
+            os.makedirs(package)
+
+    def tearDown(self):
+        self.store.checksums.close()
+        asset_store.CHECKSUM_INDEX = None
+        shutil.rmtree(self.folder)
+
+    def test_add_stores_object_by_sha1(self):
+        self.assertEqual(self.sha1, self.store.add(self.source))
+        object_path = os.path.join(self.folder, "store", self.sha1[:2], self.sha1)
+        with open(object_path, "rb") as fp:
+            self.assertEqual(b"GIF89a seta", fp.read())
+
+    def test_add_does_not_read_the_same_source_twice(self):
+        self.store.add(self.source)
+        with patch("documentstore_migracao.utils.files.sha1") as mk_sha1:
+            self.store.add(self.source)
+            mk_sha1.assert_not_called()
+
+    def test_materialize_links_packages_to_the_same_object(self):
+        results = [
+            self.store.materialize(self.source, package) for package in self.packages
+        ]
+        inodes = {os.stat(result).st_ino for result in results}
+        self.assertEqual(
+            {os.stat(self.store.object_path(self.sha1)).st_ino}, inodes
+        )
+        self.assertEqual(
+            [os.path.join(package, "seta.gif") for package in self.packages], results
+        )
+
+    def test_materialize_records_checksum_outside_package(self):
+        result = self.store.materialize(self.source, self.packages[0])
+        self.assertEqual(["seta.gif"], os.listdir(self.packages[0]))
+        self.assertEqual(self.sha1, asset_store.known_sha1(result))
+
+    def test_checksum_is_known_after_package_is_moved(self):
+        self.store.mode = "copy"
+        self.store.materialize(self.source, self.packages[0])
+        published = os.path.join(self.folder, "published")
+        os.rename(self.packages[0], published)
+        self.assertEqual(
+            self.sha1, asset_store.known_sha1(os.path.join(published, "seta.gif"))
+        )
+
+    def test_rebuilt_package_replaces_checksum(self):
+        self.store.mode = "copy"
+        for _ in range(2):
+            result = self.store.materialize(self.source, self.packages[0])
+        self.assertEqual(self.sha1, asset_store.known_sha1(result))
+        count = (
+            self.store.checksums._connect()
+            .execute("SELECT COUNT(*) FROM checksums")
+            .fetchone()[0]
+        )
+        self.assertEqual(1, count)
+
+    def test_known_sha1_uses_asset_store_dir_in_other_processes(self):
+        result = self.store.materialize(self.source, self.packages[0])
+        asset_store.CHECKSUM_INDEX = None
+        with patch.dict(
+            os.environ, {"ASSET_STORE_DIR": os.path.join(self.folder, "store")}
+        ):
+            self.assertEqual(self.sha1, asset_store.known_sha1(result))
+        asset_store.CHECKSUM_INDEX.close()
+
+    def test_known_sha1_returns_none_without_asset_store(self):
+        result = self.store.materialize(self.source, self.packages[0])
+        asset_store.CHECKSUM_INDEX = None
+        with patch.dict(os.environ, {"ASSET_STORE_DIR": ""}):
+            self.assertIsNone(asset_store.known_sha1(result))
+
+    def test_materialize_raises_FileNotFoundError_if_source_does_not_exist(self):
+        with self.assertRaises(FileNotFoundError):
+            self.store.materialize(
+                os.path.join(self.folder, "missing.gif"), self.packages[0]
+            )
+
+    def test_known_sha1_returns_none_without_record(self):
+        self.assertIsNone(asset_store.known_sha1(self.source))
+
+    def test_known_sha1_returns_none_if_file_changed(self):
+        result = self.store.materialize(self.source, self.packages[0])
+        os.unlink(result)
+        with open(result, "wb") as fp:
+            fp.write(b"outro conteudo")
+        self.assertIsNone(asset_store.known_sha1(result))
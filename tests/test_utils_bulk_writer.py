@@ -0,0 +1,247 @@
+import threading
+import unittest
+from copy import deepcopy
+from unittest import mock
+
+from pymongo.errors import BulkWriteError
+from documentstore.domain import Journal, DocumentsBundle
+
+from documentstore_migracao.utils import bulk_writer, manifest
+from .apptesting import Session
+from . import SAMPLE_KERNEL_JOURNAL
+
+
+class FakeCollection:
+    def __init__(self):
+        self.records = {}
+        self.calls = 0
+
+    def insert_many(self, records, ordered=True):
+        assert ordered is False
+        self.calls += 1
+        errors = []
+        for index, record in enumerate(records):
+            if record["_id"] in self.records:
+                errors.append({"index": index, "code": 11000, "errmsg": "E11000"})
+            else:
+                self.records[record["_id"]] = record
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+    def bulk_write(self, requests, ordered=True):
+        assert ordered is False
+        self.calls += 1
+        for request in requests:
+            self.records[request._filter["_id"]] = request._doc
+
+
+class FakeMongoDB:
+    def __init__(self):
+        self.documents = FakeCollection()
+        self.journals = FakeCollection()
+        self.documents_bundles = FakeCollection()
+        self.changes = FakeCollection()
+
+
+def fake_instance(id):
+    instance = mock.Mock(manifest={"id": id}, data_type="application/json")
+    instance.id.return_value = id
+    instance.data_bytes.return_value = b"{}"
+    return instance
+
+
+class TestBulkWriter(unittest.TestCase):
+    def setUp(self):
+        self.mongodb = FakeMongoDB()
+        self.session = mock.Mock(_mongodb_client=self.mongodb)
+        self.writer = bulk_writer.BulkWriter(self.session, batch_size=3)
+
+    def test_entities_are_written_in_batches(self):
+        for index in range(7):
+            self.writer.add("Document", fake_instance("doc-%s" % index))
+        self.assertEqual(2, self.mongodb.documents.calls)
+        self.assertEqual(6, len(self.mongodb.documents.records))
+        self.writer.flush()
+        self.assertEqual(3, self.mongodb.documents.calls)
+        self.assertEqual(7, len(self.mongodb.documents.records))
+        self.assertEqual(3, self.mongodb.changes.calls)
+        self.assertEqual(
+            ["doc-%s" % index for index in range(7)],
+            [change["id"] for change in self.mongodb.changes.records.values()],
+        )
+
+    def test_entity_manifest_is_stored_with_id(self):
+        self.writer.add("Journal", fake_instance("0034-8910"))
+        self.writer.flush()
+        self.assertEqual(
+            {"_id": "0034-8910", "id": "0034-8910"},
+            self.mongodb.journals.records["0034-8910"],
+        )
+
+    def test_duplicates_are_reported_per_item_without_changes(self):
+        self.mongodb.documents.records["doc-1"] = {"_id": "doc-1"}
+        on_duplicate = mock.Mock()
+        self.writer.add("Document", fake_instance("doc-0"))
+        self.writer.add("Document", fake_instance("doc-1"), on_duplicate=on_duplicate)
+        self.writer.flush()
+
+        self.assertIsInstance(on_duplicate.call_args[0][0], bulk_writer.AlreadyExists)
+        self.assertEqual(
+            ["doc-0"], [change["id"] for change in self.mongodb.changes.records.values()]
+        )
+        self.assertEqual({"Document": 1, "duplicates": 1}, dict(self.writer.counts))
+
+    def test_other_write_errors_are_reported_per_item(self):
+        insert_many = self.mongodb.documents.insert_many
+
+        def fail_doc_1(records, ordered=True):
+            insert_many([r for r in records if r["_id"] != "doc-1"], ordered)
+            raise BulkWriteError(
+                {"writeErrors": [{"index": 1, "code": 121, "errmsg": "invalid"}]}
+            )
+
+        self.mongodb.documents.insert_many = fail_doc_1
+        on_written = [mock.Mock() for _ in range(3)]
+        on_error = [mock.Mock() for _ in range(3)]
+        for index in range(3):
+            self.writer.add(
+                "Document",
+                fake_instance("doc-%s" % index),
+                on_written=on_written[index],
+                on_error=on_error[index],
+            )
+
+        self.assertEqual([1, 0, 1], [callback.call_count for callback in on_written])
+        self.assertEqual([0, 1, 0], [callback.call_count for callback in on_error])
+        self.assertIsInstance(on_error[1].call_args[0][0], bulk_writer.WriteError)
+        self.assertEqual(
+            ["doc-0", "doc-2"],
+            [change["id"] for change in self.mongodb.changes.records.values()],
+        )
+        self.assertEqual({"Document": 2, "failed": 1}, dict(self.writer.counts))
+
+    def test_failed_batch_is_reported_to_every_item(self):
+        self.mongodb.documents.insert_many = mock.Mock(
+            side_effect=ConnectionError("connection lost")
+        )
+        on_error = mock.Mock()
+        self.writer.add("Document", fake_instance("doc-0"), on_error=on_error)
+        self.writer.add("Journal", fake_instance("0034-8910"))
+        self.writer.flush()
+
+        on_error.assert_called_once()
+        self.assertEqual(["0034-8910"], list(self.mongodb.journals.records))
+        self.assertEqual({"Journal": 1, "failed": 1}, dict(self.writer.counts))
+
+    def test_items_whose_changes_are_not_written_are_reported(self):
+        self.mongodb.changes.insert_many = mock.Mock(
+            side_effect=ConnectionError("connection lost")
+        )
+        on_written = mock.Mock()
+        on_error = mock.Mock()
+        self.writer.add(
+            "Document", fake_instance("doc-0"), on_written=on_written, on_error=on_error
+        )
+        self.writer.flush()
+
+        on_written.assert_not_called()
+        on_error.assert_called_once()
+
+    def test_additional_changes_are_written_after_entity_change(self):
+        document = fake_instance("doc-0")
+        renditions = fake_instance("renditions")
+        self.writer.add(
+            "Document", document, changes=[(renditions, "DocumentRendition", "doc-0")]
+        )
+        self.writer.flush()
+        changes = list(self.mongodb.changes.records.values())
+        self.assertEqual(["Document", "DocumentRendition"], [c["entity"] for c in changes])
+        self.assertEqual(["doc-0", "doc-0"], [c["id"] for c in changes])
+        self.assertLessEqual(changes[0]["timestamp"], changes[1]["timestamp"])
+
+    def test_updated_bundles_replace_existing_records(self):
+        self.mongodb.documents_bundles.records["bundle-0"] = {"_id": "bundle-0"}
+        bundle = fake_instance("bundle-0")
+        bundle.manifest = {"id": "bundle-0", "items": [{"id": "doc-0"}]}
+        self.writer.update_bundle(bundle)
+        self.writer.update_bundle(fake_instance("bundle-1"))
+        self.writer.flush()
+
+        self.assertEqual(1, self.mongodb.documents_bundles.calls)
+        self.assertEqual(
+            {"_id": "bundle-0", "id": "bundle-0", "items": [{"id": "doc-0"}]},
+            self.mongodb.documents_bundles.records["bundle-0"],
+        )
+        self.assertEqual(
+            ["bundle-0", "bundle-1"],
+            [change["id"] for change in self.mongodb.changes.records.values()],
+        )
+        self.assertEqual({"DocumentsBundle": 2}, dict(self.writer.counts))
+
+    def test_entities_added_by_many_threads_are_all_written(self):
+        threads = [
+            threading.Thread(
+                target=lambda index=index: self.writer.add(
+                    "Document", fake_instance("doc-%s" % index)
+                )
+            )
+            for index in range(20)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.writer.flush()
+        self.assertEqual(20, len(self.mongodb.documents.records))
+        self.assertEqual(20, len(self.mongodb.changes.records))
+
+
+class TestBulkWriterWithoutMongoDB(unittest.TestCase):
+    def test_entities_are_added_one_by_one(self):
+        session = Session()
+        journal = Journal(manifest=deepcopy(SAMPLE_KERNEL_JOURNAL))
+        on_duplicate = mock.Mock()
+        with bulk_writer.BulkWriter(session) as writer:
+            writer.add_journal(journal)
+            writer.add_journal(journal, on_duplicate=on_duplicate)
+
+        self.assertEqual(journal.id(), session.journals.fetch(journal.id()).id())
+        self.assertEqual(1, len(session.changes.filter()))
+        on_duplicate.assert_called_once()
+
+    def test_errors_are_reported_per_item(self):
+        session = Session()
+        journal = Journal(manifest=deepcopy(SAMPLE_KERNEL_JOURNAL))
+        on_written = mock.Mock()
+        on_error = mock.Mock()
+        with mock.patch.object(
+            bulk_writer,
+            "add_journal",
+            side_effect=[ValueError("invalid"), ValueError("invalid"), None],
+        ):
+            with bulk_writer.BulkWriter(session) as writer:
+                writer.add_journal(journal)
+                writer.add("Journal", journal, on_error=on_error)
+                writer.add("Journal", journal, on_written=on_written)
+
+        on_error.assert_called_once()
+        on_written.assert_called_once()
+        self.assertEqual({"Journal": 1, "failed": 2}, dict(writer.counts))
+
+    def test_bundles_are_updated_one_by_one(self):
+        session = Session()
+        bundle = DocumentsBundle(
+            manifest=manifest.get_document_bundle_manifest(
+                "0001-3714-1998-v29-n3", "2019-01-01T00:00:00.000000Z"
+            )
+        )
+        session.documents_bundles.add(bundle)
+        bundle.add_document({"id": "doc-1", "order": "0001"})
+        with bulk_writer.BulkWriter(session) as writer:
+            writer.update_bundle(bundle)
+
+        self.assertEqual(
+            [{"id": "doc-1", "order": "0001"}],
+            session.documents_bundles.fetch(bundle.id()).documents,
+        )
+        self.assertEqual(1, len(session.changes.filter()))
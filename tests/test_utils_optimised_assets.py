@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from documentstore_migracao.utils import optimised_assets
+
+
+class TestOptimisedAssetCache(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cache = optimised_assets.OptimisedAssetCache(self.folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_get_returns_none_for_unknown_key(self):
+        self.assertIsNone(self.cache.get(self.cache.key("abc", "png")))
+        self.assertEqual(1, self.cache.misses)
+
+    def test_put_and_get(self):
+        key = self.cache.key("abc", "png")
+        self.cache.put(key, b"PNG bytes")
+        self.assertEqual(b"PNG bytes", self.cache.get(key))
+        self.assertEqual(1, self.cache.hits)
+
+    def test_key_depends_on_kind_and_settings(self):
+        other = optimised_assets.OptimisedAssetCache(
+            self.folder, settings={"thumbnail": ("JPEG", 100, 100)}
+        )
+        keys = {
+            self.cache.key("abc", "png"),
+            self.cache.key("abc", "thumbnail"),
+            self.cache.key("abd", "png"),
+            other.key("abc", "png"),
+        }
+        self.assertEqual(4, len(keys))
+
+    def test_put_evicts_least_recently_used_objects(self):
+        cache = optimised_assets.OptimisedAssetCache(self.folder, max_size=250)
+        keys = [cache.key(str(index), "png") for index in range(3)]
+        for index, key in enumerate(keys[:2]):
+            cache.put(key, b"x" * 100)
+            os.utime(cache.object_path(key), ns=(index * 10 ** 9, index * 10 ** 9))
+
+        cache.put(keys[2], b"x" * 100)
+
+        self.assertFalse(os.path.exists(cache.object_path(keys[0])))
+        self.assertTrue(os.path.exists(cache.object_path(keys[1])))
+        self.assertTrue(os.path.exists(cache.object_path(keys[2])))
+
+    def test_put_without_max_size_does_not_evict(self):
+        keys = [self.cache.key(str(index), "png") for index in range(3)]
+        for key in keys:
+            self.cache.put(key, b"x" * 100)
+        for key in keys:
+            self.assertTrue(os.path.exists(self.cache.object_path(key)))
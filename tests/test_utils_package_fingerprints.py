@@ -0,0 +1,98 @@
+import os
+import json
+import shutil
+import pickle
+import tempfile
+import unittest
+
+from documentstore_migracao.utils import package_fingerprints
+
+
+class TestPackageFingerprints(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.source = os.path.join(self.folder, "a01.pdf")
+        self.source_dir = os.path.join(self.folder, "pdf")
+        self.target_path = os.path.join(self.folder, "out", "a01")
+        os.makedirs(self.source_dir)
+        os.makedirs(self.target_path)
+        with open(self.source, "wb") as fp:
+            fp.write(b"PDF")
+        self.fingerprints = package_fingerprints.PackageFingerprints(
+            os.path.join(self.folder, "fingerprints.db")
+        )
+        self.fingerprints.record(
+            "abc/v1n1/a01.xml",
+            "inputs",
+            {self.source: package_fingerprints.file_fingerprint(self.source)},
+            {self.source_dir: package_fingerprints.file_fingerprint(self.source_dir)},
+        )
+
+    def tearDown(self):
+        self.fingerprints.close()
+        shutil.rmtree(self.folder)
+
+    def is_up_to_date(self, inputs="inputs"):
+        return self.fingerprints.is_up_to_date(
+            "abc/v1n1/a01.xml", inputs, self.target_path
+        )
+
+    def test_unchanged_package_is_up_to_date(self):
+        self.assertTrue(self.is_up_to_date())
+
+    def test_unknown_package_is_not_up_to_date(self):
+        self.assertFalse(
+            self.fingerprints.is_up_to_date("abc/v1n1/a02.xml", "inputs", self.target_path)
+        )
+
+    def test_changed_inputs(self):
+        self.assertFalse(self.is_up_to_date("other inputs"))
+
+    def test_changed_source_file(self):
+        with open(self.source, "ab") as fp:
+            fp.write(b" changed")
+        self.assertFalse(self.is_up_to_date())
+
+    def test_recorded_fingerprints_are_not_taken_again(self):
+        self.fingerprints.record(
+            "abc/v1n1/a01.xml", "inputs", {self.source: [0, 0]}, {}
+        )
+        self.assertFalse(self.is_up_to_date())
+
+    def test_new_file_in_source_dir(self):
+        stat = os.stat(self.source_dir)
+        with open(os.path.join(self.source_dir, "en_a01.pdf"), "wb") as fp:
+            fp.write(b"PDF")
+        os.utime(self.source_dir, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertFalse(self.is_up_to_date())
+
+    def test_removed_package_folder(self):
+        shutil.rmtree(self.target_path)
+        self.assertFalse(self.is_up_to_date())
+
+    def test_forget(self):
+        self.fingerprints.forget("abc/v1n1/a01.xml")
+        self.assertFalse(self.is_up_to_date())
+
+    def test_fingerprints_persist_between_runs(self):
+        self.fingerprints.close()
+        fingerprints = pickle.loads(pickle.dumps(self.fingerprints))
+        self.assertTrue(
+            fingerprints.is_up_to_date("abc/v1n1/a01.xml", "inputs", self.target_path)
+        )
+        fingerprints.close()
+
+    def test_report(self):
+        self.fingerprints.report("abc/v1n1/a01.xml", package_fingerprints.REBUILT)
+        self.fingerprints.report("abc/v1n1/a02.xml", package_fingerprints.SKIPPED)
+        self.fingerprints.close()
+        with open(self.fingerprints.report_file) as fp:
+            entries = [json.loads(line) for line in fp]
+        self.assertEqual(
+            [
+                {"package": "abc/v1n1/a01.xml", "status": "rebuilt"},
+                {"package": "abc/v1n1/a02.xml", "status": "skipped"},
+            ],
+            entries,
+        )
+        self.assertEqual({"rebuilt": 1, "skipped": 1}, dict(self.fingerprints.counts))
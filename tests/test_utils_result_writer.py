@@ -0,0 +1,98 @@
+import io
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from documentstore_migracao.utils import result_writer
+
+
+class TestResultWriter(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.output = os.path.join(self.folder, "output.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def read_lines(self):
+        with open(self.output) as fp:
+            return fp.read().splitlines()
+
+    def test_results_are_written_as_json_lines(self):
+        with result_writer.ResultWriter(self.output) as results:
+            results.write_json({"pid_v3": "doc-1"})
+            results.write("doc-2")
+        self.assertEqual(['{"pid_v3": "doc-1"}', "doc-2"], self.read_lines())
+        self.assertEqual(2, results.lines)
+
+    def test_results_are_appended_to_existing_file(self):
+        with open(self.output, "w") as fp:
+            fp.write("doc-0\n")
+        with result_writer.ResultWriter(self.output) as results:
+            results.write("doc-1")
+        self.assertEqual(["doc-0", "doc-1"], self.read_lines())
+
+    def test_file_is_not_created_without_results(self):
+        with result_writer.ResultWriter(self.output):
+            pass
+        self.assertFalse(os.path.exists(self.output))
+
+    def test_lines_written_by_many_threads_are_not_interleaved(self):
+        with result_writer.ResultWriter(self.output) as results:
+            threads = [
+                threading.Thread(
+                    target=lambda index=index: [
+                        results.write_json({"thread": index, "line": line, "data": "x" * 500})
+                        for line in range(100)
+                    ]
+                )
+                for index in range(8)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        lines = [json.loads(line) for line in self.read_lines()]
+        self.assertEqual(800, len(lines))
+        for index in range(8):
+            self.assertEqual(
+                list(range(100)),
+                [line["line"] for line in lines if line["thread"] == index],
+            )
+
+    def test_results_are_synced_periodically(self):
+        with result_writer.ResultWriter(self.output, flush_interval=0.01) as results:
+            with mock.patch("documentstore_migracao.utils.result_writer.os.fsync") as mk_fsync:
+                results.write("doc-1")
+                deadline = time.monotonic() + 5
+                while not mk_fsync.called and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                mk_fsync.assert_called()
+            self.assertEqual(["doc-1"], self.read_lines())
+
+    def test_open_files_are_kept_open(self):
+        output = io.StringIO()
+        with result_writer.ResultWriter(output) as results:
+            results.write("http://www.scielo.br/doc-1 404 ")
+        self.assertEqual("http://www.scielo.br/doc-1 404 \n", output.getvalue())
+        self.assertFalse(output.closed)
+
+    def test_write_errors_are_raised_on_close(self):
+        output = mock.Mock()
+        output.write.side_effect = OSError("No space left on device")
+        results = result_writer.ResultWriter(output)
+        results.write("doc-1")
+        with self.assertRaises(OSError):
+            results.close()
+
+    def test_closed_writer_rejects_results(self):
+        results = result_writer.ResultWriter(self.output)
+        results.close()
+        with self.assertRaises(ValueError):
+            results.write("doc-1")
@@ -0,0 +1,153 @@
+import os
+import pickle
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from documentstore_migracao.utils import site_index
+
+
+class TestSiteIndex(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.roots = {
+            "pdf": os.path.join(self.folder, "pdf"),
+            "img": os.path.join(self.folder, "img"),
+        }
+        for path in (
+            "pdf/ABC/v1n1/a01.pdf",
+            "pdf/ABC/v1n1/en_a01.pdf",
+            "img/abc/v1n1/Fig1.JPG",
+            "img/abc/v1n1/fig1.jpg",
+            "img/abc/v1n1/fig2.tif",
+            "img/abc/v1n1/html/fig3.gif",
+        ):
+            path = os.path.join(self.folder, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as fp:
+                fp.write(b"conteudo")
+        self.path = os.path.join(self.folder, "index", "site.db")
+        self.index = site_index.SiteIndex.build(self.path, self.roots)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.folder)
+
+    def test_scan_tree_yields_acron_issue_folder_and_name(self):
+        self.assertEqual(
+            [("ABC", "v1n1", "a01.pdf"), ("ABC", "v1n1", "en_a01.pdf")],
+            sorted(site_index.scan_tree(self.roots["pdf"])),
+        )
+
+    def test_build_does_not_leave_temporary_files(self):
+        self.assertEqual(["site.db"], os.listdir(os.path.dirname(self.path)))
+
+    def test_find_ignores_case_of_acron_and_issue_folder(self):
+        self.assertEqual("ABC/v1n1/a01.pdf", self.index.find("pdf", "abc", "V1N1", "a01.pdf"))
+
+    def test_find_prefers_identical_name(self):
+        self.assertEqual("abc/v1n1/fig1.jpg", self.index.find("img", "abc", "v1n1", "fig1.jpg"))
+        self.assertEqual("abc/v1n1/Fig1.JPG", self.index.find("img", "abc", "v1n1", "Fig1.JPG"))
+
+    def test_find_returns_name_that_differs_in_case(self):
+        self.assertEqual("abc/v1n1/fig2.tif", self.index.find("img", "abc", "v1n1", "FIG2.TIF"))
+
+    def test_find_returns_none_if_file_does_not_exist(self):
+        self.assertIsNone(self.index.find("img", "abc", "v1n1", "fig9.jpg"))
+        self.assertIsNone(self.index.find("pdf", "abc", "v1n1", "fig1.jpg"))
+        self.assertIsNone(self.index.find("img", "xyz", "v1n1", "fig1.jpg"))
+
+    def test_find_files_in_subfolders(self):
+        self.assertEqual(
+            "abc/v1n1/html/fig3.gif", self.index.find("img", "abc", "v1n1", "html/fig3.gif")
+        )
+
+    def test_listdir_returns_names_and_paths(self):
+        self.assertEqual(
+            [
+                ("Fig1.JPG", "abc/v1n1/Fig1.JPG"),
+                ("fig1.jpg", "abc/v1n1/fig1.jpg"),
+                ("fig2.tif", "abc/v1n1/fig2.tif"),
+                ("html/fig3.gif", "abc/v1n1/html/fig3.gif"),
+            ],
+            sorted(self.index.listdir("img", "abc", "v1n1")),
+        )
+
+    def test_names_are_loaded_once_per_issue_folder(self):
+        first = self.index.names("img", "abc", "v1n1")
+        self.assertIs(first, self.index.names("img", "ABC", "v1n1"))
+
+    def test_names_keeps_at_most_maxsize_issue_folders(self):
+        index = site_index.SiteIndex(self.path, maxsize=1)
+        index.names("img", "abc", "v1n1")
+        index.names("pdf", "abc", "v1n1")
+        self.assertEqual([("pdf", "abc", "v1n1")], list(index._cache))
+        index.close()
+
+    def test_index_can_be_pickled(self):
+        self.index.names("img", "abc", "v1n1")
+        index = pickle.loads(pickle.dumps(self.index))
+        self.assertEqual(0, len(index._cache))
+        self.assertEqual("ABC/v1n1/a01.pdf", index.find("pdf", "abc", "v1n1", "a01.pdf"))
+        index.close()
+
+
+class TestSiteIndexOpen(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.roots = {"pdf": os.path.join(self.folder, "pdf")}
+        self.issue_folder = os.path.join(self.folder, "pdf", "abc", "v1n1")
+        os.makedirs(self.issue_folder)
+        with open(os.path.join(self.issue_folder, "a01.pdf"), "wb") as fp:
+            fp.write(b"conteudo")
+        self.age_folders()
+        self.path = os.path.join(self.folder, "site.db")
+        site_index.SiteIndex.build(self.path, self.roots).close()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def age_folders(self):
+        for folder in site_index.tree_folders(self.roots["pdf"]):
+            os.utime(folder, (0, 0))
+
+    def open(self, roots=None, **kwargs):
+        with patch.object(
+            site_index.SiteIndex, "build", wraps=site_index.SiteIndex.build
+        ) as mk_build:
+            index = site_index.SiteIndex.open(self.path, roots or self.roots, **kwargs)
+        self.addCleanup(index.close)
+        return index, mk_build.called
+
+    def test_up_to_date_index_is_reused(self):
+        index, built = self.open()
+        self.assertFalse(built)
+        self.assertEqual("abc/v1n1/a01.pdf", index.find("pdf", "abc", "v1n1", "a01.pdf"))
+
+    def test_index_is_rebuilt_on_request(self):
+        _, built = self.open(rebuild=True)
+        self.assertTrue(built)
+
+    def test_index_of_other_folders_is_rebuilt(self):
+        other = os.path.join(self.folder, "other")
+        os.makedirs(other)
+        index, built = self.open({"pdf": other})
+        self.assertTrue(built)
+        self.assertIsNone(index.find("pdf", "abc", "v1n1", "a01.pdf"))
+
+    def test_index_older_than_issue_folder_is_rebuilt(self):
+        with open(os.path.join(self.issue_folder, "a02.pdf"), "wb") as fp:
+            fp.write(b"conteudo")
+        index, built = self.open()
+        self.assertTrue(built)
+        self.assertEqual("abc/v1n1/a02.pdf", index.find("pdf", "abc", "v1n1", "a02.pdf"))
+
+    def test_index_without_roots_is_rebuilt(self):
+        connection = sqlite3.connect(self.path)
+        with connection:
+            connection.execute("DROP TABLE roots")
+        connection.close()
+        _, built = self.open()
+        self.assertTrue(built)